@@ -0,0 +1,66 @@
+import random
+
+from torch.utils.data import Sampler
+
+class BucketBatchSampler(Sampler):
+    '''
+    Batch sampler which groups images with similar number of nodes together. Instead of
+    a fixed batch size, each batch is filled until the total number of nodes (or edges of
+    the fully-connected graphs, i.e. N*(N-1) per image) reaches the budget.
+    Args:
+        node_nums: a list, the number of nodes of each image in the dataset
+           budget: int, the maximum number of nodes/edges in a batch
+      budget_type: 'edge' or 'node', what the budget is counted in
+      bucket_size: the number of shuffled images to sort by node number before packing
+          shuffle: bool, shuffle the images and the batches every epoch
+    '''
+    def __init__(self, node_nums, budget, budget_type='edge', bucket_size=1000, shuffle=True):
+        assert budget_type in ['edge', 'node'], 'budget_type should be "edge" or "node"'
+        self.node_nums = [int(n) for n in node_nums]
+        self.budget = budget
+        self.budget_type = budget_type
+        self.bucket_size = bucket_size
+        self.shuffle = shuffle
+        self._batches = None
+
+    def _cost(self, idx):
+        node_num = self.node_nums[idx]
+        if self.budget_type == 'edge':
+            return node_num * (node_num - 1)
+        return node_num
+
+    def _make_batches(self):
+        indices = list(range(len(self.node_nums)))
+        if self.shuffle:
+            random.shuffle(indices)
+
+        batches = []
+        for start in range(0, len(indices), self.bucket_size):
+            # sort inside the bucket so that neighbouring images have similar graph sizes
+            bucket = sorted(indices[start:start+self.bucket_size], key=lambda i: self.node_nums[i])
+            batch, batch_cost = [], 0
+            for idx in bucket:
+                cost = self._cost(idx)
+                # !NOTE: an image exceeding the budget on its own still makes up a batch
+                if batch and batch_cost + cost > self.budget:
+                    batches.append(batch)
+                    batch, batch_cost = [], 0
+                batch.append(idx)
+                batch_cost += cost
+            if batch:
+                batches.append(batch)
+
+        if self.shuffle:
+            random.shuffle(batches)
+        return batches
+
+    def __iter__(self):
+        # reuse the batches built by __len__() so that both agree within an epoch
+        batches = self._batches if self._batches is not None else self._make_batches()
+        self._batches = None
+        return iter(batches)
+
+    def __len__(self):
+        if self._batches is None:
+            self._batches = self._make_batches()
+        return len(self._batches)
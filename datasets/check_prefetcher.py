@@ -0,0 +1,49 @@
+import time
+import threading
+import torch
+
+from datasets.prefetcher import DataPrefetcher
+
+# Check that DataPrefetcher stops its thread when the iteration is left early, as with the
+# 'if idx == 10: break' of the training scripts, no data needed:
+#     python -m datasets.check_prefetcher
+
+def batches(num_batches, fail_at=None):
+    for i in range(num_batches):
+        if i == fail_at:
+            raise RuntimeError('loader failed')
+        yield {'features': torch.full((2, 3), float(i)), 'img_name': ['{}.jpg'.format(i)]}
+
+def check_full_pass():
+    out = [data['features'][0, 0].item() for data in DataPrefetcher(list(batches(5)), torch.device('cpu'))]
+    assert out == [0., 1., 2., 3., 4.], 'wrong batches {}'.format(out)
+
+def check_early_break(num_batches, break_at, queue_size=2):
+    def run():
+        for idx, data in enumerate(DataPrefetcher(list(batches(num_batches)), torch.device('cpu'), queue_size=queue_size)):
+            if idx == break_at:
+                # let the worker fill the queue again before leaving
+                time.sleep(0.5)
+                break
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive(), 'DataPrefetcher hangs after a break at batch {} of {}'.format(break_at, num_batches)
+
+def check_loader_error():
+    try:
+        for _ in DataPrefetcher(batches(5, fail_at=3), torch.device('cpu')):
+            pass
+    except RuntimeError as e:
+        assert str(e) == 'loader failed'
+    else:
+        raise AssertionError('the loader error was not raised')
+
+if __name__ == '__main__':
+    check_full_pass()
+    # the worker has used up the loader and is blocked on the end marker with a full queue
+    check_early_break(num_batches=3, break_at=0)
+    check_early_break(num_batches=20, break_at=10)
+    check_early_break(num_batches=3, break_at=0, queue_size=1)
+    check_loader_error()
+    print('datasets.prefetcher: ok')
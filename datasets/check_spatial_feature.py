@@ -0,0 +1,56 @@
+import argparse
+import importlib
+import numpy as np
+
+# Parity check of the vectorized calculate_spatial_feats() against calculate_spatial_feats_loop()
+# on synthetic boxes, no processed data needed:
+#     python -m datasets.check_spatial_feature
+# every module is checked, an import error fails the check unless the dataset is left out with --skip, e.g.
+#     python -m datasets.check_spatial_feature --skip vcoco
+
+MODULES = {'hico': 'datasets.hico_spatial_feature', 'vcoco': 'datasets.vcoco_spatial_feature'}
+
+def random_boxes(rng, num_boxes, im_wh, dtype=np.float32):
+    xy = rng.uniform(0, 0.8, size=(num_boxes, 2)) * im_wh
+    wh = rng.uniform(1, 0.5*min(im_wh), size=(num_boxes, 2))
+    return np.concatenate([xy, np.minimum(xy+wh, im_wh)], axis=1).astype(dtype)
+
+def check_module(module):
+    rng = np.random.RandomState(0)
+    im_wh = [640, 480]
+    cases = {
+        'N=1': random_boxes(rng, 1, im_wh),
+        'N=2': random_boxes(rng, 2, im_wh),
+        'N=7 float32': random_boxes(rng, 7, im_wh),
+        'N=7 float64': random_boxes(rng, 7, im_wh, dtype=np.float64),
+        # zero width/height give log(0) = -inf in the box1_wrt_box2 features
+        'zero-width': np.array([[10, 20, 10, 80], [30, 40, 90, 40], [0, 0, 50, 60]], dtype=np.float32),
+    }
+    for name, det_boxes in cases.items():
+        with np.errstate(divide='ignore', invalid='ignore'):
+            feats = module.calculate_spatial_feats(det_boxes, im_wh)
+            # the loop gives a shapeless array without pairs
+            loop_feats = module.calculate_spatial_feats_loop(det_boxes, im_wh).reshape(-1, 16)
+        num_boxes = det_boxes.shape[0]
+        assert feats.shape == (num_boxes*(num_boxes-1), 16), f'{name}: wrong shape {feats.shape}'
+        # the loop computes part of the features in the float32 precision of the boxes
+        assert np.allclose(feats, loop_feats, rtol=1e-4, atol=1e-4, equal_nan=True), f'{name}: features do not match'
+
+    # !NOTE: center_offset() only divides the center of box2 by the image size, this is kept on purpose
+    det_boxes = np.array([[0, 0, 100, 100], [200, 100, 400, 300]], dtype=np.float64)
+    offset = module.calculate_spatial_feats(det_boxes, [400, 200])[0, 14:]
+    assert np.allclose(offset, [50 - 300/400, 50 - 200/200]), f'center_offset precedence: got {offset}'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare calculate_spatial_feats() with calculate_spatial_feats_loop()')
+    parser.add_argument('--skip', type=str, nargs='*', default=[], choices=list(MODULES.keys()),
+                        help='datasets not to check, e.g. vcoco if the V-COCO API is not checked out: none')
+    args = parser.parse_args()
+
+    for dataset, name in MODULES.items():
+        if dataset in args.skip:
+            print(f'skip {name}')
+            continue
+        module = importlib.import_module(name)
+        check_module(module)
+        print(f'{name}: ok')
@@ -6,6 +6,7 @@ from tqdm import tqdm
 import utils.io as io
 from utils.bbox_utils import compute_iou, compute_area
 from datasets.hico_constants import HicoConstants
+from datasets.hico_gt_cache import load_gt_cache
 from datasets.metadata import coco_classes
 
 
@@ -196,8 +197,8 @@ def evaluate_boxes(data_const):
     #     'selected_coco_cls_dets.hdf5')
     select_boxes = h5py.File(data_const.boxes_scores_rpn_ids_labels)
 
-    print('Loading anno_list.json ...')
-    anno_list = io.load_json_object(data_const.anno_list_json)
+    print('Loading the gt cache of anno_list.json ...')
+    gt_cache = load_gt_cache(data_const)
 
     print('Evaluating box proposals ...')
     evaluation_stats = {
@@ -214,8 +215,7 @@ def evaluate_boxes(data_const):
 
     index_error_misses = 0
     num_images = 0
-    for anno in tqdm(anno_list):
-        global_id = anno['global_id']
+    for global_id in tqdm(gt_cache.global_ids):
         if 'test' in global_id:
             num_images += 1
         else:
@@ -251,7 +251,7 @@ def evaluate_boxes(data_const):
 
         try:
             recall_stats = box_recall(
-                anno['hois'],
+                gt_cache.image_hois(global_id),
                 all_boxes.tolist(),
                 all_boxes.tolist(),
                 data_const.iou_thresh)
@@ -296,8 +296,8 @@ def evaluate_boxes_and_labels(data_const):
     #     'selected_coco_cls_dets.hdf5')
     select_boxes = h5py.File(data_const.boxes_scores_rpn_ids_labels)
 
-    print('Loading anno_list.json ...')
-    anno_list = io.load_json_object(data_const.anno_list_json)
+    print('Loading the gt cache of anno_list.json ...')
+    gt_cache = load_gt_cache(data_const)
 
     print('Loading hoi_list.json ...')
     hoi_list = io.load_json_object(data_const.hoi_list_json)
@@ -317,8 +317,7 @@ def evaluate_boxes_and_labels(data_const):
 
     index_error_misses = 0
     num_images = 0
-    for anno in tqdm(anno_list):
-        global_id = anno['global_id']
+    for global_id in tqdm(gt_cache.global_ids):
         if 'test' in global_id:
             num_images += 1
         else:
@@ -349,7 +348,7 @@ def evaluate_boxes_and_labels(data_const):
 
         try:
             recall_stats = box_label_recall(
-                anno['hois'],
+                gt_cache.image_hois(global_id),
                 human_boxes.tolist(),
                 object_boxes.tolist(),
                 object_labels,
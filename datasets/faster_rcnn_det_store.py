@@ -0,0 +1,80 @@
+import h5py
+import numpy as np
+
+# All the Faster R-CNN outputs of a dataset in one hdf5 file, instead of 3 small files per image:
+#     boxes          [N,...]     the boxes of all the images concatenated, chunked along N
+#     scores         [N,C]
+#     nms_keep       [K]         the nms keep indices of all the images and classes concatenated
+#     global_ids     [I]         the index: image i owns
+#     box_offsets    [I+1]           rows box_offsets[i]:box_offsets[i+1] of boxes/scores
+#     keep_offsets   [I,C+1]         nms_keep[keep_offsets[i,c]:keep_offsets[i,c+1]] for class c
+# The index is written by close(), a file without it is an unfinished run.
+
+class DetStoreWriter():
+    def __init__(self, hdf5_file, chunk_rows=1024):
+        self.f = h5py.File(hdf5_file, 'w')
+        self.chunk_rows = chunk_rows
+        self.global_ids = []
+        self.box_offsets = [0]
+        self.keep_offsets = []
+        self.num_keep = 0
+
+    def _append(self, name, data):
+        if name not in self.f:
+            self.f.create_dataset(name, shape=(0,)+data.shape[1:], maxshape=(None,)+data.shape[1:], \
+                                  dtype=data.dtype, chunks=(self.chunk_rows,)+data.shape[1:])
+        dset = self.f[name]
+        start = dset.shape[0]
+        dset.resize(start+data.shape[0], axis=0)
+        dset[start:] = data
+
+    def append(self, global_id, boxes, scores, nms_keep_indices):
+        '''
+            boxes/scores of one image and its nms keep indices, a list with the kept box ids of each class
+        '''
+        self._append('boxes', np.asarray(boxes, dtype=np.float32))
+        self._append('scores', np.asarray(scores, dtype=np.float32))
+        keep = [np.asarray(ids, dtype=np.int32).reshape(-1) for ids in nms_keep_indices]
+        self._append('nms_keep', np.concatenate(keep) if len(keep) else np.zeros(0, dtype=np.int32))
+
+        self.global_ids.append(global_id)
+        self.box_offsets.append(self.box_offsets[-1] + len(boxes))
+        self.keep_offsets.append(self.num_keep + np.cumsum([0]+[len(ids) for ids in keep]))
+        self.num_keep += sum(len(ids) for ids in keep)
+
+    def close(self):
+        self.f.create_dataset('global_ids', data=np.array(self.global_ids, dtype=np.bytes_))
+        self.f.create_dataset('box_offsets', data=np.array(self.box_offsets, dtype=np.int64))
+        self.f.create_dataset('keep_offsets', data=np.array(self.keep_offsets, dtype=np.int64))
+        self.f.close()
+
+class DetStore():
+    '''
+        Read side of DetStoreWriter, the index is kept in memory and every image is one contiguous slice
+    '''
+    def __init__(self, hdf5_file):
+        self.f = h5py.File(hdf5_file, 'r')
+        assert 'global_ids' in self.f, f'{hdf5_file} has no index, the detection run was not finished'
+        self.global_ids = [global_id.decode() for global_id in self.f['global_ids'][()]]
+        self.index = {global_id: i for i, global_id in enumerate(self.global_ids)}
+        self.box_offsets = self.f['box_offsets'][()]
+        self.keep_offsets = self.f['keep_offsets'][()]
+
+    def __len__(self):
+        return len(self.global_ids)
+
+    def __contains__(self, global_id):
+        return global_id in self.index
+
+    def get(self, global_id):
+        i = self.index[global_id]
+        start, end = self.box_offsets[i], self.box_offsets[i+1]
+        boxes = self.f['boxes'][start:end]
+        scores = self.f['scores'][start:end]
+        offsets = self.keep_offsets[i]
+        keep = self.f['nms_keep'][offsets[0]:offsets[-1]]
+        nms_keep_indices = [keep[s:e].tolist() for s, e in zip(offsets[:-1]-offsets[0], offsets[1:]-offsets[0])]
+        return boxes, scores, nms_keep_indices
+
+    def close(self):
+        self.f.close()
@@ -0,0 +1,41 @@
+import torch
+import torchvision
+from PIL import Image
+from torch.utils.data import Dataset, DataLoader
+
+class ImageListDataset(Dataset):
+    '''
+        Decode the images in the DataLoader workers for the offline Faster R-CNN runs
+    '''
+    def __init__(self, image_ids, image_paths):
+        assert len(image_ids) == len(image_paths)
+        self.image_ids = image_ids
+        self.image_paths = image_paths
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def __getitem__(self, idx):
+        image = Image.open(self.image_paths[idx]).convert('RGB')
+        return self.image_ids[idx], torchvision.transforms.functional.to_tensor(image)
+
+def image_collate_fn(batch):
+    # the images have different sizes, GeneralizedRCNN.transform batches them
+    image_ids, images = zip(*batch)
+    return list(image_ids), list(images)
+
+def image_loader(image_ids, image_paths, batch_size=1, num_workers=4):
+    dataset = ImageListDataset(image_ids, image_paths)
+    return DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers, \
+                      collate_fn=image_collate_fn, pin_memory=torch.cuda.is_available())
+
+def run_detector(model, dataloader, device):
+    '''
+        Run the detector with save_feat=True on batch_size images per forward and yield (image_id, output) of every image
+    '''
+    with torch.no_grad():
+        for image_ids, images in dataloader:
+            images = [image.to(device, non_blocking=True) for image in images]
+            outputs = model(images, save_feat=True)
+            for image_id, output in zip(image_ids, outputs):
+                yield image_id, output
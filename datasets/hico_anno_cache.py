@@ -0,0 +1,127 @@
+import os
+import h5py
+import numpy as np
+from tqdm import tqdm
+import scipy.io as scio
+
+import utils.io as io
+from datasets.hico_constants import HicoConstants
+
+# Flat columnar copy of anno_bbox.mat. For each subset ('train', 'test'):
+#     filename        [I]         image file name
+#     image_size      [I,3]       width, height, depth
+#     hoi_offsets     [I+1]       rows of image i in the hoi arrays: hoi_offsets[i]:hoi_offsets[i+1]
+#     hoi_id          [P]         1-based hoi id
+#     invis           [P]
+#     human_offsets   [P+1]       rows of hoi p in human_boxes
+#     human_boxes     [*,4]       x1, y1, x2, y2 as stored in the .mat file (1-based)
+#     object_offsets  [P+1]       rows of hoi p in object_boxes
+#     object_boxes    [*,4]
+#     conn_offsets    [P+1]       rows of hoi p in connections
+#     connections     [*,2]       1-based (human, object) box index, as stored in the .mat file
+# and hoi_object_names [600], the object name of each hoi in list_action.
+# The root attributes keep the version of the layout and the sha1 of anno_bbox.mat the cache was built from,
+# the cache is rebuilt when one of them changes.
+
+ANNO_CACHE_VERSION = 1
+
+def _struct_boxes(bboxes):
+    # an hoi without boxes is stored as an empty matrix instead of a struct array
+    if bboxes.dtype.names is None or bboxes.size == 0:
+        return []
+    return [[bboxes[0,b][k][0,0] for k in ['x1', 'y1', 'x2', 'y2']] for b in range(bboxes.shape[1])]
+
+def _stack_boxes(boxes):
+    return np.array(boxes).reshape(-1, 4) if len(boxes) else np.zeros((0, 4))
+
+def convert_subset(data):
+    num_img = data.shape[1]
+    filename, image_size = [], []
+    hoi_offsets, hoi_id, invis = [0], [], []
+    human_offsets, human_boxes = [0], []
+    object_offsets, object_boxes = [0], []
+    conn_offsets, connections = [0], []
+    for i in tqdm(range(num_img)):
+        filename.append(data['filename'][0,i][0])
+        # width, height, depth
+        image_size.append([data['size'][0,i][0,0][k][0,0] for k in range(3)])
+
+        hois = data['hoi'][0,i]
+        for j in range(hois['id'].shape[1]):
+            hoi_id.append(hois['id'][0,j][0,0])
+            invis.append(hois['invis'][0,j][0,0])
+            boxes = _struct_boxes(hois['bboxhuman'][0,j])
+            human_boxes += boxes
+            human_offsets.append(human_offsets[-1] + len(boxes))
+            boxes = _struct_boxes(hois['bboxobject'][0,j])
+            object_boxes += boxes
+            object_offsets.append(object_offsets[-1] + len(boxes))
+            conn = np.asarray(hois['connection'][0,j])
+            conn = conn.tolist() if conn.ndim == 2 and conn.shape[1] == 2 else []
+            connections += conn
+            conn_offsets.append(conn_offsets[-1] + len(conn))
+        hoi_offsets.append(len(hoi_id))
+
+    return {
+        'filename': np.array(filename, dtype=np.bytes_),
+        'image_size': np.array(image_size),
+        'hoi_offsets': np.array(hoi_offsets),
+        'hoi_id': np.array(hoi_id),
+        'invis': np.array(invis),
+        'human_offsets': np.array(human_offsets),
+        'human_boxes': _stack_boxes(human_boxes),
+        'object_offsets': np.array(object_offsets),
+        'object_boxes': _stack_boxes(object_boxes),
+        'conn_offsets': np.array(conn_offsets),
+        'connections': np.array(connections, dtype=int).reshape(-1, 2),
+    }
+
+def _read_version(cache_file):
+    if not os.path.exists(cache_file):
+        return None, None
+    try:
+        with h5py.File(cache_file, 'r') as f:
+            return f.attrs.get('version', None), f.attrs.get('anno_bbox_sha1', None)
+    except OSError:
+        return None, None
+
+def build_anno_cache(anno_bbox_mat, cache_file, content_hash=None):
+    print(f'Converting {anno_bbox_mat} to {cache_file} ...')
+    if content_hash is None:
+        content_hash = io.content_hash(anno_bbox_mat)
+    anno_bbox = scio.loadmat(anno_bbox_mat)
+    # written to a temporary file first, a half written cache is never read
+    tmp_file = cache_file + '.tmp'
+    with h5py.File(tmp_file, 'w') as f:
+        list_action = anno_bbox['list_action']
+        names = [list_action['nname'][k,0][0] for k in range(list_action.shape[0])]
+        f.create_dataset('hoi_object_names', data=np.array(names, dtype=np.bytes_))
+        for subset in ['train', 'test']:
+            print(f'Converting bbox_{subset} ...')
+            group = f.create_group(subset)
+            for key, value in convert_subset(anno_bbox[f'bbox_{subset}']).items():
+                group.create_dataset(key, data=value)
+        f.attrs['version'] = ANNO_CACHE_VERSION
+        f.attrs['anno_bbox_sha1'] = content_hash
+    os.replace(tmp_file, cache_file)
+
+def load_anno_cache(data_const=HicoConstants()):
+    '''
+    Read the whole cache into memory, (re)convert anno_bbox.mat first if the cache is missing,
+    of an older version or was built from another anno_bbox.mat
+    '''
+    content_hash = io.content_hash(data_const.anno_bbox_mat)
+    version, cache_hash = _read_version(data_const.anno_bbox_cache)
+    if version != ANNO_CACHE_VERSION or cache_hash != content_hash:
+        build_anno_cache(data_const.anno_bbox_mat, data_const.anno_bbox_cache, content_hash)
+    anno_cache = {}
+    with h5py.File(data_const.anno_bbox_cache, 'r') as f:
+        anno_cache['hoi_object_names'] = [name.decode() for name in f['hoi_object_names'][()]]
+        for subset in ['train', 'test']:
+            anno_cache[subset] = {key: value[()] for key, value in f[subset].items()}
+            anno_cache[subset]['filename'] = [name.decode() for name in anno_cache[subset]['filename']]
+    return anno_cache
+
+if __name__ == '__main__':
+    data_const = HicoConstants()
+    build_anno_cache(data_const.anno_bbox_mat, data_const.anno_bbox_cache)
@@ -9,12 +9,16 @@ class HicoConstants(io.JsonSerializableClass):
             proc_dir=os.path.join(os.getcwd(),'datasets/processed/hico'),
             res_dir=os.path.join(os.getcwd(),'result/hico'),
             feat_type='fc7',
-            exp_ver ='test'):
+            exp_ver ='test',
+            feat_dtype=None):
         self.clean_dir = clean_dir
         self.proc_dir = proc_dir
         self.hico = res_dir
         self.result_dir = res_dir + '/' + exp_ver
         self.feat_type = feat_type
+        # on-disk dtype of the visual/spatial features: None(float32/float64), 'float16' or 'bfloat16'
+        self.feat_dtype = feat_dtype
+        dtype_suffix = '' if feat_dtype is None else '_' + feat_dtype
 
         # Clean constants
         self.anno_bbox_mat = os.path.join(self.clean_dir,'anno_bbox.mat')
@@ -31,7 +35,11 @@ class HicoConstants(io.JsonSerializableClass):
         self.images_dir = os.path.join(self.clean_dir,'images')
 
         # Processed constants
+        # flat columnar copy of anno_bbox.mat, need to run hico_anno_cache.py (or built on first use, rebuilt when anno_bbox.mat changes)
+        self.anno_bbox_cache = os.path.join(self.proc_dir,'anno_bbox_cache.hdf5')
         self.anno_list_json = os.path.join(self.proc_dir,'anno_list.json')
+        # memory mapped gt of anno_list.json, built on first use and when anno_list.json changes, see hico_gt_cache.py
+        self.anno_gt_cache = os.path.join(self.proc_dir,'anno_gt_cache')
         self.hoi_list_json = os.path.join(self.proc_dir,'hoi_list.json')
         self.object_list_json = os.path.join(self.proc_dir,'object_list.json')
         self.verb_list_json = os.path.join(self.proc_dir,'verb_list.json')
@@ -44,6 +52,8 @@ class HicoConstants(io.JsonSerializableClass):
         self.bin_to_hoi_ids_json = os.path.join(self.proc_dir,'bin_to_hoi_ids.json')
         # path to keep the detection from faster-rcnn
         self.faster_rcnn_boxes = os.path.join(self.proc_dir,'faster_rcnn_boxes')
+        # boxes, scores and nms keep indices of all the images, see faster_rcnn_det_store.py
+        self.faster_rcnn_det = os.path.join(self.faster_rcnn_boxes, 'faster_rcnn_det.hdf5')
         self.faster_det_fc7_feat = os.path.join(self.faster_rcnn_boxes, 'faster_rcnn_fc7.hdf5')
         self.faster_det_pool_feat = os.path.join(self.faster_rcnn_boxes, 'faster_rcnn_pool.hdf5')
 
@@ -63,15 +73,15 @@ class HicoConstants(io.JsonSerializableClass):
         self.bad_faster_rcnn_det_ids = os.path.join('result', 'bad_faster_rcnn_det_imgs.json')
         
         if self.feat_type == 'fc7':
-            self.hico_trainval_data = os.path.join(self.proc_dir, 'hico_trainval_data_fc7_edge.hdf5')
-            self.hico_test_data = os.path.join(self.proc_dir, 'hico_test_data_fc7_edge.hdf5')
+            self.hico_trainval_data = os.path.join(self.proc_dir, f'hico_trainval_data_fc7_edge{dtype_suffix}.hdf5')
+            self.hico_test_data = os.path.join(self.proc_dir, f'hico_test_data_fc7_edge{dtype_suffix}.hdf5')
         else:
-            self.hico_trainval_data = os.path.join(self.proc_dir, 'hico_trainval_data_pool.hdf5')
-            self.hico_test_data = os.path.join(self.proc_dir, 'hico_test_data_pool.hdf5')
+            self.hico_trainval_data = os.path.join(self.proc_dir, f'hico_trainval_data_pool{dtype_suffix}.hdf5')
+            self.hico_test_data = os.path.join(self.proc_dir, f'hico_test_data_pool{dtype_suffix}.hdf5')
         
         # spatial features
-        self.trainval_spatial_feat = os.path.join(self.proc_dir, 'trainval_spatial_features.hdf5')
-        self.test_spatial_feat = os.path.join(self.proc_dir, 'test_spatial_features.hdf5')
+        self.trainval_spatial_feat = os.path.join(self.proc_dir, f'trainval_spatial_features{dtype_suffix}.hdf5')
+        self.test_spatial_feat = os.path.join(self.proc_dir, f'test_spatial_features{dtype_suffix}.hdf5')
 
         # word2vec
         self.word2vec = os.path.join(self.proc_dir, 'hico_word2vec.hdf5')
@@ -18,15 +18,25 @@ class HicoDataset(Dataset):
     '''
     data_sample_count = 0   # record how many times to process data sampling 
 
-    def __init__(self, data_const=HicoConstants(), subset='train', data_aug=False, sampler=None, test=False):
+    def __init__(self, data_const=HicoConstants(), subset='train', data_aug=False, sampler=None, test=False, upcast=True, spatial_on_the_fly=False):
         super(HicoDataset, self).__init__()
         
         self.data_aug = data_aug
         self.data_const = data_const
         self.test = test
+        # if False, float16 features are returned as they are stored for half-precision models
+        self.upcast = upcast
         self.subset_ids = self._load_subset_ids(subset, sampler)
         self.sub_app_data = self._load_subset_app_data(subset)
-        self.sub_spatial_data = self._load_subset_spatial_data(subset)
+        # on-disk dtype written by hico_train_val_test_data.py/hico_spatial_feature.py --feat_dtype
+        self.app_feat_dtype = self.sub_app_data.attrs.get('feat_dtype', None)
+        # if True, return det_boxes/img_wh instead of spatial_feat and let AGRNN compute the spatial features
+        self.spatial_on_the_fly = spatial_on_the_fly
+        if spatial_on_the_fly:
+            self.img_wh = self._load_img_wh()
+        else:
+            self.sub_spatial_data = self._load_subset_spatial_data(subset)
+            self.spatial_feat_dtype = self.sub_spatial_data.attrs.get('feat_dtype', None)
         self.word2vec = h5py.File(self.data_const.word2vec, 'r')
 
     def _load_subset_ids(self, subset, sampler):
@@ -60,6 +70,24 @@ class HicoDataset(Dataset):
             print('Please double check the name of subset!!!')
             sys.exit(1)
 
+    def _load_img_wh(self):
+        # !NOTE: the saved sizes of image is [H,W], please refer to the hico_mat_to_json.py file
+        anno_list = io.load_json_object(self.data_const.anno_list_json)
+        return {item['global_id']: [item['image_size'][1], item['image_size'][0]] for item in anno_list}
+
+    def _get_spatial_data(self, data, global_id, single_app_data):
+        if self.spatial_on_the_fly:
+            data['det_boxes'] = single_app_data['boxes'][:]
+            data['img_wh'] = self.img_wh[global_id]
+        else:
+            data['spatial_feat'] = self._decode_feat(self.sub_spatial_data[global_id][:], self.spatial_feat_dtype)
+        return data
+
+    def _decode_feat(self, feat, feat_dtype):
+        if feat_dtype is None:
+            return feat
+        return io.from_storage_dtype(feat, feat_dtype, upcast=self.upcast)
+
     def _get_obj_one_hot(self,node_ids):
         num_cand = len(node_ids)
         obj_one_hot = np.zeros([num_cand,80])
@@ -91,7 +119,6 @@ class HicoDataset(Dataset):
         node_num = data['node_num']
         node_labels = data['node_labels']
         features = data['features']
-        spatial_feat = data['spatial_feat']
         node_one_hot = data['node_one_hot']
         word2vec = data['word2vec']
         keep_inds = list(set(np.where(node_labels == 1)[0]))
@@ -117,7 +144,10 @@ class HicoDataset(Dataset):
                     spatial_feat_inds.append(ind)
             data['node_num'] = len(choose_inds)
             data['features'] = features[choose_inds,:]
-            data['spatial_feat'] = spatial_feat[spatial_feat_inds,:]
+            if self.spatial_on_the_fly:
+                data['det_boxes'] = data['det_boxes'][choose_inds,:]
+            else:
+                data['spatial_feat'] = data['spatial_feat'][spatial_feat_inds,:]
             data['node_one_hot'] = node_one_hot[choose_inds,:]
             data['word2vec'] = word2vec[choose_inds,:]
             data['roi_labels'] = np.array([roi_labels[int(i)] for i in choose_inds])  # !NOTE, it is important to transfer list to np.array
@@ -132,6 +162,10 @@ class HicoDataset(Dataset):
     def displaycount():
         print("total times to process data sampling:", HicoDataset.data_sample_count)
 
+    def get_node_nums(self):
+        ''' read the node number of every image once, used by BucketBatchSampler '''
+        return [int(self.sub_app_data[global_id]['node_num'][()]) for global_id in self.subset_ids]
+
     # def get_verb_one_hot(self,hoi_ids):
     #     num_cand = len(hoi_ids)
     #     verb_one_hot = np.zeros([num_cand,len(self.verb_to_id)])
@@ -149,15 +183,14 @@ class HicoDataset(Dataset):
 
         data = {}
         single_app_data = self.sub_app_data[global_id]
-        single_spatial_data = self.sub_spatial_data[global_id]
         data['img_name'] = global_id + '.jpg'
         data['roi_labels'] = single_app_data['classes'][:]
         data['node_num'] = single_app_data['node_num'].value
         # data['node_labels'] = single_app_data['node_labels'][:]
         data['edge_labels'] = single_app_data['edge_labels'][:]
         data['edge_num'] = data['edge_labels'].shape[0]
-        data['features'] = single_app_data['feature'][:]
-        data['spatial_feat'] = single_spatial_data[:]
+        data['features'] = self._decode_feat(single_app_data['feature'][:], self.app_feat_dtype)
+        data = self._get_spatial_data(data, global_id, single_app_data)
         # data['node_one_hot'] = self._get_obj_one_hot(data['roi_labels'])
         data['word2vec'] = self._get_word2vec(data['roi_labels'])
         # data['interactive_label'] = self._get_interactive_label(data['edge_labels'])
@@ -176,7 +209,6 @@ class HicoDataset(Dataset):
     def sample_date(self, global_id):
         data = {}
         single_app_data = self.sub_app_data[global_id]
-        single_spatial_data = self.sub_spatial_data[global_id]
         data['global_id'] = global_id
         data['img_name'] = global_id + '.jpg'
         data['det_boxes'] = single_app_data['boxes'][:]
@@ -186,13 +218,15 @@ class HicoDataset(Dataset):
         # data['node_labels'] = single_app_data['node_labels'][:]
         data['edge_labels'] = single_app_data['edge_labels'][:]
         data['edge_num'] = data['edge_labels'].shape[0]
-        data['features'] = single_app_data['feature'][:]
-        data['spatial_feat'] = single_spatial_data[:]
+        data['features'] = self._decode_feat(single_app_data['feature'][:], self.app_feat_dtype)
+        data = self._get_spatial_data(data, global_id, single_app_data)
         data['node_one_hot'] = self._get_obj_one_hot(data['roi_labels'])
         data['word2vec'] = self._get_word2vec(data['roi_labels'])
         data['interactive_label'] = self._get_interactive_label(data['edge_labels'])
 
         return data
+
+
 # for DatasetLoader
 def collate_fn(batch):
     '''
@@ -202,6 +236,7 @@ def collate_fn(batch):
     batch_data['global_id'] = []
     batch_data['img_name'] = []
     batch_data['det_boxes'] = []
+    batch_data['img_wh'] = []
     batch_data['roi_labels'] = []
     batch_data['roi_scores'] = []
     batch_data['node_num'] = []
@@ -218,6 +253,12 @@ def collate_fn(batch):
             batch_data['global_id'].append(data['global_id'])
             batch_data['det_boxes'].append(data['det_boxes'])
             batch_data['roi_scores'].append(data['roi_scores'])
+        elif 'img_wh' in data.keys():
+            batch_data['det_boxes'].append(data['det_boxes'])
+        if 'img_wh' in data.keys():
+            batch_data['img_wh'].append(data['img_wh'])
+        else:
+            batch_data['spatial_feat'].append(data['spatial_feat'])
         batch_data['img_name'].append(data['img_name'])
         batch_data['roi_labels'].append(data['roi_labels'])
         batch_data['node_num'].append(data['node_num'])
@@ -225,7 +266,6 @@ def collate_fn(batch):
         batch_data['edge_labels'].append(data['edge_labels'])
         batch_data['edge_num'].append(data['edge_num'])
         batch_data['features'].append(data['features'])
-        batch_data['spatial_feat'].append(data['spatial_feat'])
         # batch_data['node_one_hot'].append(data['node_one_hot'])
         batch_data['word2vec'].append(data['word2vec'])
         # batch_data['interactive_label'].append(data['interactive_label'])
@@ -234,9 +274,66 @@ def collate_fn(batch):
     # batch_data['node_labels'] = torch.FloatTensor(np.concatenate(batch_data['node_labels'], axis=0))
     batch_data['edge_labels'] = torch.FloatTensor(np.concatenate(batch_data['edge_labels'], axis=0))
     batch_data['features'] = torch.FloatTensor(np.concatenate(batch_data['features'], axis=0))
-    batch_data['spatial_feat'] = torch.FloatTensor(np.concatenate(batch_data['spatial_feat'], axis=0))
+    # the spatial features are computed by AGRNN from det_boxes and img_wh if they are not read from the disk
+    batch_data['spatial_feat'] = torch.FloatTensor(np.concatenate(batch_data['spatial_feat'], axis=0)) if batch_data['spatial_feat'] else None
     # batch_data['node_one_hot'] = torch.FloatTensor(np.concatenate(batch_data['node_one_hot'], axis=0))
     batch_data['word2vec'] = torch.FloatTensor(np.concatenate(batch_data['word2vec'], axis=0))
     # batch_data['interactive_label'] = torch.FloatTensor(np.concatenate(batch_data['interactive_label'], axis=0))
 
-    return batch_data
\ No newline at end of file
+    return batch_data
+
+
+def light_collate_fn(batch, pin_memory=False, keep_det=False, half=False):
+    '''
+        Same outputs as collate_fn(), but the node/edge counts are computed first and the float32
+        (optionally pinned) tensors are filled in place, without concatenating float64 copies.
+        det_boxes/roi_scores/global_id are only kept when keep_det is True.
+        If half is True, features/spatial_feat/word2vec are collated into float16 tensors.
+        If the dataset computes the spatial features on the fly, spatial_feat is None and det_boxes/img_wh are always kept.
+        Use functools.partial() to set the arguments when passing it to DataLoader().
+    '''
+    feat_dtype = torch.float16 if half else torch.float32
+    node_num = [data['node_num'] for data in batch]
+    edge_num = [data['edge_num'] for data in batch]
+    on_the_fly = 'img_wh' in batch[0].keys()
+    spatial_num = [0 if on_the_fly else data['spatial_feat'].shape[0] for data in batch]
+
+    def _empty(rows, field, dtype=torch.float32):
+        return torch.empty((rows, batch[0][field].shape[1]), dtype=dtype, pin_memory=pin_memory)
+
+    batch_data = {}
+    batch_data['global_id'] = []
+    batch_data['det_boxes'] = []
+    batch_data['roi_scores'] = []
+    batch_data['img_wh'] = [data['img_wh'] for data in batch] if on_the_fly else []
+    if keep_det:
+        batch_data['global_id'] = [data['global_id'] for data in batch if 'global_id' in data.keys()]
+        batch_data['roi_scores'] = [data['roi_scores'] for data in batch if 'roi_scores' in data.keys()]
+    if keep_det or on_the_fly:
+        batch_data['det_boxes'] = [data['det_boxes'] for data in batch if 'det_boxes' in data.keys()]
+    batch_data['img_name'] = [data['img_name'] for data in batch]
+    batch_data['roi_labels'] = [data['roi_labels'] for data in batch]
+    batch_data['node_num'] = node_num
+    batch_data['edge_num'] = edge_num
+    batch_data['edge_labels'] = _empty(sum(edge_num), 'edge_labels')
+    batch_data['features'] = _empty(sum(node_num), 'features', feat_dtype)
+    batch_data['spatial_feat'] = None if on_the_fly else _empty(sum(spatial_num), 'spatial_feat', feat_dtype)
+    batch_data['word2vec'] = _empty(sum(node_num), 'word2vec', feat_dtype)
+
+    # numpy views share the memory of the tensors, the assignment casts the dtype on the fly
+    edge_labels = batch_data['edge_labels'].numpy()
+    features = batch_data['features'].numpy()
+    spatial_feat = None if on_the_fly else batch_data['spatial_feat'].numpy()
+    word2vec = batch_data['word2vec'].numpy()
+    node_start, edge_start, spatial_start = 0, 0, 0
+    for i, data in enumerate(batch):
+        edge_labels[edge_start:edge_start+edge_num[i]] = data['edge_labels']
+        features[node_start:node_start+node_num[i]] = data['features']
+        if not on_the_fly:
+            spatial_feat[spatial_start:spatial_start+spatial_num[i]] = data['spatial_feat']
+        word2vec[node_start:node_start+node_num[i]] = data['word2vec']
+        node_start += node_num[i]
+        edge_start += edge_num[i]
+        spatial_start += spatial_num[i]
+
+    return batch_data
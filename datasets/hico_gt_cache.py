@@ -0,0 +1,161 @@
+import os
+import shutil
+import numpy as np
+from tqdm import tqdm
+
+import utils.io as io
+from datasets.hico_constants import HicoConstants
+
+# Ground truth of anno_list.json as .npy files in one directory, opened with np.load(mmap_mode='r').
+# Per image (in the order of anno_list.json):
+#     global_ids      [I]         global_id of each image
+#     image_size      [I,3]       as in anno_list.json: height, width, depth
+#     hoi_offsets     [I+1]       rows of image i in the hoi arrays: hoi_offsets[i]:hoi_offsets[i+1]
+# per hoi annotation of an image:
+#     hoi_id          [P]         1-based hoi id
+#     invis           [P]
+#     human_offsets   [P+1]       rows of annotation p in human_boxes
+#     human_boxes     [*,4]
+#     object_offsets  [P+1]       rows of annotation p in object_boxes
+#     object_boxes    [*,4]
+#     conn_offsets    [P+1]       rows of annotation p in connections
+#     connections     [*,2]       0-based (human, object) box index, as in anno_list.json
+# and the (human box, object box) pairs of the connections indexed by (hoi_id, image):
+#     det_hoi_offsets [601]       rows det_hoi_offsets[k-1]:det_hoi_offsets[k] belong to hoi k
+#     det_image       [G]         image index of the pair, the rows of a hoi are sorted by it
+#     det_human_box   [G,4]
+#     det_object_box  [G,4]
+# !NOTE: like compute_map.load_gt_dets(), only the last annotation of a hoi id repeated in an image gives pairs.
+# meta.json keeps the version of the layout and the sha1 of anno_list.json the cache was built from,
+# the cache is rebuilt when one of them changes.
+
+GT_CACHE_VERSION = 1
+NUM_HOIS = 600
+GT_ARRAYS = ['global_ids', 'image_size', 'hoi_offsets', 'hoi_id', 'invis', 'human_offsets', 'human_boxes', \
+             'object_offsets', 'object_boxes', 'conn_offsets', 'connections', \
+             'det_hoi_offsets', 'det_image', 'det_human_box', 'det_object_box']
+
+def _read_meta(cache_dir):
+    meta_json = os.path.join(cache_dir, 'meta.json')
+    if not os.path.exists(meta_json):
+        return {}
+    try:
+        return io.load_json_object(meta_json)
+    except ValueError:
+        return {}
+
+def _stack_boxes(boxes):
+    return np.array(boxes).reshape(-1, 4) if len(boxes) else np.zeros((0, 4))
+
+def convert_anno_list(anno_list):
+    global_ids, image_size = [], []
+    hoi_offsets, hoi_id, invis = [0], [], []
+    human_offsets, human_boxes = [0], []
+    object_offsets, object_boxes = [0], []
+    conn_offsets, connections = [0], []
+    # (hoi index, image index, connection order) of every pair, sorted at the end
+    det_keys, det_human_box, det_object_box = [], [], []
+    for i, anno in enumerate(tqdm(anno_list)):
+        global_ids.append(anno['global_id'])
+        image_size.append(anno['image_size'])
+        last_entry = {hoi['id']: j for j, hoi in enumerate(anno['hois'])}
+        for j, hoi in enumerate(anno['hois']):
+            hoi_id.append(int(hoi['id']))
+            invis.append(hoi['invis'])
+            human_boxes += hoi['human_bboxes']
+            human_offsets.append(human_offsets[-1] + len(hoi['human_bboxes']))
+            object_boxes += hoi['object_bboxes']
+            object_offsets.append(object_offsets[-1] + len(hoi['object_bboxes']))
+            connections += hoi['connections']
+            conn_offsets.append(conn_offsets[-1] + len(hoi['connections']))
+            if last_entry[hoi['id']] != j:
+                continue
+            for human_box_num, object_box_num in hoi['connections']:
+                det_keys.append((int(hoi['id'])-1, i, len(det_keys)))
+                det_human_box.append(hoi['human_bboxes'][human_box_num])
+                det_object_box.append(hoi['object_bboxes'][object_box_num])
+        hoi_offsets.append(len(hoi_id))
+
+    det_keys = np.array(det_keys, dtype=np.int64).reshape(-1, 3)
+    order = np.lexsort((det_keys[:,2], det_keys[:,1], det_keys[:,0]))
+    det_hoi_offsets = np.searchsorted(det_keys[order,0], np.arange(NUM_HOIS+1), side='left')
+    return {
+        'global_ids': np.array(global_ids, dtype=np.bytes_),
+        'image_size': np.array(image_size),
+        'hoi_offsets': np.array(hoi_offsets),
+        'hoi_id': np.array(hoi_id, dtype=np.int16),
+        'invis': np.array(invis),
+        'human_offsets': np.array(human_offsets),
+        'human_boxes': _stack_boxes(human_boxes),
+        'object_offsets': np.array(object_offsets),
+        'object_boxes': _stack_boxes(object_boxes),
+        'conn_offsets': np.array(conn_offsets),
+        'connections': np.array(connections, dtype=int).reshape(-1, 2),
+        'det_hoi_offsets': det_hoi_offsets,
+        'det_image': det_keys[order,1].astype(np.int32),
+        'det_human_box': _stack_boxes(det_human_box)[order],
+        'det_object_box': _stack_boxes(det_object_box)[order],
+    }
+
+def build_gt_cache(anno_list_json, cache_dir, content_hash=None):
+    print(f'Converting {anno_list_json} to {cache_dir} ...')
+    if content_hash is None:
+        content_hash = io.content_hash(anno_list_json)
+    anno_list = io.load_json_object(anno_list_json)
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
+    io.mkdir_if_not_exists(cache_dir, recursive=True)
+    for key, value in convert_anno_list(anno_list).items():
+        np.save(os.path.join(cache_dir, f'{key}.npy'), value)
+    # written last, a half written cache has no meta.json and is rebuilt
+    meta = {'version': GT_CACHE_VERSION, 'anno_list_sha1': content_hash}
+    io.dump_json_object(meta, os.path.join(cache_dir, 'meta.json'))
+
+def load_gt_cache(data_const=HicoConstants()):
+    '''
+        Open the cache with memory mapping, (re)build it first if it is missing, of an older
+        version or was built from another anno_list.json
+    '''
+    content_hash = io.content_hash(data_const.anno_list_json)
+    meta = _read_meta(data_const.anno_gt_cache)
+    if meta.get('version') != GT_CACHE_VERSION or meta.get('anno_list_sha1') != content_hash:
+        build_gt_cache(data_const.anno_list_json, data_const.anno_gt_cache, content_hash)
+    return HicoGtCache(data_const.anno_gt_cache)
+
+class HicoGtCache():
+    def __init__(self, cache_dir):
+        self.data = {key: np.load(os.path.join(cache_dir, f'{key}.npy'), mmap_mode='r') for key in GT_ARRAYS}
+        self.global_ids = [global_id.decode() for global_id in self.data['global_ids']]
+        self.index = {global_id: i for i, global_id in enumerate(self.global_ids)}
+
+    def image_size(self, global_id):
+        return self.data['image_size'][self.index[global_id]]
+
+    def image_hois(self, global_id):
+        '''
+            The 'hois' of the image in anno_list.json, with arrays instead of lists
+        '''
+        data = self.data
+        i = self.index[global_id]
+        hois = []
+        for p in range(data['hoi_offsets'][i], data['hoi_offsets'][i+1]):
+            hois.append({
+                'id': str(data['hoi_id'][p]).zfill(3),
+                'human_bboxes': data['human_boxes'][data['human_offsets'][p]:data['human_offsets'][p+1]],
+                'object_bboxes': data['object_boxes'][data['object_offsets'][p]:data['object_offsets'][p+1]],
+                'connections': data['connections'][data['conn_offsets'][p]:data['conn_offsets'][p+1]],
+                'invis': int(data['invis'][p]),
+            })
+        return hois
+
+    def hoi_gt_dets(self, hoi_id):
+        '''
+            Image indices, human boxes and object boxes of all the gt pairs of one hoi ('001'-'600')
+        '''
+        k = int(hoi_id)
+        start, end = self.data['det_hoi_offsets'][k-1:k+1]
+        return self.data['det_image'][start:end], self.data['det_human_box'][start:end], self.data['det_object_box'][start:end]
+
+if __name__ == '__main__':
+    data_const = HicoConstants()
+    build_gt_cache(data_const.anno_list_json, data_const.anno_gt_cache)
@@ -4,13 +4,14 @@ import scipy.io as scio
 
 import utils.io as io
 from datasets.hico_constants import HicoConstants
+from datasets.hico_anno_cache import load_anno_cache
 
 
 class ConvertMat2Json():
     def __init__(self,const):
         self.const = const
         self.anno = scio.loadmat(self.const.anno_mat)
-        self.anno_bbox = scio.loadmat(self.const.anno_bbox_mat)
+        self.anno_bbox = load_anno_cache(self.const)
         
     def create_hoi_list(self):
         num_hoi = self.anno['list_action'].shape[0]
@@ -25,37 +26,28 @@ class ConvertMat2Json():
         return hoi_list
 
     def get_image_size(self,i,subset):
-        W = self.anno_bbox[f'bbox_{subset}'][0,i][1][0,0][0][0,0]
-        H = self.anno_bbox[f'bbox_{subset}'][0,i][1][0,0][1][0,0]
-        C = self.anno_bbox[f'bbox_{subset}'][0,i][1][0,0][2][0,0]
+        W,H,C = self.anno_bbox[subset]['image_size'][i]
         image_size = [int(v) for v in [H,W,C]]
         return image_size
 
     def get_hoi_bboxes(self,i,subset):
-        num_hois = self.anno_bbox[f'bbox_{subset}'][0,i][2].shape[1]
-        hois = [None]*num_hois
-        for j in range(num_hois):
-            hoi_data = self.anno_bbox[f'bbox_{subset}'][0,i][2][0,j]
-            
-            hoi_id = str(hoi_data[0][0,0]).zfill(3)    
-        
-            num_boxes = hoi_data[1].shape[1]
-            human_bboxes = [None]*num_boxes
-            for b in range(num_boxes):
-                human_bboxes[b] = \
-                    [int(hoi_data[1][0,b][k][0,0]-1) for k in [0,2,1,3]]
-            
-            num_boxes = hoi_data[2].shape[1]
-            object_bboxes = [None]*num_boxes
-            for b in range(num_boxes):
-                object_bboxes[b] = \
-                    [int(hoi_data[2][0,b][k][0,0]-1) for k in [0,2,1,3]]
-
-            connections = (hoi_data[3]-1).tolist()
-
-            invis = int(hoi_data[4][0,0])
-
-            hois[j] = {
+        anno_bbox = self.anno_bbox[subset]
+        start, end = anno_bbox['hoi_offsets'][i], anno_bbox['hoi_offsets'][i+1]
+        hois = [None]*(end-start)
+        for j in range(start,end):
+            hoi_id = str(anno_bbox['hoi_id'][j]).zfill(3)
+
+            boxes = anno_bbox['human_boxes'][anno_bbox['human_offsets'][j]:anno_bbox['human_offsets'][j+1]]
+            human_bboxes = [[int(v-1) for v in box] for box in boxes]
+
+            boxes = anno_bbox['object_boxes'][anno_bbox['object_offsets'][j]:anno_bbox['object_offsets'][j+1]]
+            object_bboxes = [[int(v-1) for v in box] for box in boxes]
+
+            connections = (anno_bbox['connections'][anno_bbox['conn_offsets'][j]:anno_bbox['conn_offsets'][j+1]]-1).tolist()
+
+            invis = int(anno_bbox['invis'][j])
+
+            hois[j-start] = {
                 'id': hoi_id,
                 'human_bboxes': human_bboxes,
                 'object_bboxes': object_bboxes,
@@ -7,19 +7,33 @@ from PIL import Image, ImageDraw
 import matplotlib.pyplot as plt
 import utils.io as io
 from datasets.hico_constants import HicoConstants
+from datasets.faster_rcnn_det_store import DetStoreWriter
+from datasets.faster_rcnn_loader import image_loader, run_detector
+from datasets.hico_select_confident_boxes import select_dets
 import h5py
 import json
+import argparse
 
 import torchvision
 import torch
 # from utils.vis_tool import vis_img
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run Faster R-CNN to save the object detection data of HICO-DET')
+    parser.add_argument('--batch_size', type=int, default=1,
+                        help='number of images per forward: 1')
+    parser.add_argument('--num_workers', type=int, default=4,
+                        help='number of processes decoding the images: 4')
+    parser.add_argument('--select_feat', action='store_true',
+                        help='select the confident boxes right after the detection and only save their features, \
+                              also writes selected_coco_cls_dets.hdf5 so hico_select_confident_boxes.py is not needed')
+    args = parser.parse_args()
+
     # set up model
     model = torchvision.models.detection.fasterrcnn_resnet50_fpn(pretrained=True, rpn_post_nms_top_n_test=200, \
                                                                  box_batch_size_per_image=128, box_score_thresh=0.1, box_nms_thresh=0.3)
-    device = torch.device('cuda:0')
-    model.cuda()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    model.to(device)
     model.eval()
 
     print('Begining...')
@@ -31,26 +45,37 @@ if __name__ == "__main__":
     pool_feat_hdf5 =  os.path.join(data_const.faster_rcnn_boxes,'faster_rcnn_pool.hdf5')
     fc7_feat = h5py.File(fc7_feat_hdf5, 'w')
     pool_feat = h5py.File(pool_feat_hdf5, 'w')
+    det_store = DetStoreWriter(data_const.faster_rcnn_det)
+    if args.select_feat:
+        # row i of the features belongs to row i of boxes_scores_rpn_ids instead of to proposal i
+        fc7_feat.attrs['selected_only'] = True
+        pool_feat.attrs['selected_only'] = True
+        selected_dets_hdf5 = h5py.File(data_const.boxes_scores_rpn_ids_labels, 'w')
 
-    for ind in tqdm(range(len(anno_list))):
-        save_dir = data_const.faster_rcnn_boxes
-        if not os.path.exists(save_dir):
-            os.makedirs(save_dir)
-
-        root = 'datasets/hico/images/'
-        image = Image.open(os.path.join(root, anno_list[ind]['image_path_postfix'])).convert('RGB')
-        input = torchvision.transforms.functional.to_tensor(image)
-        input = input.to(device)
-        outputs = model([input], save_feat=True)
+    root = 'datasets/hico/images/'
+    global_ids = [anno['global_id'] for anno in anno_list]
+    image_paths = [os.path.join(root, anno['image_path_postfix']) for anno in anno_list]
+    dataloader = image_loader(global_ids, image_paths, batch_size=args.batch_size, num_workers=args.num_workers)
 
+    for global_id, output in tqdm(run_detector(model, dataloader, device), total=len(global_ids)):
         # save object detection result data
-        np.save(os.path.join(save_dir, '{}_boxes.npy'.format(anno_list[ind]['global_id'])), outputs[0]['boxes'].cpu().detach().numpy())
-        np.save(os.path.join(save_dir, '{}_scores.npy'.format(anno_list[ind]['global_id'])), outputs[0]['scores'].cpu().detach().numpy())
-        nms_keep_indices_path = os.path.join(save_dir,'{}_nms_keep_indices.json'.format(anno_list[ind]['global_id']))
-        io.dump_json_object(outputs[0]['labels'], nms_keep_indices_path)
-        fc7_feat.create_dataset(anno_list[ind]['global_id'], data=outputs[0]['fc7_feat'].cpu().detach().numpy())
-        pool_feat.create_dataset(anno_list[ind]['global_id'], data=outputs[0]['pool_feat'].cpu().detach().numpy())
+        det_store.append(global_id, output['boxes'].cpu().detach().numpy(), \
+                         output['scores'].cpu().detach().numpy(), output['labels'])
+        if args.select_feat:
+            # second pass over the detections of this image: keep the features of the selected boxes only
+            selected_dets, start_end_ids = select_dets(output['boxes'].cpu().numpy(), output['scores'].cpu().numpy(), output['labels'], data_const)
+            selected_dets_hdf5.create_group(global_id)
+            selected_dets_hdf5[global_id].create_dataset('boxes_scores_rpn_ids', data=selected_dets)
+            selected_dets_hdf5[global_id].create_dataset('start_end_ids', data=start_end_ids)
+            rpn_ids = torch.as_tensor(selected_dets[:, 5], dtype=torch.long, device=output['fc7_feat'].device)
+            output['fc7_feat'] = output['fc7_feat'][rpn_ids]
+            output['pool_feat'] = output['pool_feat'][rpn_ids]
+        fc7_feat.create_dataset(global_id, data=output['fc7_feat'].cpu().detach().numpy())
+        pool_feat.create_dataset(global_id, data=output['pool_feat'].cpu().detach().numpy())
 
+    if args.select_feat:
+        selected_dets_hdf5.close()
+    det_store.close()
     fc7_feat.close()
     pool_feat.close()
     print('Make detection data successfully!')
\ No newline at end of file
@@ -1,5 +1,6 @@
 import os
 import h5py
+import argparse
 import numpy as np
 from tqdm import tqdm
 
@@ -7,6 +8,8 @@ import utils.io as io
 from datasets.hico_constants import HicoConstants
 from utils.bbox_utils import compute_area
 from datasets.metadata import coco_classes
+from utils.parallel import run_per_image
+from datasets.faster_rcnn_det_store import DetStore
 
 def select_det_ids(boxes,scores,nms_keep_ids,score_thresh,max_dets, required=False):
     if nms_keep_ids is None:
@@ -37,10 +40,7 @@ def select_det_ids(boxes,scores,nms_keep_ids,score_thresh,max_dets, required=Fal
             return []
     # Convert nms ids to box ids
     nms_ids = np.array(nms_ids,dtype=np.int32)
-    try:
-        ids = nms_keep_ids[nms_ids]
-    except:
-        import pdb; pdb.set_trace()
+    ids = nms_keep_ids[nms_ids]
 
     return ids
 
@@ -67,8 +67,8 @@ def select_dets(
                 cls_boxes,
                 cls_scores,
                 cls_nms_keep_ids,
-                data_const.human_score_thresh,
-                data_const.max_num_human,
+                exp_const.human_score_thresh,
+                exp_const.max_num_human,
                 required=True)
                 
         elif cls_name=='__background__':
@@ -76,27 +76,21 @@ def select_dets(
                 cls_boxes,
                 cls_scores,
                 cls_nms_keep_ids,
-                data_const.background_score_thresh,
-                data_const.max_num_background)
+                exp_const.background_score_thresh,
+                exp_const.max_num_background)
         else:
             select_ids = select_det_ids(
                 cls_boxes,
                 cls_scores,
                 cls_nms_keep_ids,
-                data_const.object_score_thresh,
-                data_const.max_num_objects_per_class)
-        try:
-            if len(select_ids)==0 :
-                boxes_scores_rpn_id_label = np.empty((0,7))
-        except:
-            import ipdb; ipdb.set_trace()
-
-        else:
-            boxes_scores_rpn_id_label = np.concatenate((
-                cls_boxes[select_ids],
-                np.expand_dims(cls_scores[select_ids],1),
-                np.expand_dims(select_ids,1),
-                np.expand_dims([cls_ind] * len(select_ids),1)), 1)
+                exp_const.object_score_thresh,
+                exp_const.max_num_objects_per_class)
+        # an empty select_ids gives an empty [0,7] array as well
+        boxes_scores_rpn_id_label = np.concatenate((
+            cls_boxes[select_ids],
+            np.expand_dims(cls_scores[select_ids],1),
+            np.expand_dims(select_ids,1),
+            np.expand_dims([cls_ind] * len(select_ids),1)), 1)
 
         selected_dets.append(boxes_scores_rpn_id_label)
         num_boxes = boxes_scores_rpn_id_label.shape[0]
@@ -119,8 +113,8 @@ def select_dets(
                 cls_boxes,
                 cls_scores,
                 cls_nms_keep_ids,
-                data_const.object_score_thresh,
-                data_const.max_num_objects_per_class,
+                exp_const.object_score_thresh,
+                exp_const.max_num_objects_per_class,
                 required=True)
 
             if len(select_ids)==0 :
@@ -138,43 +132,34 @@ def select_dets(
         max_score_idx = np.argmax(object_selected_dets[:,4])
         object_selected_det = object_selected_dets[max_score_idx,:]
         
-        try:
-            selected_dets = np.concatenate((selected_dets, object_selected_det[None, :]))
-            start_end_ids[int(object_selected_det[6]-1)] = [1,2]
-        except Exception as e:
-            print(e)
-            import ipdb; ipdb.set_trace()
+        selected_dets = np.concatenate((selected_dets, object_selected_det[None, :]))
+        start_end_ids[int(object_selected_det[6]-1)] = [1,2]
         
         
     return selected_dets, start_end_ids
 
 
-def select(data_const):
-    io.mkdir_if_not_exists(data_const.proc_dir)
-    
-    select_boxes_dir = data_const.proc_dir
-
-    # Print where the boxes are coming from and where the output is written
-    print(f'Boxes will be read from: {data_const.faster_rcnn_boxes}')
-    print(f'Boxes will be written to: {select_boxes_dir}')
-
-    print('Loading anno_list.json ...')
-    anno_list = io.load_json_object(data_const.anno_list_json)
-
-    print('Creating selected_coco_cls_dets.hdf5 file ...')
-    # hdf5_file = os.path.join(select_boxes_dir,'selected_coco_cls_dets_0.1eval.hdf5')
-    hdf5_file = os.path.join(select_boxes_dir,'selected_coco_cls_dets.hdf5')
-    f = h5py.File(hdf5_file,'w')
+# one open store per process, h5py file handles can not be sent to the workers
+_det_stores = {}
 
-    print('Selecting boxes ...')
-    for anno in tqdm(anno_list):
-        global_id = anno['global_id']
+def _open_det_store(hdf5_file):
+    if hdf5_file not in _det_stores:
+        _det_stores[hdf5_file] = DetStore(hdf5_file)
+    return _det_stores[hdf5_file]
 
-        # # get more detection for evaluation
-        # if 'test' in global_id:
-        #     data_const.human_score_thresh = 0.1
-        #     data_const.object_score_thresh = 0.1
+def load_and_select(global_id, data_const):
+    '''
+        Per-image job of the process pool in utils/parallel.py
+    '''
+    # # get more detection for evaluation
+    # if 'test' in global_id:
+    #     data_const.human_score_thresh = 0.1
+    #     data_const.object_score_thresh = 0.1
 
+    if os.path.exists(data_const.faster_rcnn_det):
+        boxes, scores, nms_keep_indices = _open_det_store(data_const.faster_rcnn_det).get(global_id)
+    else:
+        # per-image files written by the older hico_run_faster_rcnn.py
         boxes_npy = os.path.join(
             data_const.faster_rcnn_boxes,
             f'{global_id}_boxes.npy')
@@ -190,14 +175,42 @@ def select(data_const):
             f'{global_id}_nms_keep_indices.json')
         nms_keep_indices = io.load_json_object(nms_keep_indices_json)
 
-        # import ipdb; ipdb.set_trace()
-        selected_dets, start_end_ids = select_dets(boxes,scores,nms_keep_indices,data_const)
-        f.create_group(global_id)
-        f[global_id].create_dataset('boxes_scores_rpn_ids',data=selected_dets)
-        f[global_id].create_dataset('start_end_ids',data=start_end_ids)
-        
-    f.close()
+    return select_dets(boxes,scores,nms_keep_indices,data_const)
+
+def save_selected_dets(f, global_id, result):
+    selected_dets, start_end_ids = result
+    f.create_group(global_id)
+    f[global_id].create_dataset('boxes_scores_rpn_ids',data=selected_dets)
+    f[global_id].create_dataset('start_end_ids',data=start_end_ids)
+
+def select(data_const, num_workers=1, resume=True):
+    io.mkdir_if_not_exists(data_const.proc_dir)
+    
+    select_boxes_dir = data_const.proc_dir
+
+    # Print where the boxes are coming from and where the output is written
+    print(f'Boxes will be read from: {data_const.faster_rcnn_boxes}')
+    print(f'Boxes will be written to: {select_boxes_dir}')
+
+    print('Loading anno_list.json ...')
+    anno_list = io.load_json_object(data_const.anno_list_json)
+
+    print('Creating selected_coco_cls_dets.hdf5 file ...')
+    # hdf5_file = os.path.join(select_boxes_dir,'selected_coco_cls_dets_0.1eval.hdf5')
+    hdf5_file = os.path.join(select_boxes_dir,'selected_coco_cls_dets.hdf5')
+
+    print('Selecting boxes ...')
+    # the workers read the detections and select the boxes, the main process writes the hdf5 file
+    tasks = [(anno['global_id'], (anno['global_id'], data_const)) for anno in anno_list]
+    run_per_image(load_and_select, tasks, save_selected_dets, hdf5_file, num_workers=num_workers, resume=resume)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Select the confident boxes of the Faster R-CNN detections')
+    parser.add_argument('--num_workers', type=int, default=1,
+                        help='number of processes selecting the boxes: 1')
+    parser.add_argument('--restart', action='store_true',
+                        help='select the boxes of every image instead of resuming the previous run')
+    args = parser.parse_args()
+
     data_const = HicoConstants()
-    select(data_const)
\ No newline at end of file
+    select(data_const, num_workers=args.num_workers, resume=not args.restart)
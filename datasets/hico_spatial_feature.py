@@ -1,65 +1,13 @@
 import h5py
+import argparse
 import numpy as np 
 import scipy.io as scio
 import utils.io as io
 from datasets.hico_constants import HicoConstants
-import ipdb
+from datasets.hico_gt_cache import load_gt_cache
+from utils.parallel import run_per_image
 from tqdm import tqdm
 
-# class BoxFeatures():
-#     def __init__(self):
-#         pass
-
-#     def compute_bbox_center(self,bbox):
-#         num_boxes = bbox.shape[0]
-#         center = np.zeros([num_boxes,2])
-#         center[:,0] = 0.5*(bbox[:,0] + bbox[:,2])
-#         center[:,1] = 0.5*(bbox[:,1] + bbox[:,3])
-#         return center
-
-#     def normalize_center(self,c,im_wh):
-#         return c / im_wh
-
-#     def compute_l2_norm(self,v):
-#         return np.sqrt(np.sum(v**2))
-        
-#     def compute_bbox_wh(self,bbox):
-#         num_boxes = bbox.shape[0]
-#         wh = np.zeros([num_boxes,2])
-#         wh[:,0] = 0.5*(bbox[:,2]-bbox[:,0])
-#         wh[:,1] = 0.5*(bbox[:,3]-bbox[:,1])
-#         return wh
-
-#     def compute_offset(self,c1,c2,wh1,normalize):
-#         offset = c2 - c1
-#         if normalize:
-#             offset = offset / wh1
-#         return offset
-
-#     def compute_aspect_ratio(self,wh,take_log):
-#         aspect_ratio = wh[:,0] / (wh[:,1] + 1e-6)
-#         if take_log:
-#             aspect_ratio = np.log2(aspect_ratio+1e-6)
-#         return aspect_ratio
-
-#     def compute_bbox_size_ratio(self,wh1,wh2,take_log):
-#         ratio = (wh2[:,0]*wh2[:,1])/(wh1[:,0]*wh1[:,1])
-#         if take_log:
-#             ratio = np.log2(ratio+1e-6)
-#         return ratio
-            
-#     def compute_bbox_area(self,wh,im_wh,normalize):
-#         bbox_area = wh[:,0]*wh[:,1]
-#         if normalize:
-#             norm_factor = im_wh[:,0]*im_wh[:,1]
-#         else:
-#             norm_factor = 1
-#         bbox_area = bbox_area / norm_factor
-#         return bbox_area
-
-#     def compute_im_center(self,im_wh):
-#         return im_wh/2
-
 def center_offset(box1, box2, im_wh):
     c1 = [(box1[2]+box1[0])/2, (box1[3]+box1[1])/2]
     c2 = [(box2[2]+box2[0])/2, (box2[3]+box2[1])/2]
@@ -70,7 +18,6 @@ def box_with_respect_to_img(box, im_wh):
     '''
         To get [x1/W, y1/H, x2/W, y2/H, A_box/A_img]
     '''
-    # ipdb.set_trace()
     feats = [box[0]/(im_wh[0]+ 1e-6), box[1]/(im_wh[1]+ 1e-6), box[2]/(im_wh[0]+ 1e-6), box[3]/(im_wh[1]+ 1e-6)]
     box_area = (box[2]-box[0])*(box[3]-box[1])
     img_area = im_wh[0]*im_wh[1]
@@ -85,7 +32,7 @@ def box1_with_respect_to_box2(box1, box2):
             ]
     return feats
 
-def calculate_spatial_feats(det_boxes, im_wh):
+def calculate_spatial_feats_loop(det_boxes, im_wh):
     spatial_feats = []
     for i in range(det_boxes.shape[0]):
         for j in range(det_boxes.shape[0]):
@@ -98,38 +45,85 @@ def calculate_spatial_feats(det_boxes, im_wh):
                 box1_wrt_box2 = box1_with_respect_to_box2(det_boxes[i], det_boxes[j])
                 offset = center_offset(det_boxes[i], det_boxes[j], im_wh)
                 single_feat = single_feat + box1_wrt_img + box2_wrt_img + box1_wrt_box2 + offset.tolist()
-                # ipdb.set_trace()
                 spatial_feats.append(single_feat)
     spatial_feats = np.array(spatial_feats)
     return spatial_feats
 
+def calculate_spatial_feats(det_boxes, im_wh):
+    '''
+        Vectorized calculate_spatial_feats_loop(): the [N*(N-1), 16] features of all ordered pairs (i, j), i != j,
+        in the same row order as the double loop
+    '''
+    boxes = np.asarray(det_boxes, dtype=np.float64).reshape(-1, 4)
+    img_w, img_h = float(im_wh[0]), float(im_wh[1])
+    # i-major, j skips i
+    i_idx, j_idx = np.nonzero(~np.eye(boxes.shape[0], dtype=bool))
+
+    box_w = boxes[:,2] - boxes[:,0]
+    box_h = boxes[:,3] - boxes[:,1]
+    box_wrt_img = np.stack([boxes[:,0]/(img_w+1e-6), boxes[:,1]/(img_h+1e-6), boxes[:,2]/(img_w+1e-6), boxes[:,3]/(img_h+1e-6),
+                            box_w*box_h/(img_w*img_h+1e-6)], axis=1)
+    box1_wrt_box2 = np.stack([(boxes[i_idx,0]-boxes[j_idx,0])/(box_w[j_idx]+1e-6),
+                              (boxes[i_idx,1]-boxes[j_idx,1])/(box_h[j_idx]+1e-6),
+                              np.log(box_w[i_idx]/(box_w[j_idx]+1e-6)),
+                              np.log(box_h[i_idx]/(box_h[j_idx]+1e-6))], axis=1)
+    center = np.stack([(boxes[:,2]+boxes[:,0])/2, (boxes[:,3]+boxes[:,1])/2], axis=1)
+    # !NOTE: same precedence as center_offset(), only the center of box2 is divided by the image size
+    offset = center[i_idx] - center[j_idx]/np.array([img_w, img_h])
+    spatial_feats = np.concatenate([box_wrt_img[i_idx], box_wrt_img[j_idx], box1_wrt_box2, offset], axis=1)
+    return spatial_feats
+
+def compute_spatial_feats(global_id, det_boxes, img_wh, feat_dtype=None):
+    '''
+        Per-image job of the process pool in utils/parallel.py
+    '''
+    spatial_feats = calculate_spatial_feats(det_boxes, img_wh)
+    if feat_dtype is not None:
+        spatial_feats = io.to_storage_dtype(spatial_feats, feat_dtype)
+    return spatial_feats
+
+def save_spatial_feats(save_data, global_id, spatial_feats):
+    save_data.create_dataset(global_id, data=spatial_feats)
+
 if __name__=="__main__":
-    data_const = HicoConstants()
+    parse = argparse.ArgumentParser("Prepare the spatial features!!!")
+    parse.add_argument("--feat_dtype", type=str, default=None, choices=['float32', 'float16', 'bfloat16'],
+                        help="dtype to store the spatial features on disk, keep float64 if not set: None")
+    parse.add_argument("--num_workers", type=int, default=1,
+                        help="number of processes computing the features: 1")
+    parse.add_argument("--restart", action="store_true",
+                        help="recompute every image instead of resuming the previous run")
+    args = parse.parse_args()
+
+    data_const = HicoConstants(feat_dtype=args.feat_dtype)
 
     boxes_scores_rpn_ids_labels = h5py.File(data_const.boxes_scores_rpn_ids_labels, 'r')
     print('Load seleced boxes data file successfully...')
     split_id = io.load_json_object(data_const.split_ids_json)
-    anno_list = io.load_json_object(data_const.anno_list_json)
-    anno_dict = {item['global_id']: item for item in anno_list}
+    gt_cache = load_gt_cache(data_const)
     print('Load original data successfully!')
 
     for subset in ['train_val', 'test']:
         # create saving file
         if subset == 'train_val':
             print('Creating trainval_spatial_feat.hdf5 file....')
-            save_data = h5py.File(data_const.trainval_spatial_feat, 'w')
+            save_file = data_const.trainval_spatial_feat
         else:
             print('Creating test_spatial_feat.hdf5 file....')
-            save_data = h5py.File(data_const.test_spatial_feat, 'w')
+            save_file = data_const.test_spatial_feat
 
-        for global_id in tqdm(split_id[subset]):
+        # the finished images are skipped by run_per_image() when resuming
+        tasks = []
+        for global_id in split_id[subset]:
             selected_det_data = boxes_scores_rpn_ids_labels[global_id]['boxes_scores_rpn_ids']
             det_boxes = selected_det_data[:,:4][:]
             # !NOTE: the saved sizes of image is [H,W], please refer to the hico_mat_to_json.py file 
-            img_hw = np.array(anno_dict[global_id]["image_size"])[:2]
+            img_hw = np.array(gt_cache.image_size(global_id))[:2]
             img_wh = [img_hw[1], img_hw[0]]
-            spatial_feats = calculate_spatial_feats(det_boxes, img_wh)
-            save_data.create_dataset(global_id, data=spatial_feats)
-
-        save_data.close()
+            tasks.append((global_id, (global_id, det_boxes, img_wh, args.feat_dtype)))
+        run_per_image(compute_spatial_feats, tasks, save_spatial_feats, save_file, num_workers=args.num_workers, resume=not args.restart)
 
+        if args.feat_dtype is not None:
+            # HicoDataset reads it to decode the features
+            with h5py.File(save_file, 'a') as save_data:
+                save_data.attrs['feat_dtype'] = args.feat_dtype
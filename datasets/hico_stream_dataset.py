@@ -0,0 +1,92 @@
+import torch
+# !NOTE: IterableDataset and get_worker_info() only exist since PyTorch 1.2 (requirements.txt pins 1.1.0),
+#        this module is only imported by the training scripts when --stream is set
+try:
+    from torch.utils.data import IterableDataset, get_worker_info
+except ImportError:
+    raise ImportError('--stream needs PyTorch>=1.2 (IterableDataset), found PyTorch {}'.format(torch.__version__))
+
+import random
+
+class HicoStreamDataset(IterableDataset):
+    '''
+    Streaming variant of HicoDataset for feature stores larger than RAM (needs PyTorch>=1.2).
+    The images are read in chunks of consecutive global_ids (in store order), the chunk order is
+    shuffled every epoch and the samples are shuffled inside a bounded buffer. The chunks are sharded
+    deterministically over distributed ranks and then DataLoader workers. With several ranks the last
+    chunk is filled up and the chunk list is padded (both with images of the start of the epoch order,
+    like DistributedSampler) so that every rank reads the same number of images and runs the same
+    number of steps; with one rank every image is read exactly once per epoch. Call set_epoch() before
+    every epoch to get a different (but reproducible) order.
+    Args:
+         dataset: a HicoDataset, used to read and decode one image
+      chunk_size: number of consecutive images read in one sequential pass
+     buffer_size: size of the shuffle buffer, 0 to disable the shuffling
+            seed: base seed shared by all workers/ranks
+            rank: rank of this process, default is taken from torch.distributed if initialized
+      world_size: number of ranks, default is taken from torch.distributed if initialized
+    '''
+    def __init__(self, dataset, chunk_size=256, buffer_size=1024, seed=0, rank=None, world_size=None):
+        super(HicoStreamDataset, self).__init__()
+        self.dataset = dataset
+        self.chunk_size = chunk_size
+        self.buffer_size = buffer_size
+        self.seed = seed
+        self.epoch = 0
+        if rank is None or world_size is None:
+            if torch.distributed.is_available() and torch.distributed.is_initialized():
+                rank, world_size = torch.distributed.get_rank(), torch.distributed.get_world_size()
+            else:
+                rank, world_size = 0, 1
+        self.rank = rank
+        self.world_size = world_size
+        # !NOTE: the groups are written in sorted global_id order, reading them in that order is sequential on disk
+        order = sorted(range(len(dataset.subset_ids)), key=lambda i: dataset.subset_ids[i])
+        self.chunks = [order[i:i+chunk_size] for i in range(0, len(order), chunk_size)]
+        if world_size > 1 and self.chunks and len(self.chunks[-1]) < chunk_size:
+            # full chunks only, so that equal chunk counts mean equal image counts
+            self.chunks[-1] = self.chunks[-1] + (order * chunk_size)[:chunk_size-len(self.chunks[-1])]
+        self.num_rank_chunks = (len(self.chunks) + world_size - 1) // world_size
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _shard_chunks(self):
+        worker_info = get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info else (0, 1)
+        # same permutation on every worker/rank, padded with its first chunks to a multiple of world_size
+        chunk_ids = list(range(len(self.chunks)))
+        random.Random(self.seed + self.epoch).shuffle(chunk_ids)
+        num_padding = self.num_rank_chunks * self.world_size - len(chunk_ids)
+        chunk_ids += (chunk_ids * self.world_size)[:num_padding]
+        # every rank takes every world_size-th chunk, then each worker every num_workers-th chunk of the rank
+        rank_chunk_ids = chunk_ids[self.rank::self.world_size]
+        num_shards = self.world_size * num_workers
+        shard_id = self.rank * num_workers + worker_id
+        return rank_chunk_ids[worker_id::num_workers], random.Random((self.seed + self.epoch) * num_shards + shard_id)
+
+    def __len__(self):
+        # number of images read by this rank in one epoch, used by tqdm
+        if self.world_size == 1:
+            return len(self.dataset)
+        return self.num_rank_chunks * self.chunk_size
+
+    def __iter__(self):
+        chunk_ids, rng = self._shard_chunks()
+        buffer = []
+        for chunk_id in chunk_ids:
+            for idx in self.chunks[chunk_id]:
+                data = self.dataset[idx]
+                if self.buffer_size <= 0:
+                    yield data
+                    continue
+                if len(buffer) < self.buffer_size:
+                    buffer.append(data)
+                    continue
+                # yield a random sample of the full buffer and put the new one in its place
+                pick = rng.randrange(len(buffer))
+                buffer[pick], data = data, buffer[pick]
+                yield data
+        rng.shuffle(buffer)
+        for data in buffer:
+            yield data
@@ -10,9 +10,10 @@ import h5py
 
 from datasets import metadata
 from datasets.hico_constants import HicoConstants
+from datasets.hico_anno_cache import load_anno_cache
 import utils.io as io 
 from utils.vis_tool import vis_img, vis_img_frcnn
-from utils.bbox_utils import compute_iou
+from utils.bbox_utils import compute_iou, compute_iou_matrix
 from PIL import Image
 import matplotlib.pyplot as plt
 import matplotlib
@@ -53,11 +54,50 @@ def get_node_index(classname, bbox, det_classes, det_boxes, node_num, labeled=Tr
                 max_iou_index = i_node
     return max_iou_index
 
+def get_node_indices(classnames, bboxes, det_classes, det_boxes, labeled=True, iou_thresh=0.5):
+    '''
+    Vectorized get_node_index() for all the ground truth boxes of one image
+    Args:
+        classnames: a list, the class name of each ground truth box
+            bboxes: [M,4], the ground truth boxes
+    Returns:
+        [M] array, index of the best matched detection, -1 if there is none with IoU > iou_thresh
+    '''
+    if len(bboxes) == 0:
+        return np.zeros(0, dtype=int)
+    # !NOTE: keep the float32 precision of get_node_index() for the ground truth boxes
+    iou = compute_iou_matrix(np.array(bboxes, dtype=np.float32), det_boxes)
+    if labeled:
+        det_names = np.array(metadata.coco_classes)[det_classes]
+        iou[np.array(classnames)[:, None] != det_names[None, :]] = 0
+    # argmax keeps the first detection on ties, as the strict '>' in get_node_index()
+    max_iou_index = np.argmax(iou, axis=1)
+    max_iou = iou[np.arange(iou.shape[0]), max_iou_index]
+    return np.where(max_iou > iou_thresh, max_iou_index, -1)
+
+def assign_edge_labels(edge_labels, human_index, obj_index, action_ids, hoi_groups, labeled_edge_list, human_num):
+    '''
+    Set the edge labels of all the matched <human, object> pairs of one image at once
+    '''
+    if len(human_index) == 0:
+        return edge_labels
+    matched = np.logical_and(human_index != -1, obj_index != -1)
+    bad_human = matched & (human_index - 1 >= human_num)
+    edge_idx = labeled_edge_list[np.where(matched & ~bad_human, human_index - 1, 0)] + (obj_index - human_index - 1)
+    bad = matched & (bad_human | (edge_idx >= edge_labels.shape[0]) | (edge_idx < -edge_labels.shape[0]))
+    # !NOTE: the per-pair loop hit an IndexError here and skipped the remaining pairs of the same hoi
+    bad_count = np.cumsum(bad)
+    group_start = np.r_[0, np.flatnonzero(np.diff(hoi_groups)) + 1]
+    group_offset = np.repeat(bad_count[group_start] - bad[group_start], np.diff(np.r_[group_start, len(hoi_groups)]))
+    keep = matched & (bad_count - group_offset == 0)
+    edge_labels[edge_idx[keep], action_ids[keep]] = 1
+    return edge_labels
+
 def parse_data(data_const,args):
 
     assert os.path.exists(data_const.clean_dir), 'Please check the path to annotion file!'
 
-    anno_data = scio.loadmat(data_const.clean_dir + '/anno_bbox.mat')
+    anno_data = load_anno_cache(data_const)
     print('Load original data successfully!')
 
     boxes_scores_rpn_ids_labels = h5py.File(data_const.boxes_scores_rpn_ids_labels, 'r')
@@ -69,7 +109,7 @@ def parse_data(data_const,args):
         boxes_feat = h5py.File(data_const.faster_det_pool_feat, 'r')
     
     action_class_num = len(metadata.action_classes)
-    list_action = anno_data['list_action']
+    hoi_object_names = anno_data['hoi_object_names']
 
     # to save images with bad selected detection
     bad_dets_imgs = {'0': [], '1': [], 'no_human': []} 
@@ -77,36 +117,40 @@ def parse_data(data_const,args):
     for phase in ['bbox_train', 'bbox_test']:
 
         if not args.vis_result:
+            dtype_suffix = '' if args.feat_dtype is None else '_' + args.feat_dtype
             if phase == 'bbox_train':
                 if args.feat_type == 'fc7':
-                    print('Creating hico_trainval_data_fc7_edge.hdf5 file ...')
-                    hdf5_file = os.path.join(data_const.proc_dir,'hico_trainval_data_fc7_edge.hdf5')
+                    print(f'Creating hico_trainval_data_fc7_edge{dtype_suffix}.hdf5 file ...')
+                    hdf5_file = os.path.join(data_const.proc_dir,f'hico_trainval_data_fc7_edge{dtype_suffix}.hdf5')
                     save_data = h5py.File(hdf5_file,'w')
                 else:
-                    print('Creating hico_trainval_data_pool_edge.hdf5 file ...')
-                    hdf5_file = os.path.join(data_const.proc_dir,'hico_trainval_data_pool_edge.hdf5')
+                    print(f'Creating hico_trainval_data_pool_edge{dtype_suffix}.hdf5 file ...')
+                    hdf5_file = os.path.join(data_const.proc_dir,f'hico_trainval_data_pool_edge{dtype_suffix}.hdf5')
                     save_data = h5py.File(hdf5_file,'w')
             else:
                 if args.feat_type == 'fc7':
-                    print('Creating hico_test_data_fc7_edge.hdf5 file ...')
-                    hdf5_file = os.path.join(data_const.proc_dir,'hico_test_data_fc7_edge.hdf5')
+                    print(f'Creating hico_test_data_fc7_edge{dtype_suffix}.hdf5 file ...')
+                    hdf5_file = os.path.join(data_const.proc_dir,f'hico_test_data_fc7_edge{dtype_suffix}.hdf5')
                     save_data = h5py.File(hdf5_file,'w')
                 else:
-                    print('Creating hico_test_data_pool_edge.hdf5 file ...')
-                    hdf5_file = os.path.join(data_const.proc_dir,'hico_test_data_pool_edge.hdf5')
+                    print(f'Creating hico_test_data_pool_edge{dtype_suffix}.hdf5 file ...')
+                    hdf5_file = os.path.join(data_const.proc_dir,f'hico_test_data_pool_edge{dtype_suffix}.hdf5')
                     save_data = h5py.File(hdf5_file,'w')
+            if args.feat_dtype is not None:
+                # HicoDataset reads it to decode the features
+                save_data.attrs['feat_dtype'] = args.feat_dtype
 
-        data = anno_data[phase]
+        data = anno_data[phase.split('_')[1]]
         if args.vis_result:
             # img_list = [1761,23,44,50,53,72,75,79,93,109,127,129,138,139,490,496]
-            img_list = [14663] #range(data.shape[1])
+            img_list = [14663] #range(len(data['filename']))
         else:
-            img_list = range(data.shape[1])
+            img_list = range(len(data['filename']))
 
         for i_img in tqdm(img_list):
             # load detection data
             # ipdb.set_trace()
-            img_name = data['filename'][0,i_img][0]
+            img_name = data['filename'][i_img]
             global_id = img_name.split(".")[0]
             selected_det_data = boxes_scores_rpn_ids_labels[global_id]['boxes_scores_rpn_ids']
             det_feat = boxes_feat[global_id]
@@ -117,15 +161,11 @@ def parse_data(data_const,args):
             if selected_det_data.shape[0] == 1:
                 bad_dets_imgs['1'].append(global_id)
                 continue
-            # TypeError: Indexing elements must be in increasing order
-            # det_feat = det_feat[selected_det_data[:, 5], :]
-            feat = []
-            for rpn_id in selected_det_data[:, 5]:
-                feat.append(np.expand_dims(det_feat[rpn_id, :], 0))
-            try:
-                feat = np.concatenate(feat, axis=0)
-            except Exception as e:
-                ipdb.set_trace()
+            if boxes_feat.attrs.get('selected_only', False):
+                # hico_run_faster_rcnn.py --select_feat only saved the features of the selected boxes, in the same order
+                feat = det_feat[()]
+            else:
+                feat = io.read_rows(det_feat, selected_det_data[:, 5])
             det_boxes = selected_det_data[:, :4]
             det_class = selected_det_data[:, -1].astype(int)
             det_scores = selected_det_data[:, 4]
@@ -154,38 +194,38 @@ def parse_data(data_const,args):
                 image_gt = Image.open(os.path.join(data_const.clean_dir, 'images/train2015', img_name)).convert('RGB')
                 raw_action = np.zeros(117)
 
-            for i_hoi in range(data['hoi'][0,i_img]['id'].shape[1]):
-                try:
-                    for j_h in range(data['hoi'][0, i_img]['bboxhuman'][0, i_hoi]['x1'].shape[1]):
-
-                        hoi_id = data['hoi'][0, i_img]['id'][0, i_hoi][0, 0]
-                        action_id = metadata.hoi_to_action[hoi_id - 1]  # !NOTE: Need to subtract 1 
-
-                        # ipdb.set_trace()
-                        classname = 'person'
-                        h_x1 = data['hoi'][0, i_img]['bboxhuman'][0, i_hoi]['x1'][0, j_h][0, 0]
-                        h_y1 = data['hoi'][0, i_img]['bboxhuman'][0, i_hoi]['y1'][0, j_h][0, 0]
-                        h_x2 = data['hoi'][0, i_img]['bboxhuman'][0, i_hoi]['x2'][0, j_h][0, 0]
-                        h_y2 = data['hoi'][0, i_img]['bboxhuman'][0, i_hoi]['y2'][0, j_h][0, 0]
-                        human_index = get_node_index(classname, [h_x1, h_y1, h_x2, h_y2], det_class, det_boxes, node_num, labeled=args.labeled)
-
-                        j_o = data['hoi'][0, i_img]['connection'][0,i_hoi][j_h][1] - 1
-                        classname = list_action['nname'][hoi_id-1, 0][0]    # !NOTE: Need to subtract 1
-                        o_x1 = data['hoi'][0, i_img]['bboxobject'][0, i_hoi]['x1'][0, j_o][0, 0]
-                        o_y1 = data['hoi'][0, i_img]['bboxobject'][0, i_hoi]['y1'][0, j_o][0, 0]
-                        o_x2 = data['hoi'][0, i_img]['bboxobject'][0, i_hoi]['x2'][0, j_o][0, 0]
-                        o_y2 = data['hoi'][0, i_img]['bboxobject'][0, i_hoi]['y2'][0, j_o][0, 0]
-                        obj_index = get_node_index(classname, [o_x1, o_y1, o_x2, o_y2], det_class, det_boxes, node_num, labeled=args.labeled)
-
-                        if args.vis_result:
-                            raw_action[action_id] = 1
-                            image_gt = vis_img(image_gt, [[h_x1, h_y1, h_x2, h_y2],[o_x1, o_y1, o_x2, o_y2]], [1, metadata.coco_classes.index(classname)], raw_action=action_id, data_gt=True)
-
-                        if human_index != -1 and obj_index != -1:
-                            edge_idx = labeled_edge_list[human_index-1] + (obj_index-human_index-1)
-                            edge_labels[edge_idx, action_id] = 1 
-                except IndexError:
-                    pass
+            # collect all the ground truth pairs first, then match them to the detections at once
+            h_boxes, o_boxes, o_classnames, action_ids, hoi_groups = [], [], [], [], []
+            for i_hoi in range(data['hoi_offsets'][i_img], data['hoi_offsets'][i_img+1]):
+                hoi_id = data['hoi_id'][i_hoi]
+                action_id = metadata.hoi_to_action[hoi_id - 1]  # !NOTE: Need to subtract 1 
+                classname = hoi_object_names[hoi_id-1]    # !NOTE: Need to subtract 1
+                bboxhuman = data['human_boxes'][data['human_offsets'][i_hoi]:data['human_offsets'][i_hoi+1]]
+                bboxobject = data['object_boxes'][data['object_offsets'][i_hoi]:data['object_offsets'][i_hoi+1]]
+                connection = data['connections'][data['conn_offsets'][i_hoi]:data['conn_offsets'][i_hoi+1]]
+                for j_h in range(bboxhuman.shape[0]):
+                    # !NOTE: an invalid connection raised an IndexError in the .mat struct and skipped the rest of the hoi
+                    if j_h >= connection.shape[0]:
+                        break
+                    j_o = connection[j_h][1] - 1
+                    if not -bboxobject.shape[0] <= j_o < bboxobject.shape[0]:
+                        break
+                    h_x1, h_y1, h_x2, h_y2 = bboxhuman[j_h]
+                    o_x1, o_y1, o_x2, o_y2 = bboxobject[j_o]
+
+                    if args.vis_result:
+                        raw_action[action_id] = 1
+                        image_gt = vis_img(image_gt, [[h_x1, h_y1, h_x2, h_y2],[o_x1, o_y1, o_x2, o_y2]], [1, metadata.coco_classes.index(classname)], raw_action=action_id, data_gt=True)
+
+                    h_boxes.append([h_x1, h_y1, h_x2, h_y2])
+                    o_boxes.append([o_x1, o_y1, o_x2, o_y2])
+                    o_classnames.append(classname)
+                    action_ids.append(action_id)
+                    hoi_groups.append(i_hoi)
+
+            human_index = get_node_indices(['person']*len(h_boxes), h_boxes, det_class, det_boxes, labeled=args.labeled)
+            obj_index = get_node_indices(o_classnames, o_boxes, det_class, det_boxes, labeled=args.labeled)
+            edge_labels = assign_edge_labels(edge_labels, human_index, obj_index, np.array(action_ids, dtype=int), np.array(hoi_groups, dtype=int), labeled_edge_list, human_num)
             # visualizing result instead of saving result
             if args.vis_result:
                 # ipdb.set_trace()
@@ -212,6 +252,8 @@ def parse_data(data_const,args):
                 save_data[global_id].create_dataset('classes', data=det_class)
                 save_data[global_id].create_dataset('scores', data=det_scores)
                 save_data[global_id].create_dataset('edge_labels', data=edge_labels)
+                if args.feat_dtype is not None:
+                    feat = io.to_storage_dtype(feat, args.feat_dtype)
                 save_data[global_id].create_dataset('feature', data=feat)
         if not args.vis_result:
             save_data.close()
@@ -259,6 +301,8 @@ if __name__ == "__main__":
                         help='take instance detection label into account when getting node index')
     parse.add_argument("--feat_type", '--f_t', type=str, default='fc7', choices=['fc7', 'pool'], required=True,
                         help="which feature do you want to parse: fc7")
+    parse.add_argument("--feat_dtype", type=str, default=None, choices=['float32', 'float16', 'bfloat16'],
+                        help="dtype to store the features on disk, keep the original one if not set: None")
     parse.add_argument("--label_type", '--l_t', type=str, default='node', choices=['node', 'edge'],
                         help="which type of the label do you want: node")
 
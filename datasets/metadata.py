@@ -133,6 +133,9 @@ obj_hoi_index = [(0, 0), (161, 170), (11, 24), (66, 76), (147, 160), (1, 10), (5
                 ]
 
 obj_to_hoi = [hoi_classes[x[0] - 1: x[1]] for x in obj_hoi_index]
+# the same ranges as (first 0-based hoi id, number of hois) of every object class, for indexing with arrays
+obj_hoi_start = [x[0] - 1 for x in obj_hoi_index]
+obj_hoi_num = [x[1] - x[0] + 1 for x in obj_hoi_index]
 obj_actions = [[action_classes.index(y) for y in x] for x in obj_to_hoi]
 
 def action_to_obj_idx(obj_class, action_hico):
@@ -0,0 +1,94 @@
+import queue
+import threading
+
+import torch
+
+class DataPrefetcher():
+    '''
+    Wrap a DataLoader and stage the next batches on the device in a background thread, so that
+    the host-to-device copy overlaps with the forward/backward pass of the current batch.
+    On GPU the copies are issued from pinned memory on a side CUDA stream; on CPU-only machines
+    it falls back to a plain background-thread prefetch.
+    Args:
+        dataloader: the DataLoader to wrap
+            device: torch.device the tensors are moved to
+              keys: names of the batch fields to move, default is every tensor in the batch
+        queue_size: how many batches are prepared ahead
+    '''
+    def __init__(self, dataloader, device, keys=None, queue_size=2):
+        self.dataloader = dataloader
+        self.device = device
+        self.keys = keys
+        self.queue_size = queue_size
+        self.use_cuda = device.type == 'cuda'
+        self.stream = torch.cuda.Stream(device=device) if self.use_cuda else None
+
+    def __len__(self):
+        return len(self.dataloader)
+
+    def _stage(self, data):
+        keys = self.keys if self.keys is not None else list(data.keys())
+        for key in keys:
+            value = data.get(key)
+            if not isinstance(value, torch.Tensor):
+                continue
+            if self.use_cuda:
+                if not value.is_pinned():
+                    value = value.pin_memory()
+                data[key] = value.to(self.device, non_blocking=True)
+            else:
+                data[key] = value.to(self.device)
+        return data
+
+    def _put(self, batch_queue, item, stop):
+        # the queue is bounded, check the stop flag so that an abandoned iteration can exit
+        while not stop.is_set():
+            try:
+                batch_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _worker(self, batch_queue, stop):
+        try:
+            for data in self.dataloader:
+                event = None
+                if self.use_cuda:
+                    with torch.cuda.stream(self.stream):
+                        data = self._stage(data)
+                        event = torch.cuda.Event()
+                        event.record(self.stream)
+                else:
+                    data = self._stage(data)
+                if not self._put(batch_queue, (data, event), stop):
+                    return
+            # the end of the loader and the errors go through the same stop-aware put as the batches
+            self._put(batch_queue, None, stop)
+        except Exception as e:
+            self._put(batch_queue, e, stop)
+
+    def __iter__(self):
+        batch_queue = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._worker, args=(batch_queue, stop), daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = batch_queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                data, event = item
+                if event is not None:
+                    # wait for the copy and tell the allocator the tensors are used on this stream
+                    current_stream = torch.cuda.current_stream(self.device)
+                    current_stream.wait_event(event)
+                    for value in data.values():
+                        if isinstance(value, torch.Tensor) and value.is_cuda:
+                            value.record_stream(current_stream)
+                yield data
+        finally:
+            stop.set()
+            thread.join()
@@ -118,6 +118,10 @@ class VcocoDataset(Dataset):
     def displaycount():
         print("total times to process data sampling:", VcocoDataset.data_sample_count)
 
+    def get_node_nums(self):
+        ''' read the node number of every image once, used by BucketBatchSampler '''
+        return [int(self.sub_app_data[str(global_id)]['node_num'][()]) for global_id in self.subset_ids]
+
     # def get_verb_one_hot(self,hoi_ids):
     #     num_cand = len(hoi_ids)
     #     verb_one_hot = np.zeros([num_cand,len(self.verb_to_id)])
@@ -6,6 +6,7 @@
 # sys.path.append('./vcoco')
 import os
 import h5py
+import argparse
 import ipdb
 from tqdm import tqdm
 from PIL import Image
@@ -13,11 +14,19 @@ from PIL import Image
 from datasets.vcoco import vsrl_utils as vu
 import utils.io as io
 from datasets.vcoco_constants import VcocoConstants
+from datasets.faster_rcnn_loader import image_loader, run_detector
 
 import torchvision
 import torch
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run Faster R-CNN to save the object detection data of V-COCO')
+    parser.add_argument('--batch_size', type=int, default=1,
+                        help='number of images per forward: 1')
+    parser.add_argument('--num_workers', type=int, default=4,
+                        help='number of processes decoding the images: 4')
+    args = parser.parse_args()
+
     # set up the model
     model = torchvision.models.detection.fasterrcnn_resnet50_fpn(pretrained=True, rpn_post_nms_top_n_test=200, box_batch_size_per_image=128, \
                                                                  box_score_thresh=0.1, box_nms_thresh=0.3)
@@ -40,19 +49,17 @@ if __name__ == '__main__':
         img_id_list = vcoco[0]['image_id'][:,0].tolist()
         nms_keep_indices_dict = {}
         # ipdb.set_trace()
-        for img_id in tqdm(set(img_id_list)):
-            img_path = os.path.join('datasets/vcoco/coco/images', coco.loadImgs(ids=img_id)[0]['coco_url'].split('.org')[1][1:])
-            img = Image.open(img_path).convert('RGB')
-            img_tensor = torchvision.transforms.functional.to_tensor(img)
-            img_tensor = img_tensor.to(device)
-            outputs = model([img_tensor], save_feat=True)
+        img_id_list = list(set(img_id_list))
+        img_path_list = [os.path.join('datasets/vcoco/coco/images', coco.loadImgs(ids=img_id)[0]['coco_url'].split('.org')[1][1:]) for img_id in img_id_list]
+        dataloader = image_loader(img_id_list, img_path_list, batch_size=args.batch_size, num_workers=args.num_workers)
+        for img_id, output in tqdm(run_detector(model, dataloader, device), total=len(img_id_list)):
             # save object detection results
             faster_rcnn_det_data.create_group(str(img_id))
-            faster_rcnn_det_data[str(img_id)].create_dataset(name='boxes', data=outputs[0]['boxes'].cpu().detach().numpy()) 
-            faster_rcnn_det_data[str(img_id)].create_dataset(name='scores', data=outputs[0]['scores'].cpu().detach().numpy())  
-            faster_rcnn_det_data[str(img_id)].create_dataset(name='fc7_feaet', data=outputs[0]['fc7_feat'].cpu().detach().numpy()) 
-            faster_rcnn_det_data[str(img_id)].create_dataset(name='pool_feaet', data=outputs[0]['pool_feat'].cpu().detach().numpy())
-            nms_keep_indices_dict[str(img_id)] = outputs[0]['labels']
+            faster_rcnn_det_data[str(img_id)].create_dataset(name='boxes', data=output['boxes'].cpu().detach().numpy()) 
+            faster_rcnn_det_data[str(img_id)].create_dataset(name='scores', data=output['scores'].cpu().detach().numpy())  
+            faster_rcnn_det_data[str(img_id)].create_dataset(name='fc7_feaet', data=output['fc7_feat'].cpu().detach().numpy()) 
+            faster_rcnn_det_data[str(img_id)].create_dataset(name='pool_feaet', data=output['pool_feat'].cpu().detach().numpy())
+            nms_keep_indices_dict[str(img_id)] = output['labels']
         faster_rcnn_det_data.close()
         io.dump_json_object(nms_keep_indices_dict, os.path.join(data_const.proc_dir, subset, 'nms_keep_indices.json'))
     print('Finished!!!')
@@ -165,11 +165,7 @@ def select(data_const):
             # import ipdb; ipdb.set_trace()
             selected_dets, start_end_ids = select_dets(boxes,scores,nms_keep_indices,data_const)
 
-            selected_feat = []
-            for rpn_id in selected_dets[:, 5]:
-                selected_feat.append(np.expand_dims(features[rpn_id, :], 0))
-            selected_feat = np.concatenate(selected_feat, axis=0
-            )
+            selected_feat = io.read_rows(features, selected_dets[:, 5])
             f.create_group(str(img_id))
             f[str(img_id)].create_dataset('boxes_scores_rpn_ids',data=selected_dets)
             f[str(img_id)].create_dataset('start_end_ids',data=start_end_ids)
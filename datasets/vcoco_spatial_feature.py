@@ -33,7 +33,7 @@ def box1_with_respect_to_box2(box1, box2):
             ]
     return feats
 
-def calculate_spatial_feats(det_boxes, im_wh):
+def calculate_spatial_feats_loop(det_boxes, im_wh):
     spatial_feats = []
     for i in range(det_boxes.shape[0]):
         for j in range(det_boxes.shape[0]):
@@ -51,6 +51,30 @@ def calculate_spatial_feats(det_boxes, im_wh):
     spatial_feats = np.array(spatial_feats)
     return spatial_feats
 
+def calculate_spatial_feats(det_boxes, im_wh):
+    '''
+        Vectorized calculate_spatial_feats_loop(): the [N*(N-1), 16] features of all ordered pairs (i, j), i != j,
+        in the same row order as the double loop
+    '''
+    boxes = np.asarray(det_boxes, dtype=np.float64).reshape(-1, 4)
+    img_w, img_h = float(im_wh[0]), float(im_wh[1])
+    # i-major, j skips i
+    i_idx, j_idx = np.nonzero(~np.eye(boxes.shape[0], dtype=bool))
+
+    box_w = boxes[:,2] - boxes[:,0]
+    box_h = boxes[:,3] - boxes[:,1]
+    box_wrt_img = np.stack([boxes[:,0]/(img_w+1e-6), boxes[:,1]/(img_h+1e-6), boxes[:,2]/(img_w+1e-6), boxes[:,3]/(img_h+1e-6),
+                            box_w*box_h/(img_w*img_h+1e-6)], axis=1)
+    box1_wrt_box2 = np.stack([(boxes[i_idx,0]-boxes[j_idx,0])/(box_w[j_idx]+1e-6),
+                              (boxes[i_idx,1]-boxes[j_idx,1])/(box_h[j_idx]+1e-6),
+                              np.log(box_w[i_idx]/(box_w[j_idx]+1e-6)),
+                              np.log(box_h[i_idx]/(box_h[j_idx]+1e-6))], axis=1)
+    center = np.stack([(boxes[:,2]+boxes[:,0])/2, (boxes[:,3]+boxes[:,1])/2], axis=1)
+    # !NOTE: same precedence as center_offset(), only the center of box2 is divided by the image size
+    offset = center[i_idx] - center[j_idx]/np.array([img_w, img_h])
+    spatial_feats = np.concatenate([box_wrt_img[i_idx], box_wrt_img[j_idx], box1_wrt_box2, offset], axis=1)
+    return spatial_feats
+
 if __name__=="__main__":
     data_const = VcocoConstants()
 
@@ -63,8 +87,8 @@ if __name__=="__main__":
         vcoco_all = vu.load_vcoco(subset)
         image_ids = vcoco_all[0]['image_id'][:,0].astype(int).tolist()
         for img_id in tqdm(set(image_ids)):
-            det_boxes = vcoco_data[str(img_id)]['boxes']
-            img_wh = vcoco_data[str(img_id)]['img_size']
+            det_boxes = vcoco_data[str(img_id)]['boxes'][:]
+            img_wh = vcoco_data[str(img_id)]['img_size'][:]
             spatial_feats = calculate_spatial_feats(det_boxes, img_wh)
             save_data.create_dataset(str(img_id), data=spatial_feats)
 
@@ -16,7 +16,7 @@ import datasets.vcoco.vsrl_eval
 import datasets.vcoco.vsrl_utils as vu
 from datasets import vcoco_metadata
 from datasets.vcoco_constants import VcocoConstants
-from utils.bbox_utils import compute_iou
+from utils.bbox_utils import compute_iou, compute_iou_matrix
 from utils.vis_tool import vis_img_vcoco
 import utils.io as io
 
@@ -35,6 +35,21 @@ def get_node_index(bbox, det_boxes, index_list):
             max_iou_index = i_node
     return max_iou_index
 
+def get_node_indices(bboxes, det_boxes, num, iou_thresh=0.3):
+    '''
+    Vectorized get_node_index(bbox, det_boxes, range(num)) for a [M,4] array of ground truth boxes,
+    returns [M] array with -1 for the boxes without a match (including the nan boxes)
+    '''
+    bboxes = np.array(bboxes, dtype=np.float32).reshape(-1, 4)
+    if num == 0 or bboxes.shape[0] == 0:
+        return -np.ones(bboxes.shape[0], dtype=int)
+    iou = compute_iou_matrix(bboxes, det_boxes[:num, :])
+    iou[np.isnan(iou)] = 0
+    # argmax keeps the first detection on ties, as the strict '>' in get_node_index()
+    max_iou_index = np.argmax(iou, axis=1)
+    max_iou = iou[np.arange(iou.shape[0]), max_iou_index]
+    return np.where(max_iou > iou_thresh, max_iou_index, -1)
+
 def parse_data(data_const, args):
     # just focus on HOI samplers, remove those action with on objects
     action_class_num = len(vcoco_metadata.action_classes) - len(vcoco_metadata.action_no_obj)
@@ -109,63 +124,67 @@ def parse_data(data_const, args):
                 else:
                     continue
             # import ipdb; ipdb.set_trace()
+            # match all the role boxes of the image with the detections at once
+            gt_actions = [x for x in vcoco_all if x['label'][i_image,0] == 1 and x['action_name'] not in vcoco_metadata.action_no_obj]
+            gt_role_bbox = [(x['role_bbox'][i_image, :] * 1.).reshape((-1, 4)) for x in gt_actions]
+            gt_role_start = np.cumsum([0] + [len(role_bbox) for role_bbox in gt_role_bbox])
+            gt_role_bbox = np.concatenate(gt_role_bbox) if gt_role_bbox else np.zeros((0, 4))
+            human_match = get_node_indices(gt_role_bbox, det_boxes, human_num)
+            node_match = get_node_indices(gt_role_bbox, det_boxes, node_num)    # !Note: Take the human into account
             # Ground truth labels
-            for x in vcoco_all:
-                if x['label'][i_image,0] == 1:
-                    if x['action_name'] in vcoco_metadata.action_no_obj:
+            for i_x, x in enumerate(gt_actions):
+                # role_bbox contain (agent,object/instr)
+                # if i_image == 16:
+                #     import ipdb; ipdb.set_trace()
+                role_bbox = x['role_bbox'][i_image, :] * 1.
+                role_bbox = role_bbox.reshape((-1, 4))
+                # match human box
+                bbox = role_bbox[0, :]
+                human_index = human_match[gt_role_start[i_x]]
+                if human_index == -1:
+                    warnings.warn('human detection missing')
+                    # print(img_name)
+                    continue
+                assert human_index < human_num
+                # match object box
+                for i_role in range(1, len(x['role_name'])):
+                    action_name = x['action_name']
+                    if x['role_name'][i_role]=='instr' and (x['action_name'] == 'cut' or x['action_name'] == 'eat' or x['action_name'] == 'hit'):
+                        action_index = vcoco_metadata.action_with_obj_index[x['action_name']+'_with']
+                        action_name +='_with'
+                        # import ipdb; ipdb.set_trace()
+                        # print('testing')
+                    else:
+                        action_index = vcoco_metadata.action_with_obj_index[x['action_name']]
+                    bbox = role_bbox[i_role, :]
+                    if np.isnan(bbox[0]):
+                        continue
+                    if args.vis_result:
+                        img_gt = vis_img_vcoco(img_gt, [role_bbox[0,:], role_bbox[i_role,:]], 1, raw_action=action_index, data_gt=True)
+                    obj_index = node_match[gt_role_start[i_x] + i_role]
+                    # obj_index = get_node_index(bbox, det_boxes, range(human_num, node_num))  # test
+                    if obj_index == -1:
+                        warnings.warn('object detection missing')
+                        # print(img_name)
                         continue
-                    # role_bbox contain (agent,object/instr)
-                    # if i_image == 16:
-                    #     import ipdb; ipdb.set_trace()
-                    role_bbox = x['role_bbox'][i_image, :] * 1.
-                    role_bbox = role_bbox.reshape((-1, 4))
-                    # match human box
-                    bbox = role_bbox[0, :]
-                    human_index = get_node_index(bbox, det_boxes, range(human_num))
-                    if human_index == -1:
-                        warnings.warn('human detection missing')
+                    if obj_index == human_index:
+                        warnings.warn('human detection is the same to object detection')
                         # print(img_name)
                         continue
-                    assert human_index < human_num
-                    # match object box
-                    for i_role in range(1, len(x['role_name'])):
-                        action_name = x['action_name']
-                        if x['role_name'][i_role]=='instr' and (x['action_name'] == 'cut' or x['action_name'] == 'eat' or x['action_name'] == 'hit'):
-                            action_index = vcoco_metadata.action_with_obj_index[x['action_name']+'_with']
-                            action_name +='_with'
-                            # import ipdb; ipdb.set_trace()
-                            # print('testing')
-                        else:
-                            action_index = vcoco_metadata.action_with_obj_index[x['action_name']]
-                        bbox = role_bbox[i_role, :]
-                        if np.isnan(bbox[0]):
-                            continue
-                        if args.vis_result:
-                            img_gt = vis_img_vcoco(img_gt, [role_bbox[0,:], role_bbox[i_role,:]], 1, raw_action=action_index, data_gt=True)
-                        obj_index = get_node_index(bbox, det_boxes, range(node_num))    # !Note: Take the human into account
-                        # obj_index = get_node_index(bbox, det_boxes, range(human_num, node_num))  # test
-                        if obj_index == -1:
-                            warnings.warn('object detection missing')
-                            # print(img_name)
-                            continue
-                        if obj_index == human_index:
-                            warnings.warn('human detection is the same to object detection')
-                            # print(img_name)
-                            continue
-                        # match labels
-                        # if human_index == 0:
-                        #     edge_index = obj_index - 1
-                        if human_index > obj_index:
-                            edge_index = human_index * (node_num-1) + obj_index
-                        else:
-                            edge_index = human_index * (node_num-1) + obj_index - 1
-                            # edge_index = human_index * obj_num + obj_index - human_num  #test
-                        det_record[action_name] +=1
-                        edge_labels[edge_index, action_index] = 1
-                        # edge_labels[edge_index, no_action_index] = 0
-                        edge_roles[edge_index, vcoco_metadata.role_index[x['role_name'][i_role]]] = 1
-                        edge_roles[edge_index, no_role_index] = 0
-                        
+                    # match labels
+                    # if human_index == 0:
+                    #     edge_index = obj_index - 1
+                    if human_index > obj_index:
+                        edge_index = human_index * (node_num-1) + obj_index
+                    else:
+                        edge_index = human_index * (node_num-1) + obj_index - 1
+                        # edge_index = human_index * obj_num + obj_index - human_num  #test
+                    det_record[action_name] +=1
+                    edge_labels[edge_index, action_index] = 1
+                    # edge_labels[edge_index, no_action_index] = 0
+                    edge_roles[edge_index, vcoco_metadata.role_index[x['role_name'][i_role]]] = 1
+                    edge_roles[edge_index, no_role_index] = 0
+                    
             # visualizing result instead of saving result
             if args.vis_result:
                 # ipdb.set_trace()
@@ -6,6 +6,7 @@ import pickle
 import h5py
 import argparse
 import numpy as np
+from functools import partial
 from tqdm import tqdm
 
 import dgl
@@ -17,9 +18,10 @@ from torch.utils.data import DataLoader
 
 from model.model import AGRNN
 from datasets.hico_constants import HicoConstants
-from datasets.hico_dataset import HicoDataset, collate_fn
+from datasets.hico_dataset import HicoDataset, collate_fn, light_collate_fn
 from datasets import metadata
 import utils.io as io
+from result.hoi_det_table import HoiDetTable, expand_hoi_dets
 
 def main(args):
     # use GPU if available else revert to CPU
@@ -36,10 +38,12 @@ def main(args):
         # ipdb.set_trace()
         if not args.exp_ver:
             args.exp_ver = args.pretrained.split("/")[-3]+"_"+args.pretrained.split("/")[-1].split("_")[-2]
-        data_const = HicoConstants(feat_type=checkpoint['feat_type'], exp_ver=args.exp_ver)
+        data_const = HicoConstants(feat_type=checkpoint['feat_type'], exp_ver=args.exp_ver, feat_dtype=args.feat_dtype)
         model = AGRNN(feat_type=checkpoint['feat_type'], bias=checkpoint['bias'], bn=checkpoint['bn'], dropout=checkpoint['dropout'], multi_attn=checkpoint['multi_head'], layer=checkpoint['layers'], diff_edge=checkpoint['diff_edge']) #2 )
         # ipdb.set_trace()
         model.load_state_dict(checkpoint['state_dict'])
+        if args.half:
+            model.half()
         model.to(device)
         model.eval()
         print('Constructed model successfully!')
@@ -51,10 +55,15 @@ def main(args):
     if not os.path.exists(data_const.result_dir):
         os.mkdir(data_const.result_dir)
     pred_hoi_dets_hdf5 = os.path.join(data_const.result_dir, 'pred_hoi_dets.hdf5')
-    pred_hois = h5py.File(pred_hoi_dets_hdf5,'w')
+    if args.pred_format == 'tree':
+        pred_hois = h5py.File(pred_hoi_dets_hdf5,'w')
+    else:
+        pred_hois = HoiDetTable()
 
-    test_dataset = HicoDataset(data_const=data_const, subset='test', test=True)
-    test_dataloader = DataLoader(dataset=test_dataset, batch_size=1, shuffle=False, collate_fn=collate_fn)
+    # with --half the float16 features of the store are handed to the model as they are
+    test_dataset = HicoDataset(data_const=data_const, subset='test', test=True, upcast=not args.half, spatial_on_the_fly=args.spatial_on_the_fly)
+    test_collate_fn = partial(light_collate_fn, keep_det=True, half=True) if args.half else collate_fn
+    test_dataloader = DataLoader(dataset=test_dataset, batch_size=1, shuffle=False, collate_fn=test_collate_fn)
     # for global_id in tqdm(test_list): 
     for data in tqdm(test_dataloader):
         train_data = data
@@ -69,41 +78,30 @@ def main(args):
         word2vec = train_data['word2vec']
 
         # referencing
-        features, spatial_feat, word2vec = features.to(device), spatial_feat.to(device), word2vec.to(device)
-        outputs, attn, attn_lang = model(node_num, features, spatial_feat, word2vec, [roi_labels])    # !NOTE: it is important to set [roi_labels] 
+        features, word2vec = features.to(device), word2vec.to(device)
+        spatial_feat = spatial_feat.to(device) if spatial_feat is not None else None
+        outputs, attn, attn_lang = model(node_num, features, spatial_feat, word2vec, [roi_labels], det_boxes=[det_boxes], img_wh=train_data['img_wh'])    # !NOTE: it is important to set [roi_labels] 
         
-        action_score = nn.Sigmoid()(outputs)
+        action_score = nn.Sigmoid()(outputs.float())
         action_score = action_score.cpu().detach().numpy()
-        attn = attn.cpu().detach().numpy()
-        attn_lang = attn_lang.cpu().detach().numpy()
+        attn = attn.float().cpu().detach().numpy()
+        attn_lang = attn_lang.float().cpu().detach().numpy()
         # save detection result
-        pred_hois.create_group(global_id)
-        det_data_dict = {}
-        h_idxs = np.where(roi_labels == 1)[0]
-        labeled_edge_list = np.cumsum(node_num - np.arange(len(h_idxs)) - 1)
-        labeled_edge_list[-1] = 0
-        for h_idx in h_idxs:
-            for i_idx in range(len(roi_labels)):
-                if i_idx <= h_idx:
-                    continue
-                # import ipdb; ipdb.set_trace()
-                edge_idx = labeled_edge_list[h_idx-1] + (i_idx-h_idx-1)
-                # score = roi_scores[h_idx] * roi_scores[i_idx] * action_score[edge_idx] * (attn[h_idx][i_idx-1]+attn_lang[h_idx][i_idx-1])
-                score = roi_scores[h_idx] * roi_scores[i_idx] * action_score[edge_idx]
-                try:
-                    hoi_ids = metadata.obj_hoi_index[roi_labels[i_idx]]
-                except Exception as e:
-                    ipdb.set_trace()
-                for hoi_idx in range(hoi_ids[0]-1, hoi_ids[1]):
-                    hoi_pair_score = np.concatenate((det_boxes[h_idx], det_boxes[i_idx], np.expand_dims(score[metadata.hoi_to_action[hoi_idx]], 0)), axis=0)
-                    if str(hoi_idx+1).zfill(3) not in det_data_dict.keys():
-                        det_data_dict[str(hoi_idx+1).zfill(3)] = hoi_pair_score[None,:]
-                    else:
-                        det_data_dict[str(hoi_idx+1).zfill(3)] = np.vstack((det_data_dict[str(hoi_idx+1).zfill(3)], hoi_pair_score[None,:]))
-        for k, v in det_data_dict.items():
-            pred_hois[global_id].create_dataset(k, data=v)
-
-    pred_hois.close()
+        hoi_ids, hoi_dets = expand_hoi_dets(det_boxes, roi_scores, roi_labels, node_num, action_score)
+        if args.pred_format == 'tree':
+            pred_hois.create_group(global_id)
+            det_data_dict = {}
+            for hoi_idx, hoi_det in zip(hoi_ids, hoi_dets):
+                det_data_dict[str(hoi_idx+1).zfill(3)] = hoi_det
+            for k, v in det_data_dict.items():
+                pred_hois[global_id].create_dataset(k, data=v)
+        else:
+            pred_hois.add(global_id, hoi_ids, hoi_dets)
+
+    if args.pred_format == 'tree':
+        pred_hois.close()
+    else:
+        pred_hois.save(pred_hoi_dets_hdf5)
 
 def str2bool(arg):
     arg = arg.lower()
@@ -131,7 +129,21 @@ if __name__ == "__main__":
     parser.add_argument('--exp_ver', '--e_v', type=str, default=None,
                         help='the version of code, will create subdir in log/ && checkpoints/ ')
 
+    parser.add_argument('--feat_dtype', type=str, default=None, choices=['float32', 'float16', 'bfloat16'],
+                        help='on-disk dtype of the test features, the original data is used if not set: None')
+
+    parser.add_argument('--spatial_on_the_fly', type=str2bool, default='false',
+                        help='compute the spatial features in the model instead of reading test_spatial_feat.hdf5: false')
+
+    parser.add_argument('--pred_format', type=str, default='columnar', choices=['columnar', 'tree'],
+                        help='layout of pred_hoi_dets.hdf5, columnar arrays sorted by hoi or one group per image (tree): columnar')
+
+    parser.add_argument('--half', type=str2bool, default='false',
+                        help='run the model in float16 on the GPU and feed it the float16 features without upcasting: false')
+
     args = parser.parse_args()
+    if args.half and not (args.gpu and torch.cuda.is_available()):
+        parser.error('--half needs a GPU')
     # data_const = HicoConstants(feat_type=args.feat_type, exp_ver=args.exp_ver)
     # inferencing
     main(args)
\ No newline at end of file
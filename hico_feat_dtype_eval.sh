@@ -0,0 +1,27 @@
+#! /usr/bin/env bash
+
+# measure the mAP impact of storing the features in half precision:
+# bash hico_feat_dtype_eval.sh 'final_ver' 'path_to_the_checkpoint_file' 'float16' ['true']
+# the optional 4th argument also runs the model in float16 on the float16 features (hico_eval.py --half)
+# the half-precision data must be prepared first with the same --feat_dtype, e.g.
+# python -m datasets.hico_train_val_test_data --f_t='fc7' --feat_dtype='float16'
+# python -m datasets.hico_spatial_feature --feat_dtype='float16'
+EXP_VER=$1
+CHECKPOINT=$2
+FEAT_DTYPE=$3
+HALF=${4:-false}
+for VER in "${EXP_VER}" "${EXP_VER}_${FEAT_DTYPE}"; do
+    if [[ $VER == $EXP_VER ]]; then
+        echo 'running eval.py file on the original features'
+        python -m hico_eval --e_v=$VER -p=$CHECKPOINT
+    else
+        echo "running eval.py file on the ${FEAT_DTYPE} features"
+        python -m hico_eval --e_v=$VER -p=$CHECKPOINT --feat_dtype=$FEAT_DTYPE --half=$HALF
+    fi
+    echo 'running result/compute_map.py to compute map'
+    python -m result.compute_map --e_v=$VER
+    echo 'running result/sample_analysis.py to get splited map'
+    python -m result.sample_analysis --e_v=$VER
+done
+echo 'running result/compare_map.py to compare the mAP'
+python -m result.compare_map --base_ver=$EXP_VER --e_v="${EXP_VER}_${FEAT_DTYPE}"
@@ -20,13 +20,18 @@ import numpy as np
 from tqdm import tqdm
 from PIL import Image, ImageDraw, ImageFont
 import random
+from functools import partial
 
 import utils.io as io
 from model.model import AGRNN
 from datasets import metadata
 from utils.vis_tool import vis_img
 from datasets.hico_constants import HicoConstants
-from datasets.hico_dataset import HicoDataset, collate_fn
+from datasets.hico_dataset import HicoDataset, light_collate_fn
+from datasets.bucket_sampler import BucketBatchSampler
+from datasets.prefetcher import DataPrefetcher
+from result.compute_map import load_gt_dets
+from result.online_map import HoiMapAccumulator
 
 ###########################################################################################
 #                                     TRAIN/TEST MODEL                                    #
@@ -34,13 +39,28 @@ from datasets.hico_dataset import HicoDataset, collate_fn
 
 def run_model(args, data_const):
     # set up dataset variable
-    train_dataset = HicoDataset(data_const=data_const, subset='train', data_aug=args.data_aug, sampler=args.sampler)
-    val_dataset = HicoDataset(data_const=data_const, subset='val', data_aug=False, sampler=args.sampler, test=True)
+    train_dataset = HicoDataset(data_const=data_const, subset='train', data_aug=args.data_aug, sampler=args.sampler, spatial_on_the_fly=args.spatial_on_the_fly)
+    val_dataset = HicoDataset(data_const=data_const, subset='val', data_aug=False, sampler=args.sampler, test=True, spatial_on_the_fly=args.spatial_on_the_fly)
     dataset = {'train': train_dataset, 'val': val_dataset}
     print('set up dataset variable successfully')
     # use default DataLoader() to load the data. 
-    train_dataloader = DataLoader(dataset=dataset['train'], batch_size=args.batch_size, shuffle=True, collate_fn=collate_fn)
-    val_dataloader = DataLoader(dataset=dataset['val'], batch_size=args.batch_size, shuffle=True, collate_fn=collate_fn)
+    # det_boxes/roi_scores are only needed to visualize the validation results
+    pin_memory = torch.cuda.is_available() and args.gpu
+    train_collate_fn = partial(light_collate_fn, pin_memory=pin_memory)
+    val_collate_fn = partial(light_collate_fn, pin_memory=pin_memory, keep_det=True)
+    if args.bucket_budget:
+        # group images with similar node numbers and fill each batch up to the node/edge budget
+        train_sampler = BucketBatchSampler(dataset['train'].get_node_nums(), args.bucket_budget, budget_type=args.bucket_type)
+        train_dataloader = DataLoader(dataset=dataset['train'], batch_sampler=train_sampler, collate_fn=train_collate_fn)
+    elif args.stream:
+        # read the images in contiguous chunks and shuffle them in a bounded buffer instead of random access
+        # !NOTE: imported here, HicoStreamDataset needs PyTorch>=1.2
+        from datasets.hico_stream_dataset import HicoStreamDataset
+        train_stream = HicoStreamDataset(dataset['train'], chunk_size=args.stream_chunk, buffer_size=args.stream_buffer)
+        train_dataloader = DataLoader(dataset=train_stream, batch_size=args.batch_size, collate_fn=train_collate_fn)
+    else:
+        train_dataloader = DataLoader(dataset=dataset['train'], batch_size=args.batch_size, shuffle=True, collate_fn=train_collate_fn)
+    val_dataloader = DataLoader(dataset=dataset['val'], batch_size=args.batch_size, shuffle=True, collate_fn=val_collate_fn)
     dataloader = {'train': train_dataloader, 'val': val_dataloader}
     print('set up dataloader successfully')
 
@@ -105,17 +125,29 @@ def epoch_train(model, dataloader, dataset, criterion, optimizer, scheduler, dev
     # set visualization and create folder to save checkpoints
     writer = SummaryWriter(log_dir=args.log_dir + '/' + args.exp_ver + '/' + 'epoch_train')
     io.mkdir_if_not_exists(os.path.join(args.save_dir, args.exp_ver, 'epoch_train'), recursive=True)
+    if args.val_map:
+        # score the validation detections in memory instead of running hico_eval.py + result/compute_map.py
+        val_gt_dets = load_gt_dets(data_const.proc_dir, set(dataset['val'].subset_ids))
+        map_accumulator = HoiMapAccumulator(val_gt_dets, io.load_json_object(data_const.bin_to_hoi_ids_json), max_dets=args.val_map_max_dets)
+        best_map = -1
 
     for epoch in range(args.start_epoch, args.epoch):
         # each epoch has a training and validation step
         epoch_loss = 0
+        val_map = None
+        if args.val_map:
+            map_accumulator.reset()
+        if args.stream:
+            dataloader['train'].dataset.set_epoch(epoch)
         for phase in ['train', 'val']:
             start_time = time.time()
             running_loss = 0.0
             idx = 0
             
             HicoDataset.data_sample_count=0
-            for data in tqdm(dataloader[phase]): 
+            # stage the next batches on the device in the background
+            batches = DataPrefetcher(dataloader[phase], device) if args.prefetch else dataloader[phase]
+            for data in tqdm(batches): 
                 train_data = data
                 img_name = train_data['img_name']
                 det_boxes = train_data['det_boxes']
@@ -127,12 +159,16 @@ def epoch_train(model, dataloader, dataset, criterion, optimizer, scheduler, dev
                 features = train_data['features']
                 spatial_feat = train_data['spatial_feat']
                 word2vec = train_data['word2vec']
-                features, spatial_feat, word2vec, edge_labels = features.to(device), spatial_feat.to(device), word2vec.to(device), edge_labels.to(device)
-                if idx == 10: break    
+                # !NOTE: no-op if the batch has been staged by DataPrefetcher
+                features, word2vec, edge_labels = features.to(device), word2vec.to(device), edge_labels.to(device)
+                # spatial_feat is None if it is computed by the model from det_boxes and img_wh
+                spatial_feat = spatial_feat.to(device) if spatial_feat is not None else None
+                # the validation mAP needs the whole validation set
+                if idx == 10 and not args.val_map: break    
                 if phase == 'train':
                     model.train()
                     model.zero_grad()
-                    outputs = model(node_num, features, spatial_feat, word2vec, roi_labels)
+                    outputs = model(node_num, features, spatial_feat, word2vec, roi_labels, det_boxes=det_boxes, img_wh=train_data['img_wh'])
                     loss = criterion(outputs, edge_labels.float())
                     # import ipdb; ipdb.set_trace()
                     loss.backward()
@@ -142,8 +178,10 @@ def epoch_train(model, dataloader, dataset, criterion, optimizer, scheduler, dev
                     model.eval()
                     # turn off the gradients for validation, save memory and computations
                     with torch.no_grad():
-                        outputs = model(node_num, features, spatial_feat, word2vec, roi_labels, validation=True)
+                        outputs = model(node_num, features, spatial_feat, word2vec, roi_labels, validation=True, det_boxes=det_boxes, img_wh=train_data['img_wh'])
                         loss = criterion(outputs, edge_labels.float())
+                    if args.val_map:
+                        map_accumulator.update(outputs, train_data)
                     # print result every 1000 iteration during validation
                     if idx==0 or idx % round(1000/args.batch_size)==round(1000/args.batch_size)-1:
                         # ipdb.set_trace()
@@ -170,6 +208,11 @@ def epoch_train(model, dataloader, dataset, criterion, optimizer, scheduler, dev
                 HicoDataset.displaycount() 
             else:
                 writer.add_scalars('trainval_loss_epoch', {'train': train_loss, 'val': epoch_loss}, epoch)
+                if args.val_map:
+                    val_map = map_accumulator.compute()
+                    writer.add_scalars('val_map_epoch', {'full': val_map['full'], 'rare': val_map['rare'], 'non_rare': val_map['non_rare']}, epoch)
+                    print("[val] Epoch: {}/{} mAP Full: {} Rare: {} Non-Rare: {}".format(\
+                            epoch+1, args.epoch, val_map['full'], val_map['rare'], val_map['non_rare']))
             # print data
             if (epoch % args.print_every) == 0:
                 end_time = time.time()
@@ -178,7 +221,13 @@ def epoch_train(model, dataloader, dataset, criterion, optimizer, scheduler, dev
                         
         # scheduler.step()
         # save model
-        if epoch_loss<0.0405 or epoch % args.save_every == (args.save_every - 1) and epoch >= (200-1):
+        # !NOTE: with --val_map the best validation mAP replaces the validation loss threshold
+        if val_map is not None:
+            is_best = val_map['full'] > best_map
+            best_map = max(best_map, val_map['full'])
+        else:
+            is_best = epoch_loss<0.0405
+        if is_best or epoch % args.save_every == (args.save_every - 1) and epoch >= (200-1):
             checkpoint = { 
                             'lr': args.lr,
                            'b_s': args.batch_size,
@@ -273,10 +322,39 @@ parser.add_argument('--diff_edge',  type=str2bool, default='false', required=Tru
 parser.add_argument('--sampler',  type=float, default=0, 
                     help='h_h edge, h_o edge, o_o edge are different with each other')
 
+parser.add_argument('--bucket_budget', type=int, default=0,
+                    help='if set, build training batches by node number under this budget instead of --batch_size: 0')
+
+parser.add_argument('--bucket_type', type=str, default='edge', choices=['edge', 'node'],
+                    help='count the bucket budget in edges or nodes: edge')
+
+parser.add_argument('--stream', type=str2bool, default='false',
+                    help='stream the training set in contiguous chunks with a bounded shuffle buffer: false')
+parser.add_argument('--stream_chunk', type=int, default=256,
+                    help='number of consecutive images read per chunk when streaming: 256')
+parser.add_argument('--stream_buffer', type=int, default=1024,
+                    help='size of the shuffle buffer when streaming: 1024')
+
+parser.add_argument('--spatial_on_the_fly', type=str2bool, default='false',
+                    help='compute the spatial features in the model from det_boxes and img_wh instead of reading spatial_feat.hdf5: false')
+
+parser.add_argument('--feat_dtype', type=str, default=None, choices=['float32', 'float16', 'bfloat16'],
+                    help='on-disk dtype of the features, the original data is used if not set: None')
+
+parser.add_argument('--prefetch', type=str2bool, default='false',
+                    help='copy the next batches to the device in a background thread: false')
+
+parser.add_argument('--val_map', type=str2bool, default='false',
+                    help='compute the Full/Rare/Non-Rare mAP of the validation set every epoch and save the checkpoints by it: false')
+parser.add_argument('--val_map_max_dets', type=int, default=10000,
+                    help='keep the best scored detections per hoi for the validation mAP, bounds its memory: 10000')
+
 args = parser.parse_args() 
+if args.bucket_budget and args.stream:
+    parser.error('--bucket_budget and --stream cannot be used together')
 
 if __name__ == "__main__":
-    data_const = HicoConstants(feat_type=args.feat_type)
+    data_const = HicoConstants(feat_type=args.feat_type, feat_dtype=args.feat_dtype)
     run_model(args, data_const)
 
 
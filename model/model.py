@@ -9,7 +9,7 @@ from model.graph_head import TowMLPHead, ResBlockHead
 from model.s3d_g import S3D_G
 from model.grnn import GRNN
 from model.config import CONFIGURATION
-from model.utils import MLP
+from model.utils import MLP, calculate_spatial_feats
 import ipdb
 
 class NodeUpdate(nn.Module):
@@ -148,7 +148,17 @@ class AGRNN(nn.Module):
 
         return edge_list, h_node_list, obj_node_list, h_h_e_list, o_o_e_list, h_o_e_list, readout_edge_list, readout_h_h_e_list, readout_h_o_e_list
 
-    def forward(self, node_num=None, feat=None, spatial_feat=None, word2vec=None, roi_label=None, validation=False, choose_nodes=None, remove_nodes=None):
+    def _spatial_feat(self, det_boxes, img_wh, feat):
+        # compute the spatial features of every image on the device instead of reading them from spatial_feat.hdf5
+        spatial_feat = [calculate_spatial_feats(torch.as_tensor(boxes, dtype=torch.float32).to(feat.device), wh) for boxes, wh in zip(det_boxes, img_wh)]
+        return torch.cat(spatial_feat, dim=0).to(feat.dtype)
+
+    def forward(self, node_num=None, feat=None, spatial_feat=None, word2vec=None, roi_label=None, validation=False, choose_nodes=None, remove_nodes=None, det_boxes=None, img_wh=None):
+        '''
+        If spatial_feat is None, it is computed from det_boxes and img_wh (lists with one item per image).
+        '''
+        if spatial_feat is None:
+            spatial_feat = self._spatial_feat(det_boxes, img_wh, feat)
         # set up graph
         batch_graph, batch_h_node_list, batch_obj_node_list, batch_h_h_e_list, batch_o_o_e_list, batch_h_o_e_list, batch_readout_edge_list, batch_readout_h_h_e_list, batch_readout_h_o_e_list = [], [], [], [], [], [], [], [], []
         node_num_cum = np.cumsum(node_num) # !IMPORTANT
@@ -1,3 +1,4 @@
+import torch
 import torch.nn as nn
 from collections import OrderedDict
 
@@ -76,3 +77,29 @@ class Predictor(nn.Module):
         # if the criterion is BCELoss, you need to uncomment the following code
         # output = self.sigmoid(output)
         return output
+
+def calculate_spatial_feats(boxes, img_wh):
+    '''
+    Torch version of datasets/hico_spatial_feature.py calculate_spatial_feats(), computed on the device of boxes
+    Args:
+         boxes: [N,4] tensor, the detected boxes of one image
+        img_wh: [W,H] of the image
+    Returns:
+        [N*(N-1),16] tensor, the spatial features of the ordered pairs (i, j), i != j, i-major
+    '''
+    img_w, img_h = float(img_wh[0]), float(img_wh[1])
+    num = boxes.shape[0]
+    i_idx, j_idx = torch.nonzero(1 - torch.eye(num, dtype=torch.uint8, device=boxes.device)).t()
+
+    box_w = boxes[:,2] - boxes[:,0]
+    box_h = boxes[:,3] - boxes[:,1]
+    box_wrt_img = torch.stack([boxes[:,0]/(img_w+1e-6), boxes[:,1]/(img_h+1e-6), boxes[:,2]/(img_w+1e-6), boxes[:,3]/(img_h+1e-6),
+                               box_w*box_h/(img_w*img_h+1e-6)], dim=1)
+    box1_wrt_box2 = torch.stack([(boxes[i_idx,0]-boxes[j_idx,0])/(box_w[j_idx]+1e-6),
+                                 (boxes[i_idx,1]-boxes[j_idx,1])/(box_h[j_idx]+1e-6),
+                                 torch.log(box_w[i_idx]/(box_w[j_idx]+1e-6)),
+                                 torch.log(box_h[i_idx]/(box_h[j_idx]+1e-6))], dim=1)
+    center = torch.stack([(boxes[:,2]+boxes[:,0])/2, (boxes[:,3]+boxes[:,1])/2], dim=1)
+    # !NOTE: same precedence as center_offset(), only the center of box2 is divided by the image size
+    offset = center[i_idx] - center[j_idx]/boxes.new_tensor([img_w, img_h])
+    return torch.cat([box_wrt_img[i_idx], box_wrt_img[j_idx], box1_wrt_box2, offset], dim=1)
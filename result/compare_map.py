@@ -0,0 +1,44 @@
+import os
+import argparse
+
+import utils.io as io
+from datasets.hico_constants import HicoConstants
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--base_ver', type=str, required=True,
+                        help='the experiment version used as reference, e.g. evaluated on float32 features')
+parser.add_argument('--exp_ver', '--e_v', type=str, required=True,
+                        help='the experiment version to compare, e.g. evaluated on float16/bfloat16 features')
+
+def load_analysis(exp_ver):
+    data_const = HicoConstants(exp_ver=exp_ver)
+    sample_complexity_analysis_json = os.path.join(
+        data_const.result_dir+'/map',
+        'sample_complexity_analysis.json')
+    return io.load_json_object(sample_complexity_analysis_json)
+
+def main():
+    args = parser.parse_args()
+    base = load_analysis(args.base_ver)
+    exp = load_analysis(args.exp_ver)
+
+    headers = ['', 'Full', 'Rare', 'Non-Rare']
+    rows = []
+    for name, sca in [(args.base_ver, base), (args.exp_ver, exp)]:
+        rows.append([name] + [str(round(sca[k]*100,2)) for k in ['full','rare','non_rare']])
+    rows.append(['diff'] + [str(round((exp[k]-base[k])*100,2)) for k in ['full','rare','non_rare']])
+
+    print('Space delimited values that can be copied to spreadsheet and split by space')
+    print(' '.join(headers))
+    for row in rows:
+        print(' '.join(row))
+
+    compare_json = os.path.join(
+        HicoConstants(exp_ver=args.exp_ver).result_dir+'/map',
+        f'compare_with_{args.base_ver}.json')
+    io.dump_json_object(
+        {k: exp[k]-base[k] for k in ['full','rare','non_rare']},
+        compare_json)
+
+if __name__=='__main__':
+    main()
@@ -6,12 +6,15 @@ import pickle
 from tqdm import tqdm
 import numpy as np
 #import matplotlib.pyplot as plt
-from multiprocessing import Pool
 from sklearn.metrics import average_precision_score, precision_recall_curve
 
 import utils.io as io
-from utils.bbox_utils import compute_iou
+from utils.bbox_utils import compute_iou, compute_iou_matrix
+from utils.ap_utils import compute_ap, compute_pr, compute_normalized_pr, descending_order
 from datasets.hico_constants import HicoConstants
+from datasets.hico_gt_cache import load_gt_cache
+from result.hoi_det_table import NUM_HOIS, is_columnar, read_hoi_dets
+from utils.parallel import run_by_cost
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
@@ -61,67 +64,50 @@ def match_hoi(pred_det,gt_dets):
     return is_match, remaining_gt_dets
 
 
-def compute_ap(precision,recall):
-    if np.any(np.isnan(recall)):
-        return np.nan
-
-    ap = 0
-    for t in np.arange(0,1.1,0.1): # 0, 0.1, 0.2, ..., 1.0
-        selected_p = precision[recall>=t]
-        if selected_p.size==0:
-            p = 0
-        else:
-            p = np.max(selected_p)   
-        ap += p/11.
-    
-    return ap
-
-
-def compute_pr(y_true,y_score,npos):
-    sorted_y_true = [y for y,_ in 
-        sorted(zip(y_true,y_score),key=lambda x: x[1],reverse=True)]
-    tp = np.array(sorted_y_true)
-    fp = ~tp
-    tp = np.cumsum(tp)
-    fp = np.cumsum(fp)
-    if npos==0:
-        recall = np.nan*tp
-    else:
-        recall = tp / npos
-    precision = tp / (tp + fp)
-    return precision, recall
-
-
-def compute_normalized_pr(y_true,y_score,npos,N=196.45):
-    sorted_y_true = [y for y,_ in 
-        sorted(zip(y_true,y_score),key=lambda x: x[1],reverse=True)]
-    tp = np.array(sorted_y_true)
-    fp = ~tp
-    tp = np.cumsum(tp)
-    fp = np.cumsum(fp)
-    if npos==0:
-        recall = np.nan*tp
-    else:
-        recall = tp / npos
-    precision = recall*N / (recall*N + fp)
-    nap = np.sum(precision[sorted_y_true]) / (npos+1e-6)
-    return precision, recall, nap
-
-
-def eval_hoi(hoi_id,global_ids,gt_dets,pred_hoi_dets_file,out_dir):
+def match_hois(pred_human_boxes,pred_object_boxes,gt_dets,iou_thresh=0.5):
+    '''
+        Greedy matching of all the detections of one image (in evaluation order) to its gt dets,
+        gives the same decisions as calling match_hoi() detection by detection
+    '''
+    num_dets = len(pred_human_boxes)
+    is_match = np.zeros(num_dets,dtype=bool)
+    if num_dets==0 or len(gt_dets)==0:
+        return is_match
+    gt_human_boxes = [gt_det['human_box'] for gt_det in gt_dets]
+    gt_object_boxes = [gt_det['object_box'] for gt_det in gt_dets]
+    human_iou = compute_iou_matrix(pred_human_boxes,gt_human_boxes)
+    object_iou = compute_iou_matrix(pred_object_boxes,gt_object_boxes)
+    candidate = np.logical_and(human_iou > iou_thresh, object_iou > iou_thresh)
+    # !NOTE: the matrices are float64, recheck the pairs close to the threshold with compute_iou() itself
+    for i,j in zip(*np.nonzero(np.logical_or(np.abs(human_iou-iou_thresh) < 1e-4, np.abs(object_iou-iou_thresh) < 1e-4))):
+        candidate[i,j] = compute_iou(pred_human_boxes[i],gt_human_boxes[j]) > iou_thresh and \
+            compute_iou(pred_object_boxes[i],gt_object_boxes[j]) > iou_thresh
+
+    # each detection takes the first gt det that is not covered yet
+    covered = np.zeros(len(gt_dets),dtype=bool)
+    for i in range(num_dets):
+        gt_ids = np.nonzero(np.logical_and(candidate[i], ~covered))[0]
+        if gt_ids.size > 0:
+            covered[gt_ids[0]] = True
+            is_match[i] = True
+
+    return is_match
+
+
+def eval_hoi(hoi_id,global_ids,hoi_gt_dets,pred_dets,out_dir):
+    '''
+        hoi_gt_dets: {global_id: gt dets} of this hoi only, see index_gt_by_hoi()
+          pred_dets: the opened pred_hoi_dets.hdf5
+    '''
     print(f'Evaluating hoi_id: {hoi_id} ...')
-    pred_dets = h5py.File(pred_hoi_dets_file,'r')
+    if is_columnar(pred_dets):
+        return eval_hoi_columnar(hoi_id,global_ids,hoi_gt_dets,pred_dets,out_dir)
     y_true = []
     y_score = []
     det_id = []
     npos = 0
     for global_id in global_ids:
-        # if global_id == 'HICO_test2015_00000432':
-        #     import ipdb; ipdb.set_trace()
-        if hoi_id in gt_dets[global_id]:
-            candidate_gt_dets = gt_dets[global_id][hoi_id]
-        else:
-            candidate_gt_dets = []
+        candidate_gt_dets = hoi_gt_dets.get(global_id,[])
         npos += len(candidate_gt_dets)
 
         # start_id, end_id = pred_dets[global_id]['start_end_ids'][int(hoi_id)-1]
@@ -131,22 +117,52 @@ def eval_hoi(hoi_id,global_ids,gt_dets,pred_hoi_dets_file,out_dir):
             continue
         if hoi_id not in pred_dets[global_id].keys():
             continue
-        hoi_dets = pred_dets[global_id][hoi_id]
-        num_dets = hoi_dets.shape[0]
-        sorted_idx = [idx for idx,_ in sorted(
-            zip(range(num_dets),hoi_dets[:,8].tolist()),
-            key=lambda x: x[1],
-            reverse=True)]
-        for i in sorted_idx:
-            pred_det = {
-                'human_box': hoi_dets[i,:4],
-                'object_box': hoi_dets[i,4:8],
-                'score': hoi_dets[i,8]
-            }
-            is_match, candidate_gt_dets = match_hoi(pred_det,candidate_gt_dets)
-            y_true.append(is_match)
-            y_score.append(pred_det['score'])
-            det_id.append((global_id,i))
+        hoi_dets = pred_dets[global_id][hoi_id][()]
+        sorted_idx = descending_order(hoi_dets[:,8]).tolist()
+        hoi_dets = hoi_dets[sorted_idx]
+        is_match = match_hois(hoi_dets[:,:4],hoi_dets[:,4:8],candidate_gt_dets)
+        y_true += is_match.tolist()
+        y_score += list(hoi_dets[:,8])
+        det_id += [(global_id,i) for i in sorted_idx]
+    return save_ap(hoi_id,y_true,y_score,det_id,npos,out_dir)
+
+
+def eval_hoi_columnar(hoi_id,global_ids,hoi_gt_dets,pred_dets,out_dir):
+    hoi_dets = read_hoi_dets(pred_dets,hoi_id,_worker_state.get('pred_global_ids'))
+    pred_global_ids = hoi_dets['global_ids']
+    npos = 0
+    for global_id in global_ids:
+        npos += len(hoi_gt_dets.get(global_id,[]))
+
+    # same order as the per-image walk: images in the order of global_ids, then by decreasing score
+    global_idx = hoi_dets['global_idx']
+    # index of each detection inside its image, as in the per-image hdf5 layout
+    first_row = np.searchsorted(global_idx,global_idx,side='left')
+    det_idx = np.arange(global_idx.shape[0]) - first_row
+    eval_order = {global_id: i for i,global_id in enumerate(global_ids)}
+    image_order = np.array([eval_order.get(pred_global_ids[i],-1) for i in global_idx],dtype=np.int64)
+    keep = np.nonzero(image_order >= 0)[0]
+    # np.lexsort is stable, equal scores keep the detection order like sorted(reverse=True)
+    keep = keep[np.lexsort((-hoi_dets['score'][keep],image_order[keep]))]
+
+    y_true = []
+    y_score = []
+    det_id = []
+    # the detections of an image are contiguous in keep
+    image_starts = np.nonzero(np.diff(global_idx[keep]))[0] + 1
+    for image_keep in np.split(keep,image_starts):
+        if image_keep.size == 0:
+            continue
+        global_id = pred_global_ids[global_idx[image_keep[0]]]
+        candidate_gt_dets = hoi_gt_dets.get(global_id,[])
+        is_match = match_hois(hoi_dets['human_box'][image_keep],hoi_dets['object_box'][image_keep],candidate_gt_dets)
+        y_true += is_match.tolist()
+        y_score += list(hoi_dets['score'][image_keep])
+        det_id += [(global_id,int(i)) for i in det_idx[image_keep]]
+    return save_ap(hoi_id,y_true,y_score,det_id,npos,out_dir)
+
+
+def save_ap(hoi_id,y_true,y_score,det_id,npos,out_dir):
     # Compute PR
     precision,recall = compute_pr(y_true,y_score,npos)
     #nprecision,nrecall,nap = compute_normalized_pr(y_true,y_score,npos)
@@ -185,32 +201,71 @@ def eval_hoi(hoi_id,global_ids,gt_dets,pred_hoi_dets_file,out_dir):
 
 
 def load_gt_dets(proc_dir,global_ids_set):
-    # Load anno_list
-    print('Loading anno_list.json ...')
-    anno_list_json = os.path.join(proc_dir,'anno_list.json')
-    anno_list = io.load_json_object(anno_list_json)
-
-    gt_dets = {}
-    for anno in anno_list:
-        if anno['global_id'] not in global_ids_set:
-            continue
-
-        global_id = anno['global_id']
-        gt_dets[global_id] = {}
-        for hoi in anno['hois']:
-            hoi_id = hoi['id']
-            gt_dets[global_id][hoi_id] = []
-            for human_box_num, object_box_num in hoi['connections']:
-                human_box = hoi['human_bboxes'][human_box_num]
-                object_box = hoi['object_bboxes'][object_box_num]
-                det = {
-                    'human_box': human_box,
-                    'object_box': object_box,
-                }
-                gt_dets[global_id][hoi_id].append(det)
+    # !NOTE: read from the memory mapped gt cache instead of parsing anno_list.json, see datasets/hico_gt_cache.py
+    print('Loading the gt cache of anno_list.json ...')
+    gt_cache = load_gt_cache(HicoConstants(proc_dir=proc_dir))
+    gt_dets = {global_id: {} for global_id in gt_cache.global_ids if global_id in global_ids_set}
+    is_selected = np.array([global_id in global_ids_set for global_id in gt_cache.global_ids],dtype=bool)
+    for k in range(1,NUM_HOIS+1):
+        hoi_id = str(k).zfill(3)
+        det_image, det_human_box, det_object_box = gt_cache.hoi_gt_dets(hoi_id)
+        keep = np.nonzero(is_selected[det_image])[0]
+        for image, human_box, object_box in zip(det_image[keep].tolist(),det_human_box[keep].tolist(),det_object_box[keep].tolist()):
+            det = {
+                'human_box': human_box,
+                'object_box': object_box,
+            }
+            gt_dets[gt_cache.global_ids[image]].setdefault(hoi_id,[]).append(det)
 
     return gt_dets
 
+def index_gt_by_hoi(gt_dets):
+    '''
+        {global_id: {hoi_id: dets}} -> {hoi_id: {global_id: dets}}, so a task only touches the gt of its hoi
+    '''
+    gt_dets_by_hoi = {}
+    for global_id, hoi_dets in gt_dets.items():
+        for hoi_id, dets in hoi_dets.items():
+            gt_dets_by_hoi.setdefault(hoi_id,{})[global_id] = dets
+    return gt_dets_by_hoi
+
+
+# set once in every worker by init_worker(), the tasks only carry the hoi_id
+_worker_state = {}
+
+def init_worker(global_ids,gt_dets_by_hoi,pred_hoi_dets_file,out_dir):
+    _worker_state['global_ids'] = global_ids
+    _worker_state['gt_dets_by_hoi'] = gt_dets_by_hoi
+    _worker_state['pred_dets'] = h5py.File(pred_hoi_dets_file,'r')
+    _worker_state['out_dir'] = out_dir
+    if is_columnar(_worker_state['pred_dets']):
+        _worker_state['pred_global_ids'] = [global_id.decode() for global_id in _worker_state['pred_dets']['global_ids'][()]]
+
+
+def eval_hoi_task(hoi_id):
+    return eval_hoi(
+        hoi_id,
+        _worker_state['global_ids'],
+        _worker_state['gt_dets_by_hoi'].get(hoi_id,{}),
+        _worker_state['pred_dets'],
+        _worker_state['out_dir'])
+
+
+def count_hoi_dets(pred_hoi_dets_file,hoi_ids):
+    '''
+        Number of predictions of every hoi, the cost of its evaluation task
+    '''
+    with h5py.File(pred_hoi_dets_file,'r') as pred_dets:
+        if is_columnar(pred_dets):
+            counts = np.diff(pred_dets['hoi_offsets'][()])
+            return [int(counts[int(hoi_id)-1]) for hoi_id in hoi_ids]
+        counts = {}
+        for global_id in pred_dets.keys():
+            for hoi_id, hoi_dets in pred_dets[global_id].items():
+                counts[hoi_id] = counts.get(hoi_id,0) + hoi_dets.shape[0]
+    return [counts.get(hoi_id,0) for hoi_id in hoi_ids]
+
+
 def main():
     args = parser.parse_args()
 
@@ -232,23 +287,16 @@ def main():
     print('Creating GT dets ...')
     gt_dets = load_gt_dets(data_const.proc_dir,global_ids_set)
 
-    eval_inputs = []
-    for hoi in hoi_list:
-        eval_inputs.append(
-            (hoi['id'],global_ids,gt_dets, data_const.result_dir+'/pred_hoi_dets.hdf5', data_const.result_dir+'/map'))
-    
-    # import ipdb; ipdb.set_trace()
-    # eval_hoi(*eval_inputs[0])
-
-    print(f'Starting a pool of {args.num_processes} workers ...')
-    p = Pool(args.num_processes)
+    gt_dets_by_hoi = index_gt_by_hoi(gt_dets)
 
-    print(f'Begin mAP computation ...')
-    output = p.starmap(eval_hoi,eval_inputs)
-    #output = eval_hoi('003',global_ids,gt_dets,args.pred_hoi_dets_hdf5,args.out_dir)
+    # !NOTE: the gt and the prediction file are sent to/opened by every worker once, not once per hoi
+    hoi_ids = [hoi['id'] for hoi in hoi_list]
+    init_args = (global_ids, gt_dets_by_hoi, data_const.result_dir+'/pred_hoi_dets.hdf5', data_const.result_dir+'/map')
 
-    p.close()
-    p.join()
+    print(f'Begin mAP computation with {args.num_processes} workers ...')
+    # !NOTE: the hois with the most predictions go first and the tasks are handed out one by one
+    costs = count_hoi_dets(data_const.result_dir+'/pred_hoi_dets.hdf5',hoi_ids)
+    output = run_by_cost(eval_hoi_task,[(hoi_id,) for hoi_id in hoi_ids],costs,num_workers=args.num_processes,initializer=init_worker,initargs=init_args)
 
     mAP = {
         'AP': {},
@@ -0,0 +1,107 @@
+import h5py
+import numpy as np
+
+from datasets import metadata
+
+# Columnar pred_hoi_dets.hdf5 (attrs['format'] == 'columnar'), one row per detection:
+#     global_ids    [I]       the evaluated images, global_idx points into it
+#     global_idx    [R]
+#     hoi_id        [R]       1-based, the rows are sorted by it (and by image, then detection order inside a hoi)
+#     human_box     [R,4]
+#     object_box    [R,4]
+#     score         [R]
+#     hoi_offsets   [601]     rows hoi_offsets[k-1]:hoi_offsets[k] belong to hoi k
+# instead of one group per image with one dataset per hoi.
+
+NUM_HOIS = 600
+
+# object class -> hoi ids -> action ids, see metadata.obj_hoi_index
+OBJ_HOI_START = np.array(metadata.obj_hoi_start)
+OBJ_HOI_NUM = np.array(metadata.obj_hoi_num)
+HOI_TO_ACTION = np.array(metadata.hoi_to_action)
+
+def expand_hoi_dets(det_boxes, roi_scores, roi_labels, node_num, action_score):
+    '''
+        Turn the action scores of the readout edges of one image into the hoi detections
+        [human box, object box, score] of every hoi id of the object, grouped by the 0-based hoi id.
+        Returns the hoi ids and, for each of them, the rows in the (human, object) order of the edges
+    '''
+    h_idxs = np.where(roi_labels == 1)[0]
+    labeled_edge_list = np.cumsum(node_num - np.arange(len(h_idxs)) - 1)
+    labeled_edge_list[-1] = 0
+    # all the (human, node) pairs with node > human, ordered by human then node
+    h_grid, o_grid = np.meshgrid(h_idxs, np.arange(len(roi_labels)), indexing='ij')
+    pair_mask = o_grid > h_grid
+    pair_h, pair_o = h_grid[pair_mask], o_grid[pair_mask]
+    edge_idx = labeled_edge_list[pair_h-1] + (pair_o-pair_h-1)
+    # roi score of the human * roi score of the node * action scores of the edge
+    pair_score = roi_scores[pair_h, None] * roi_scores[pair_o, None] * action_score[edge_idx]
+
+    # one row per (pair, hoi of the object class)
+    obj_labels = np.asarray(roi_labels)[pair_o]
+    hoi_num = OBJ_HOI_NUM[obj_labels]
+    rows = np.repeat(np.arange(len(pair_o)), hoi_num)
+    row_start = np.repeat(np.cumsum(hoi_num) - hoi_num, hoi_num)
+    hoi_idx = np.repeat(OBJ_HOI_START[obj_labels], hoi_num) + np.arange(len(rows)) - row_start
+    score = pair_score[rows, HOI_TO_ACTION[hoi_idx]]
+    hoi_pair_score = np.concatenate((det_boxes[pair_h[rows]], det_boxes[pair_o[rows]], score[:, None]), axis=1)
+
+    # a stable sort keeps the edge order inside every hoi
+    order = np.argsort(hoi_idx, kind='stable')
+    hoi_ids, starts = np.unique(hoi_idx[order], return_index=True)
+    return hoi_ids, np.split(hoi_pair_score[order], starts[1:])
+
+class HoiDetTable():
+    def __init__(self):
+        self.global_ids = []
+        self.global_idx = []
+        self.hoi_id = []
+        self.dets = []
+
+    def add(self, global_id, hoi_ids, hoi_dets):
+        '''
+            hoi_ids: 0-based hoi ids, hoi_dets: for each of them the [human box, object box, score] rows
+        '''
+        idx = len(self.global_ids)
+        self.global_ids.append(global_id)
+        for hoi_idx, hoi_det in zip(hoi_ids, hoi_dets):
+            self.global_idx.append(np.full(hoi_det.shape[0], idx, dtype=np.int32))
+            self.hoi_id.append(np.full(hoi_det.shape[0], hoi_idx+1, dtype=np.int16))
+            self.dets.append(hoi_det)
+
+    def save(self, hdf5_file):
+        global_idx = np.concatenate(self.global_idx) if self.dets else np.zeros(0, dtype=np.int32)
+        hoi_id = np.concatenate(self.hoi_id) if self.dets else np.zeros(0, dtype=np.int16)
+        dets = np.concatenate(self.dets) if self.dets else np.zeros((0, 9))
+        # the rows were added image by image, a stable sort keeps that order inside every hoi
+        order = np.argsort(hoi_id, kind='stable')
+        hoi_offsets = np.searchsorted(hoi_id[order], np.arange(NUM_HOIS+1)+1, side='left')
+        with h5py.File(hdf5_file, 'w') as f:
+            f.attrs['format'] = 'columnar'
+            f.create_dataset('global_ids', data=np.array(self.global_ids, dtype=np.bytes_))
+            f.create_dataset('global_idx', data=global_idx[order])
+            f.create_dataset('hoi_id', data=hoi_id[order])
+            f.create_dataset('human_box', data=dets[order, :4])
+            f.create_dataset('object_box', data=dets[order, 4:8])
+            f.create_dataset('score', data=dets[order, 8])
+            f.create_dataset('hoi_offsets', data=hoi_offsets)
+
+def is_columnar(pred_dets):
+    return pred_dets.attrs.get('format', '') == 'columnar'
+
+def read_hoi_dets(pred_dets, hoi_id, global_ids=None):
+    '''
+        All the detections of one hoi ('001'-'600') with one slice per column,
+        pass the decoded global_ids to avoid reading them again for every hoi
+    '''
+    k = int(hoi_id)
+    start, end = pred_dets['hoi_offsets'][k-1:k+1]
+    if global_ids is None:
+        global_ids = [global_id.decode() for global_id in pred_dets['global_ids'][()]]
+    return {
+        'global_ids': global_ids,
+        'global_idx': pred_dets['global_idx'][start:end],
+        'human_box': pred_dets['human_box'][start:end],
+        'object_box': pred_dets['object_box'][start:end],
+        'score': pred_dets['score'][start:end],
+    }
@@ -0,0 +1,103 @@
+import numpy as np
+import torch
+
+from utils.ap_utils import compute_ap, compute_pr, descending_order
+from result.compute_map import match_hois
+from result.hoi_det_table import NUM_HOIS, expand_hoi_dets
+
+# In-process version of hico_eval.py + result/compute_map.py + result/sample_analysis.py:
+# the detections of every batch are matched to the gt right away and only the score/tp
+# of each detection is kept per hoi, nothing is written to disk.
+
+class HoiMapAccumulator():
+    def __init__(self, gt_dets, bin_to_hoi_ids, max_dets=10000):
+        '''
+                   gt_dets: {global_id: {hoi_id: dets}} as returned by compute_map.load_gt_dets()
+            bin_to_hoi_ids: content of bin_to_hoi_ids.json, bin '10' holds the rare hois
+                  max_dets: only the max_dets best scored detections of a hoi are kept, which bounds
+                            the memory to 2*max_dets detections per hoi, the AP is then computed
+                            without the low score tail
+        '''
+        self.gt_dets = gt_dets
+        self.hoi_ids = [str(k+1).zfill(3) for k in range(NUM_HOIS)]
+        self.rare_hoi_ids = bin_to_hoi_ids['10']
+        self.non_rare_hoi_ids = []
+        for ul, hoi_ids in bin_to_hoi_ids.items():
+            if ul=='10':
+                continue
+            self.non_rare_hoi_ids += hoi_ids
+        if max_dets is None or max_dets <= 0:
+            raise ValueError('max_dets must be a positive number of detections per hoi, got {}'.format(max_dets))
+        self.max_dets = max_dets
+        self.reset()
+
+    def reset(self):
+        # chunks of scores/tp flags per 0-based hoi id, merged in _compact()
+        self.scores = [[] for _ in range(NUM_HOIS)]
+        self.tps = [[] for _ in range(NUM_HOIS)]
+        self.num_dets = np.zeros(NUM_HOIS, dtype=np.int64)
+        self.npos = np.zeros(NUM_HOIS, dtype=np.int64)
+
+    def update(self, batch_outputs, batch_meta):
+        '''
+            batch_outputs: the readout edge logits of the batch from model(..., validation=True)
+               batch_meta: the batch of light_collate_fn(keep_det=True), uses global_id, det_boxes,
+                           roi_scores, roi_labels, node_num and edge_num
+        '''
+        action_scores = torch.sigmoid(batch_outputs.float()).cpu().numpy()
+        edge_start = 0
+        for i, global_id in enumerate(batch_meta['global_id']):
+            edge_num = int(batch_meta['edge_num'][i])
+            self.add_image(global_id, batch_meta['det_boxes'][i], batch_meta['roi_scores'][i], batch_meta['roi_labels'][i], \
+                           batch_meta['node_num'][i], action_scores[edge_start:edge_start+edge_num])
+            edge_start += edge_num
+
+    def add_image(self, global_id, det_boxes, roi_scores, roi_labels, node_num, action_score):
+        image_gt_dets = self.gt_dets.get(global_id, {})
+        for hoi_id, dets in image_gt_dets.items():
+            self.npos[int(hoi_id)-1] += len(dets)
+
+        hoi_idxs, hoi_dets = expand_hoi_dets(det_boxes, roi_scores, roi_labels, node_num, action_score)
+        for hoi_idx, hoi_det in zip(hoi_idxs, hoi_dets):
+            # same order as compute_map.eval_hoi(): by decreasing score inside the image
+            hoi_det = hoi_det[descending_order(hoi_det[:,8])]
+            is_match = match_hois(hoi_det[:,:4], hoi_det[:,4:8], image_gt_dets.get(self.hoi_ids[hoi_idx], []))
+            self.scores[hoi_idx].append(hoi_det[:,8].astype(np.float32))
+            self.tps[hoi_idx].append(is_match)
+            self.num_dets[hoi_idx] += hoi_det.shape[0]
+            if self.num_dets[hoi_idx] > 2*self.max_dets:
+                self._compact(hoi_idx)
+
+    def _compact(self, hoi_idx):
+        scores = np.concatenate(self.scores[hoi_idx]) if self.scores[hoi_idx] else np.zeros(0, dtype=np.float32)
+        tps = np.concatenate(self.tps[hoi_idx]) if self.tps[hoi_idx] else np.zeros(0, dtype=bool)
+        if scores.shape[0] > self.max_dets:
+            # keep the arrival order of the kept detections, compute_pr() breaks the ties with it
+            keep = np.sort(descending_order(scores)[:self.max_dets])
+            scores, tps = scores[keep], tps[keep]
+        self.scores[hoi_idx] = [scores]
+        self.tps[hoi_idx] = [tps]
+        self.num_dets[hoi_idx] = scores.shape[0]
+        return scores, tps
+
+    def compute(self):
+        '''
+            Full/Rare/Non-Rare mAP of the images seen since the last reset(),
+            the hois without any gt in these images (nan AP) are left out of the means
+        '''
+        APs = {}
+        for hoi_idx, hoi_id in enumerate(self.hoi_ids):
+            scores, tps = self._compact(hoi_idx)
+            precision, recall = compute_pr(tps, scores, self.npos[hoi_idx])
+            APs[hoi_id] = compute_ap(precision, recall)
+
+        def _mean(hoi_ids):
+            aps = [APs[hoi_id] for hoi_id in hoi_ids if not np.isnan(APs[hoi_id])]
+            return sum(aps) / len(aps) if aps else np.nan
+
+        return {
+            'AP': APs,
+            'full': _mean(self.hoi_ids),
+            'rare': _mean(self.rare_hoi_ids),
+            'non_rare': _mean(self.non_rare_hoi_ids),
+        }
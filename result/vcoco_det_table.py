@@ -0,0 +1,89 @@
+import h5py
+import numpy as np
+
+from datasets import vcoco_metadata
+
+# Columnar detection_results.hdf5 of vcoco_eval.py (attrs['format'] == 'columnar'), one row per (human, node) pair:
+#     image_ids      [I]       the evaluated images
+#     image_offsets  [I+1]     rows image_offsets[i]:image_offsets[i+1] belong to image_ids[i]
+#     agent_box      [R,4]     'person_box' of the pickled dicts
+#     role_box       [R,4]     box of the other node, the same for every action role
+#     scores         [R,K]     score of each action role, in the order of action_roles
+#     action_roles   [K]       the '{action}_{role}' keys of the pickled dicts
+# instead of a pickled list with one dict per pair.
+
+def _action_roles():
+    '''
+        '{action}_{role}' keys and the index of their action score in the model outputs
+    '''
+    keys, action_idxs = [], []
+    for action in vcoco_metadata.action_class_with_object:
+        if action == 'none':
+            continue
+        action_idxs.append(vcoco_metadata.action_with_obj_index[action])
+        if action == 'cut_with' or action == 'eat_with' or action == 'hit_with':
+            action = action.split('_')[0]
+            role_name = 'instr'
+        else:
+            role_name = vcoco_metadata.action_roles[action][1]
+        keys.append('{}_{}'.format(action, role_name))
+    return keys, np.array(action_idxs)
+
+ACTION_ROLES, ACTION_ROLE_SCORE_IDX = _action_roles()
+
+class VcocoDetTable():
+    def __init__(self, action_roles=ACTION_ROLES):
+        self.action_roles = action_roles
+        self.image_ids = []
+        self.num_rows = []
+        self.agent_box = []
+        self.role_box = []
+        self.scores = []
+
+    def add(self, image_id, agent_boxes, role_boxes, scores):
+        '''
+            scores: [pairs, len(action_roles)]
+        '''
+        self.image_ids.append(image_id)
+        self.num_rows.append(agent_boxes.shape[0])
+        self.agent_box.append(np.asarray(agent_boxes, dtype=np.float32))
+        self.role_box.append(np.asarray(role_boxes, dtype=np.float32))
+        self.scores.append(np.asarray(scores, dtype=np.float32))
+
+    def save(self, hdf5_file):
+        num_roles = len(self.action_roles)
+        with h5py.File(hdf5_file, 'w') as f:
+            f.attrs['format'] = 'columnar'
+            f.create_dataset('image_ids', data=np.array(self.image_ids, dtype=np.int64))
+            f.create_dataset('image_offsets', data=np.concatenate(([0], np.cumsum(self.num_rows, dtype=np.int64))))
+            f.create_dataset('agent_box', data=np.concatenate(self.agent_box) if self.num_rows else np.zeros((0, 4), dtype=np.float32))
+            f.create_dataset('role_box', data=np.concatenate(self.role_box) if self.num_rows else np.zeros((0, 4), dtype=np.float32))
+            f.create_dataset('scores', data=np.concatenate(self.scores) if self.num_rows else np.zeros((0, num_roles), dtype=np.float32))
+            f.create_dataset('action_roles', data=np.array(self.action_roles, dtype=np.bytes_))
+
+class VcocoDets():
+    '''
+        The whole columnar file in memory, the rows of an image are sliced by get()
+    '''
+    def __init__(self, hdf5_file):
+        with h5py.File(hdf5_file, 'r') as f:
+            self.image_offsets = f['image_offsets'][()]
+            self.agent_box = f['agent_box'][()]
+            self.role_box = f['role_box'][()]
+            self.scores = f['scores'][()]
+            self.index = {int(image_id): i for i, image_id in enumerate(f['image_ids'][()])}
+            self.action_role_index = {key.decode(): k for k, key in enumerate(f['action_roles'][()])}
+
+    def get(self, image_id):
+        i = self.index.get(int(image_id))
+        if i is None:
+            start, end = 0, 0
+        else:
+            start, end = self.image_offsets[i:i+2]
+        return self.agent_box[start:end], self.role_box[start:end], self.scores[start:end]
+
+def is_columnar(detections_file):
+    if not h5py.is_hdf5(detections_file):
+        return False
+    with h5py.File(detections_file, 'r') as f:
+        return f.attrs.get('format', '') == 'columnar'
@@ -21,9 +21,11 @@ from pycocotools.coco import COCO
 import os, json
 import copy
 import pickle
-import pdb
 
 import utils.io as io
+from utils.ap_utils import voc_pr, voc_ap
+from result.vcoco_det_table import VcocoDets, is_columnar
+from utils.parallel import run_by_cost
 
 class VCOCOeval(object):
 
@@ -85,7 +87,7 @@ class VCOCOeval(object):
 
   def _prep_vcocodb_entry(self, entry):
     entry['boxes'] = np.empty((0, 4), dtype=np.float32)
-    entry['is_crowd'] = np.empty((0), dtype=np.bool)
+    entry['is_crowd'] = np.empty((0), dtype=bool)
     entry['gt_classes'] = np.empty((0), dtype=np.int32)
     entry['gt_actions'] = np.empty((0, self.num_actions), dtype=np.int32)
     entry['gt_role_id'] = np.empty((0, self.num_actions, 2), dtype=np.int32)
@@ -170,11 +172,12 @@ class VCOCOeval(object):
 
 
   def _collect_detections_for_image(self, dets, image_id):
+    if isinstance(dets, VcocoDets):
+      return self._collect_columnar_detections_for_image(dets, image_id)
     agents = np.empty((0, 4 + self.num_actions), dtype=np.float32)
     roles = np.empty((0, 5 * self.num_actions, 2), dtype=np.float32)
     for det in dets:
       if det['image_id'] == image_id:
-        # import ipdb; ipdb.set_trace()
         this_agent = np.zeros((1, 4 + self.num_actions), dtype=np.float32)
         this_role  = np.zeros((1, 5 * self.num_actions, 2), dtype=np.float32)
         this_agent[0, :4] = det['person_box']
@@ -194,30 +197,54 @@ class VCOCOeval(object):
     return agents, roles
 
 
-  def _do_eval(self, data_const, detections_file, ovr_thresh=0.5):
+  def _collect_columnar_detections_for_image(self, dets, image_id):
+    """Same arrays as _collect_detections_for_image() from the rows of the image in the columnar file"""
+    agent_box, role_box, scores = dets.get(image_id)
+    agents = np.zeros((agent_box.shape[0], 4 + self.num_actions), dtype=np.float32)
+    roles = np.zeros((agent_box.shape[0], 5 * self.num_actions, 2), dtype=np.float32)
+    agents[:, :4] = agent_box
+    for aid in range(self.num_actions):
+      # !NOTE:remove action "point"
+      if aid == 23:
+        continue
+      for j, rid in enumerate(self.roles[aid]):
+        if rid == 'agent':
+          continue
+        roles[:, 5 * aid: 5 * aid + 4, j-1] = role_box
+        roles[:, 5 * aid + 4, j-1] = scores[:, dets.action_role_index[self.actions[aid] + '_' + rid]]
+    return agents, roles
+
+
+  def _do_eval(self, data_const, detections_file, ovr_thresh=0.5, num_workers=1):
     vcocodb = self._get_vcocodb()
     # self._do_agent_eval(vcocodb, detections_file, ovr_thresh=ovr_thresh)
-    self._do_role_eval(data_const, vcocodb, detections_file, ovr_thresh=ovr_thresh, eval_type='scenario_1')
-    self._do_role_eval(data_const, vcocodb, detections_file, ovr_thresh=ovr_thresh, eval_type='scenario_2')
+    # !NOTE: both scenarios are scored in a single pass over vcocodb and the detections
+    self._do_role_eval(data_const, vcocodb, detections_file, ovr_thresh=ovr_thresh, eval_type=['scenario_1', 'scenario_2'], num_workers=num_workers)
 
   
-  def _do_role_eval(self, data_const, vcocodb, detections_file, ovr_thresh=0.5, eval_type='scenario_1'):
-
-    with open(detections_file, 'rb') as f:
-      dets = pickle.load(f)
-
-    tp = [[[] for r in range(2)] for a in range(self.num_actions)]
-    fp = [[[] for r in range(2)] for a in range(self.num_actions)]
-    sc = [[[] for r in range(2)] for a in range(self.num_actions)]
+  def _do_role_eval(self, data_const, vcocodb, detections_file, ovr_thresh=0.5, eval_type='scenario_1', num_workers=1):
+    """eval_type: 'scenario_1', 'scenario_2' or a list of them, scored together
+    num_workers: the actions are scored in parallel, the ones with the most predictions first"""
+    eval_types = [eval_type] if isinstance(eval_type, str) else list(eval_type)
+    for t in eval_types:
+      if t not in ['scenario_1', 'scenario_2']:
+        raise ValueError('Unknown eval type')
+
+    dets = _load_detections(detections_file)
+    # group the detections by image once instead of scanning all of them for every image
+    dets_by_image = {}
+    if not isinstance(dets, VcocoDets):
+      for det in dets:
+        dets_by_image.setdefault(det['image_id'], []).append(det)
 
     npos = np.zeros((self.num_actions), dtype=np.float32)
+    # the gt and the predictions of every image with their matched gt person, shared by all the actions
+    images = []
 
     for i in range(len(vcocodb)):
       image_id = vcocodb[i]['id']
       # get groundtruth person index 
       gt_inds = np.where(vcocodb[i]['gt_classes'] == 1)[0]
-      # if gt_inds.shape[0]>1:
-      #   import ipdb; ipdb.set_trace()
       # person boxes [N, 4]
       gt_boxes = vcocodb[i]['boxes'][gt_inds]
       # action labels [N, 26]
@@ -230,107 +257,95 @@ class VCOCOeval(object):
       for aid in range(self.num_actions):
         npos[aid] += np.sum(gt_actions[:, aid] == 1)
 
-      # print('debuging....')
-      pred_agents, pred_roles = self._collect_detections_for_image(dets, image_id)
+      # the columnar detections are indexed by image already
+      image_dets = dets if isinstance(dets, VcocoDets) else dets_by_image.get(image_id, [])
+      pred_agents, pred_roles = self._collect_detections_for_image(image_dets, image_id)
+      if pred_agents.shape[0] == 0:
+        continue
 
-      for aid in range(self.num_actions):
-        if len(self.roles[aid])<2:
-          # if action has no role, then no role AP computed
+      # matching happens based on the person: [num_pred, num_gt] overlaps, the same for every action and role
+      overlaps = get_overlap(gt_boxes[None, :, :], pred_agents[:, None, :4])
+      images.append({
+        'boxes': vcocodb[i]['boxes'],
+        'gt_boxes': gt_boxes,
+        'gt_actions': gt_actions,
+        'gt_role_id': vcocodb[i]['gt_role_id'][gt_inds],
+        'ignore': ignore,
+        'jmax': overlaps.argmax(axis=1),
+        'ovmax': overlaps.max(axis=1),
+        'pred_roles': pred_roles,
+      })
+
+    # !NOTE: action 'point' is not reported, see below. If action has no role, then no role AP computed
+    aids = [aid for aid in range(self.num_actions) if aid != 23 and len(self.roles[aid]) >= 2]
+    costs = [sum(np.sum(~np.isnan(image['pred_roles'][:, 5 * aid + 4, :len(self.roles[aid])-1])) for image in images) for aid in aids]
+    outputs = run_by_cost(_eval_action_task, [(aid,) for aid in aids], costs, num_workers=num_workers, \
+                          initializer=_init_role_eval_worker, initargs=(self, images, ovr_thresh, eval_types))
+    action_outputs = dict(zip(aids, outputs))
+
+    for t in eval_types:
+      # compute ap for each action
+      role_ap = np.zeros((self.num_actions, 2), dtype=np.float32)
+      role_ap[:] = np.nan
+      for aid in aids:
+        tp, sc = action_outputs[aid]
+        for rid in range(len(self.roles[aid])-1):
+          a_tp = np.concatenate(tp[t][rid]) if tp[t][rid] else np.zeros(0, dtype=np.float32)
+          a_sc = np.concatenate(sc[rid]) if sc[rid] else np.zeros(0, dtype=np.float32)
+          # sort in descending score order, cumsum and rec/prec, see utils/ap_utils.py
+          rec, prec = voc_pr(a_tp, 1 - a_tp, npos[aid], y_score=a_sc)
+          #check
+          assert(rec.size == 0 or np.amax(rec) <= 1)
+          role_ap[aid, rid] = voc_ap(rec, prec)
+      self._report_role_ap(data_const, role_ap, npos, t)
+
+
+  def _eval_action_roles(self, aid, images, ovr_thresh, eval_types):
+    """tp flags (per eval type) and scores of every role of one action, one chunk per image"""
+    # per image chunks, the scores are the same for every eval type and fp = 1 - tp
+    tp = {t: [[] for r in range(2)] for t in eval_types}
+    sc = [[] for r in range(2)]
+    for image in images:
+      jmax = image['jmax']
+      for rid in range(len(self.roles[aid])-1): 
+
+        # get gt roles for action and role
+        gt_role_inds = image['gt_role_id'][:, aid, rid]
+        gt_roles = -np.ones_like(image['gt_boxes'])
+        has_role = gt_role_inds > -1
+        gt_roles[has_role] = image['boxes'][gt_role_inds[has_role]]
+
+        agent_scores = image['pred_roles'][:, 5 * aid + 4, rid]
+        valid = np.where(np.isnan(agent_scores) == False)[0]
+        # same order as sorting the valid scores alone
+        idx = valid[agent_scores[valid].argsort()[::-1]]
+        # if matched with an instance with no annotations, skip the prediction
+        idx = idx[~image['ignore'][jmax[idx]]]
+        if idx.size == 0:
           continue
 
-        for rid in range(len(self.roles[aid])-1): 
-
-          # keep track of detected instances for each action for each role
-          covered = np.zeros((gt_boxes.shape[0]), dtype=np.bool)
-
-          # get gt roles for action and role
-          # import ipdb; ipdb.set_trace()
-          gt_role_inds = vcocodb[i]['gt_role_id'][gt_inds, aid, rid]
-          gt_roles = -np.ones_like(gt_boxes)
-          for j in range(gt_boxes.shape[0]):
-            if gt_role_inds[j] > -1:
-              gt_roles[j] = vcocodb[i]['boxes'][gt_role_inds[j]]
-
-          agent_boxes = pred_agents[:, :4]
-          role_boxes = pred_roles[:, 5 * aid: 5 * aid + 4, rid]
-          agent_scores = pred_roles[:, 5 * aid + 4, rid]
-
-          valid = np.where(np.isnan(agent_scores) == False)[0]
-          agent_scores = agent_scores[valid]
-          agent_boxes = agent_boxes[valid, :]
-          role_boxes = role_boxes[valid, :]
-
-          idx = agent_scores.argsort()[::-1]
-
-          for j in idx:
-            pred_box = agent_boxes[j, :]
-            overlaps = get_overlap(gt_boxes, pred_box)
-
-            # matching happens based on the person 
-            jmax = overlaps.argmax()
-            ovmax = overlaps.max()
-
-            # if matched with an instance with no annotations
-            # continue
-            if ignore[jmax]:
-              continue
-
-            # overlap between predicted role and gt role
-            if np.all(gt_roles[jmax, :] == -1): # if no gt role
-              if eval_type == 'scenario_1':
-                if np.all(role_boxes[j, :] == 0.0) or np.all(np.isnan(role_boxes[j, :])):
-                  # if no role is predicted, mark it as correct role overlap
-                  ov_role = 1.0
-                else:
-                  # if a role is predicted, mark it as false 
-                  ov_role = 0.0
-              elif eval_type == 'scenario_2':
-                # if no gt role, role prediction is always correct, irrespective of the actual predition
-                ov_role = 1.0   
-              else:
-                raise ValueError('Unknown eval type')    
-            else:
-              ov_role = get_overlap(gt_roles[jmax, :].reshape((1, 4)), role_boxes[j, :])
-
-            is_true_action = (gt_actions[jmax, aid] == 1)
-            sc[aid][rid].append(agent_scores[j])
-            if is_true_action and (ovmax>=ovr_thresh) and (ov_role>=ovr_thresh):
-              if covered[jmax]:
-                fp[aid][rid].append(1)
-                tp[aid][rid].append(0)
-              else:
-                fp[aid][rid].append(0)
-                tp[aid][rid].append(1)
-                covered[jmax] = True
-            else:
-              fp[aid][rid].append(1)
-              tp[aid][rid].append(0)
+        pred_gt = jmax[idx]
+        role_boxes = image['pred_roles'][idx, 5 * aid: 5 * aid + 4, rid]
+        # overlap between predicted role and gt role
+        with np.errstate(invalid='ignore', divide='ignore'):
+          ov_role = get_overlap(gt_roles[pred_gt], role_boxes)
+        no_gt_role = np.all(gt_roles[pred_gt] == -1, axis=1)
+        # if no role is predicted, mark it as correct role overlap in scenario 1
+        no_role_pred = np.logical_or(np.all(role_boxes == 0.0, axis=1), np.all(np.isnan(role_boxes), axis=1))
+        is_true_action = np.logical_and(image['gt_actions'][pred_gt, aid] == 1, image['ovmax'][idx] >= ovr_thresh)
+
+        sc[rid].append(agent_scores[idx])
+        for t in eval_types:
+          if t == 'scenario_1':
+            ov_role_t = np.where(no_gt_role, no_role_pred.astype(np.float32), ov_role)
+          else:
+            # if no gt role, role prediction is always correct, irrespective of the actual predition
+            ov_role_t = np.where(no_gt_role, 1.0, ov_role)
+          tp[t][rid].append(_greedy_tp(np.logical_and(is_true_action, ov_role_t >= ovr_thresh), pred_gt))
+    return tp, sc
 
-    # compute ap for each action
-    role_ap = np.zeros((self.num_actions, 2), dtype=np.float32)
-    role_ap[:] = np.nan
-    for aid in range(self.num_actions):
-      # !NOTE: remove action 'point'
-      if aid == 23 or len(self.roles[aid])<2:
-        continue
-      for rid in range(len(self.roles[aid])-1):
-        a_fp = np.array(fp[aid][rid], dtype=np.float32)
-        a_tp = np.array(tp[aid][rid], dtype=np.float32)
-        a_sc = np.array(sc[aid][rid], dtype=np.float32)
-        # sort in descending score order
-        idx = a_sc.argsort()[::-1]
-        a_fp = a_fp[idx]
-        a_tp = a_tp[idx]
-        a_sc = a_sc[idx]
-
-        a_fp = np.cumsum(a_fp)
-        a_tp = np.cumsum(a_tp)
-        rec = a_tp / float(npos[aid])
-        #check
-        assert(np.amax(rec) <= 1)
-        prec = a_tp / np.maximum(a_tp + a_fp, np.finfo(np.float64).eps)
-        role_ap[aid, rid] = voc_ap(rec, prec)
 
+  def _report_role_ap(self, data_const, role_ap, npos, eval_type):
     # !NOTE: save ap/mAP
     result = {'ap': {}, 'mAP': 0}
     save_file = os.path.join(data_const.result_dir, f'mAP_{eval_type}.json')
@@ -351,8 +366,7 @@ class VCOCOeval(object):
 
   def _do_agent_eval(self, vcocodb, detections_file, ovr_thresh=0.5):
 
-    with open(detections_file, 'rb') as f:
-      dets = pickle.load(f)
+    dets = _load_detections(detections_file)
 
     tp = [[] for a in range(self.num_actions)]
     fp = [[] for a in range(self.num_actions)]
@@ -378,7 +392,7 @@ class VCOCOeval(object):
       for aid in range(self.num_actions):
 
         # keep track of detected instances for each action
-        covered = np.zeros((gt_boxes.shape[0]), dtype=np.bool)
+        covered = np.zeros((gt_boxes.shape[0]), dtype=bool)
 
         agent_scores = pred_agents[:, 4 + aid]
         agent_boxes = pred_agents[:, :4]
@@ -422,21 +436,10 @@ class VCOCOeval(object):
     agent_ap = np.zeros((self.num_actions), dtype=np.float32)
     for aid in range(self.num_actions):
 
-      a_fp = np.array(fp[aid], dtype=np.float32)
-      a_tp = np.array(tp[aid], dtype=np.float32)
-      a_sc = np.array(sc[aid], dtype=np.float32)
-      # sort in descending score order
-      idx = a_sc.argsort()[::-1]
-      a_fp = a_fp[idx]
-      a_tp = a_tp[idx]
-      a_sc = a_sc[idx]
-
-      a_fp = np.cumsum(a_fp)
-      a_tp = np.cumsum(a_tp)
-      rec = a_tp / float(npos[aid])
+      # sort in descending score order, cumsum and rec/prec, see utils/ap_utils.py
+      rec, prec = voc_pr(tp[aid], fp[aid], npos[aid], y_score=sc[aid])
       #check
       assert(np.amax(rec) <= 1)
-      prec = a_tp / np.maximum(a_tp + a_fp, np.finfo(np.float64).eps)
       agent_ap[aid] = voc_ap(rec, prec)
 
     print('---------Reporting Agent AP (%)------------------')
@@ -446,6 +449,29 @@ class VCOCOeval(object):
     print('---------------------------------------------')
 
 
+# set once in every worker by _init_role_eval_worker(), the tasks only carry the action id
+_role_eval_state = {}
+
+def _init_role_eval_worker(vcoco_eval, images, ovr_thresh, eval_types):
+  _role_eval_state['vcoco_eval'] = vcoco_eval
+  _role_eval_state['images'] = images
+  _role_eval_state['ovr_thresh'] = ovr_thresh
+  _role_eval_state['eval_types'] = eval_types
+
+
+def _eval_action_task(aid):
+  return _role_eval_state['vcoco_eval']._eval_action_roles(
+      aid, _role_eval_state['images'], _role_eval_state['ovr_thresh'], _role_eval_state['eval_types'])
+
+
+def _load_detections(detections_file):
+  # columnar detection_results.hdf5 of vcoco_eval.py, or the pickled list of dicts
+  if is_columnar(detections_file):
+    return VcocoDets(detections_file)
+  with open(detections_file, 'rb') as f:
+    return pickle.load(f)
+
+
 def _load_vcoco(vcoco_file):
   print('loading vcoco annotations...')
   with open(vcoco_file, 'r') as f:
@@ -467,42 +493,28 @@ def clip_xyxy_to_image(x1, y1, x2, y2, height, width):
 
 
 def get_overlap(boxes, ref_box):
-  ixmin = np.maximum(boxes[:, 0], ref_box[0])
-  iymin = np.maximum(boxes[:, 1], ref_box[1])
-  ixmax = np.minimum(boxes[:, 2], ref_box[2])
-  iymax = np.minimum(boxes[:, 3], ref_box[3])
+  """overlaps of boxes [..., 4] with ref_box [..., 4], broadcast against each other"""
+  ixmin = np.maximum(boxes[..., 0], ref_box[..., 0])
+  iymin = np.maximum(boxes[..., 1], ref_box[..., 1])
+  ixmax = np.minimum(boxes[..., 2], ref_box[..., 2])
+  iymax = np.minimum(boxes[..., 3], ref_box[..., 3])
   iw = np.maximum(ixmax - ixmin + 1., 0.)
   ih = np.maximum(iymax - iymin + 1., 0.)
   inters = iw * ih
 
   # union
-  uni = ((ref_box[2] - ref_box[0] + 1.) * (ref_box[3] - ref_box[1] + 1.) +
-         (boxes[:, 2] - boxes[:, 0] + 1.) *
-         (boxes[:, 3] - boxes[:, 1] + 1.) - inters)
+  uni = ((ref_box[..., 2] - ref_box[..., 0] + 1.) * (ref_box[..., 3] - ref_box[..., 1] + 1.) +
+         (boxes[..., 2] - boxes[..., 0] + 1.) *
+         (boxes[..., 3] - boxes[..., 1] + 1.) - inters)
 
   overlaps = inters / uni
   return overlaps
 
 
-def voc_ap(rec, prec):
-  """ ap = voc_ap(rec, prec)
-  Compute VOC AP given precision and recall.
-  [as defined in PASCAL VOC]
-  """
-  # correct AP calculation
-  # first append sentinel values at the end
-  mrec = np.concatenate(([0.], rec, [1.]))
-  mpre = np.concatenate(([0.], prec, [0.]))
-
-  # compute the precision envelope
-  for i in range(mpre.size - 1, 0, -1):
-      mpre[i - 1] = np.maximum(mpre[i - 1], mpre[i])
-
-  # to calculate area under PR curve, look for points
-  # where X axis (recall) changes value
-  i = np.where(mrec[1:] != mrec[:-1])[0]
-
-  # and sum (\Delta recall) * prec
-  ap = np.sum((mrec[i + 1] - mrec[i]) * mpre[i + 1])
-  return ap
-
+def _greedy_tp(is_match, gt_ids):
+  """tp flags of predictions in score order: only the first match of each gt instance is a tp"""
+  tp = np.zeros((is_match.shape[0]), dtype=np.float32)
+  match_inds = np.where(is_match)[0]
+  _, first = np.unique(gt_ids[match_inds], return_index=True)
+  tp[match_inds[first]] = 1
+  return tp
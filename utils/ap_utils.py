@@ -0,0 +1,103 @@
+import numpy as np
+
+# Precision/recall and AP as array operations, shared by the HICO-DET (result/compute_map.py)
+# and the V-COCO (result/vsrl_eval.py) evaluation.
+
+def descending_order(y_score, stable=True):
+    '''
+        Indices sorting y_score in decreasing order. With stable=True equal scores keep their
+        order, like sorted(..., reverse=True); stable=False is the argsort()[::-1] of vsrl_eval.py
+    '''
+    y_score = np.asarray(y_score)
+    if stable:
+        return np.argsort(-y_score, kind='stable')
+    return y_score.argsort()[::-1]
+
+
+def compute_pr(y_true, y_score, npos):
+    '''
+        Precision and recall after each detection, in decreasing score order
+    '''
+    order = descending_order(y_score)
+    tp = np.asarray(y_true, dtype=bool)[order]
+    fp = ~tp
+    tp = np.cumsum(tp)
+    fp = np.cumsum(fp)
+    if npos==0:
+        recall = np.nan*tp
+    else:
+        recall = tp / npos
+    precision = tp / (tp + fp)
+    return precision, recall
+
+
+def compute_normalized_pr(y_true, y_score, npos, N=196.45):
+    order = descending_order(y_score)
+    sorted_y_true = np.asarray(y_true, dtype=bool)[order]
+    tp = np.cumsum(sorted_y_true)
+    fp = np.cumsum(~sorted_y_true)
+    if npos==0:
+        recall = np.nan*tp
+    else:
+        recall = tp / npos
+    precision = recall*N / (recall*N + fp)
+    nap = np.sum(precision[sorted_y_true]) / (npos+1e-6)
+    return precision, recall, nap
+
+
+def compute_ap(precision, recall):
+    '''
+        11-point interpolated AP, recall must be non-decreasing (as returned by compute_pr)
+    '''
+    if np.any(np.isnan(recall)):
+        return np.nan
+
+    precision = np.asarray(precision)
+    recall = np.asarray(recall)
+    thresholds = np.arange(0,1.1,0.1) # 0, 0.1, 0.2, ..., 1.0
+    # the best precision at recall >= t is a suffix maximum starting at the first such detection
+    max_precision = np.maximum.accumulate(precision[::-1])[::-1]
+    first_ids = np.searchsorted(recall, thresholds, side='left')
+    ap = 0
+    for i in first_ids:
+        p = max_precision[i] if i < max_precision.size else 0
+        ap += p/11.
+
+    return ap
+
+
+def voc_pr(tp, fp, npos, y_score=None, stable=False):
+    '''
+        Recall/precision of the tp/fp flags as in vsrl_eval.py, sorted by y_score first if given
+    '''
+    tp = np.asarray(tp, dtype=np.float32)
+    fp = np.asarray(fp, dtype=np.float32)
+    if y_score is not None:
+        order = descending_order(np.asarray(y_score, dtype=np.float32), stable=stable)
+        tp = tp[order]
+        fp = fp[order]
+    fp = np.cumsum(fp)
+    tp = np.cumsum(tp)
+    rec = tp / float(npos)
+    prec = tp / np.maximum(tp + fp, np.finfo(np.float64).eps)
+    return rec, prec
+
+
+def voc_ap(rec, prec):
+    '''
+        VOC AP: area under the precision envelope
+    '''
+    # first append sentinel values at the end
+    mrec = np.concatenate(([0.], rec, [1.]))
+    mpre = np.concatenate(([0.], prec, [0.]))
+
+    # compute the precision envelope
+    mpre = np.maximum.accumulate(mpre[::-1])[::-1]
+
+    # to calculate area under PR curve, look for points
+    # where X axis (recall) changes value
+    i = np.where(mrec[1:] != mrec[:-1])[0]
+
+    # and sum (\Delta recall) * prec
+    ap = np.sum((mrec[i + 1] - mrec[i]) * mpre[i + 1])
+    return ap
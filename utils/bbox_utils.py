@@ -79,8 +79,30 @@ def compute_iou_batch(bbox1,bbox2,verbose=False):
     if verbose:
         return iou, intersection, union
 
-    return iou 
-    
+    return iou
+
+
+def compute_iou_matrix(bbox1,bbox2):
+    '''
+    IoU of every box in bbox1 [M,4] with every box in bbox2 [N,4], returns [M,N].
+    Same convention as compute_iou(): areas count the border pixel and empty intersections are 0
+    '''
+    bbox1 = np.asarray(bbox1,dtype=np.float64).reshape(-1,4)
+    bbox2 = np.asarray(bbox2,dtype=np.float64).reshape(-1,4)
+    x1_in = np.maximum(bbox1[:,None,0],bbox2[None,:,0])
+    y1_in = np.maximum(bbox1[:,None,1],bbox2[None,:,1])
+    x2_in = np.minimum(bbox1[:,None,2],bbox2[None,:,2])
+    y2_in = np.minimum(bbox1[:,None,3],bbox2[None,:,3])
+
+    valid_mask = np.logical_and(x2_in > x1_in, y2_in > y1_in)
+    intersection = np.where(valid_mask, (x2_in - x1_in + 1) * (y2_in - y1_in + 1), 0.)
+    area1 = compute_area_batch(bbox1)
+    area2 = compute_area_batch(bbox2)
+    union = area1[:,None] + area2[None,:] - intersection
+    iou = intersection / (union + 1e-6)
+
+    return iou
+
 
 def vis_bbox(bbox,img,color=(0,0,0),modify=False):
     im_h,im_w = img.shape[0:2]
@@ -53,10 +53,12 @@ class GeneralizedRCNN(nn.Module):
         proposals, proposal_losses = self.rpn(images, features, targets)
         detections, detector_losses = self.roi_heads(features, proposals, images.image_sizes, targets, save_feat=save_feat)
         if save_feat:
-            detections[0]['boxes'] = detections[0]['boxes'].reshape(-1, 4)
-            detection = self.transform.postprocess(detections, images.image_sizes, original_image_sizes)
-            detection[0]['boxes'] = detection[0]['boxes'].reshape(-1, 81*4)
-            return detection
+            for detection in detections:
+                detection['boxes'] = detection['boxes'].reshape(-1, 4)
+            detections = self.transform.postprocess(detections, images.image_sizes, original_image_sizes)
+            for detection in detections:
+                detection['boxes'] = detection['boxes'].reshape(-1, 81*4)
+            return detections
         else:
             bbox_wst_processed_img = detections[0]['boxes'][:]
             detections = self.transform.postprocess(detections, images.image_sizes, original_image_sizes)
@@ -4,6 +4,7 @@ import json
 import yaml
 import numpy as np
 import gzip
+import hashlib
 import scipy.io
 
 def load_pickle_object(file_name, compress=True):
@@ -45,6 +46,17 @@ def dumps_json_object(dump_object, indent=4):
     return data
 
 
+def content_hash(file_name, chunk_size=1<<24):
+    '''
+        sha1 of the file content, used to rebuild the caches of annotation files when they change
+    '''
+    sha1 = hashlib.sha1()
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
 def load_mat_object(file_name):
     return scipy.io.loadmat(file_name=file_name)
 
@@ -53,6 +65,42 @@ def load_yaml_object(file_name):
     return yaml.load(read(file_name, 'r'))
 
 
+def to_storage_dtype(array, dtype='float32'):
+    '''
+        Convert a feature array to the dtype used on disk: 'float32', 'float16' or 'bfloat16'.
+        numpy/h5py have no bfloat16, so it is kept as the upper 16 bits of float32 in uint16.
+    '''
+    if dtype == 'bfloat16':
+        bits = np.ascontiguousarray(array, dtype=np.float32).view(np.uint32).astype(np.uint64)
+        # round to nearest even before dropping the lower 16 bits
+        bits = (bits + 0x7FFF + ((bits >> 16) & 1)) >> 16
+        return bits.astype(np.uint16)
+    return np.asarray(array, dtype=dtype)
+
+
+def from_storage_dtype(array, dtype='float32', upcast=True):
+    '''
+        Inverse of to_storage_dtype(). bfloat16 is always upcast to float32, float16 is kept
+        as it is if upcast is False (e.g. to feed a half-precision model directly).
+    '''
+    if dtype == 'bfloat16':
+        return (np.asarray(array, dtype=np.uint32) << 16).view(np.float32)
+    if dtype == 'float16' and not upcast:
+        return array
+    return np.asarray(array, dtype=np.float32)
+
+
+def read_rows(dataset, row_ids):
+    '''
+        Gather dataset[row_ids] with a single read. h5py only accepts strictly increasing
+        indices, so the unique sorted rows are read once and put back in the requested order.
+    '''
+    row_ids = np.asarray(row_ids).astype(np.int64)
+    unique_ids, inverse = np.unique(row_ids, return_inverse=True)
+    rows = dataset[unique_ids.tolist()] if len(unique_ids) else dataset[0:0]
+    return rows[inverse.reshape(-1)]
+
+
 def read(file_name, mode='rb'):
     with open(file_name, mode) as f:
         return f.read()
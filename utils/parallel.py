@@ -0,0 +1,87 @@
+import os
+import h5py
+from functools import partial
+from multiprocessing import Pool
+from tqdm import tqdm
+
+def _run_task(compute_fn, task):
+    global_id, args = task
+    return global_id, compute_fn(*args)
+
+def load_done_ids(done_file):
+    if not os.path.exists(done_file):
+        return set()
+    with open(done_file, 'r') as f:
+        return set(line.strip() for line in f if line.strip())
+
+def run_per_image(compute_fn, tasks, save_fn, hdf5_file, num_workers=1, resume=True, chunksize=4):
+    '''
+    Compute the per-image results in a process pool and write them to one hdf5 file from the main process.
+    The finished global_ids are appended to <hdf5_file>.done after each write, so a rerun skips them.
+    Args:
+        compute_fn: picklable function, compute_fn(*args) is run in the workers
+             tasks: a list of (global_id, args)
+           save_fn: save_fn(hdf5, global_id, result), run in the main process
+         hdf5_file: the output file, opened in 'a' mode when resuming
+       num_workers: number of worker processes, 1 to run everything in the main process
+            resume: skip the global_ids recorded in <hdf5_file>.done
+    '''
+    done_file = hdf5_file + '.done'
+    done_ids = load_done_ids(done_file) if resume and os.path.exists(hdf5_file) else set()
+    if done_ids:
+        print(f'Resuming {hdf5_file}, {len(done_ids)} images have been finished')
+        hdf5 = h5py.File(hdf5_file, 'a')
+    else:
+        hdf5 = h5py.File(hdf5_file, 'w')
+        open(done_file, 'w').close()
+    tasks = [task for task in tasks if task[0] not in done_ids]
+
+    run_task = partial(_run_task, compute_fn)
+    pool = Pool(num_workers) if num_workers > 1 else None
+    results = pool.imap_unordered(run_task, tasks, chunksize) if pool else map(run_task, tasks)
+    try:
+        with open(done_file, 'a') as done_f:
+            for global_id, result in tqdm(results, total=len(tasks)):
+                # !NOTE: the group may have been partly written before a crash
+                if global_id in hdf5:
+                    del hdf5[global_id]
+                save_fn(hdf5, global_id, result)
+                hdf5.flush()
+                done_f.write(global_id + '\n')
+                done_f.flush()
+    finally:
+        if pool:
+            pool.terminate()
+        hdf5.close()
+
+def _run_indexed_task(compute_fn, task):
+    idx, args = task
+    return idx, compute_fn(*args)
+
+def run_by_cost(compute_fn, tasks, costs, num_workers=1, initializer=None, initargs=()):
+    '''
+    Run the tasks in a process pool, the most expensive first and handed out one at a time
+    (imap_unordered with chunksize 1), so a few big tasks do not end up together in a static chunk.
+    Args:
+        compute_fn: picklable function, compute_fn(*args) is run in the workers
+             tasks: a list of args
+             costs: estimated cost of each task, e.g. its number of predictions
+       num_workers: number of worker processes, 1 to run everything in the main process
+       initializer: run once in every worker (or in the main process) with initargs
+    Returns the results in the order of tasks.
+    '''
+    # sorted() is stable, the tasks of the same cost keep their order
+    order = sorted(range(len(tasks)), key=lambda idx: costs[idx], reverse=True)
+    indexed_tasks = [(idx, tasks[idx]) for idx in order]
+    run_task = partial(_run_indexed_task, compute_fn)
+    results = [None] * len(tasks)
+    if num_workers > 1:
+        with Pool(num_workers, initializer=initializer, initargs=initargs) as pool:
+            for idx, result in tqdm(pool.imap_unordered(run_task, indexed_tasks, 1), total=len(tasks)):
+                results[idx] = result
+    else:
+        if initializer is not None:
+            initializer(*initargs)
+        for idx, result in map(run_task, indexed_tasks):
+            results[idx] = result
+    return results
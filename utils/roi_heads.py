@@ -11,6 +11,35 @@ import ipdb
 
 from . import _utils as det_utils
 
+# the N/A categories of the 91-way torchvision COCO predictor, removed to keep the 81 classes of metadata.coco_classes
+COCO_NA_IDS = [12, 26, 29, 30, 45, 66, 68, 69, 71, 83]
+COCO_VALID_IDS = torch.tensor([i for i in range(91) if i not in COCO_NA_IDS])
+
+def per_class_nms(boxes, scores, nms_thresh):
+    """
+    NMS of every class with a single batched_nms call.
+
+    Arguments:
+        boxes (Tensor[N, C, 4])
+        scores (Tensor[N, C])
+
+    Returns:
+        nms_keep_indices (list[list[int]]): the kept box ids of each class, in decreasing score order
+    """
+    num_boxes, num_classes = scores.shape
+    # entry k of the class-major flattening is box k % N of class k // N
+    flat_boxes = boxes.transpose(0, 1).reshape(-1, 4)
+    flat_scores = scores.t().reshape(-1)
+    labels = torch.arange(num_classes, device=scores.device).repeat_interleave(num_boxes)
+    keep = box_ops.batched_nms(flat_boxes, flat_scores, labels, nms_thresh).cpu().numpy()
+
+    keep_cls, keep_ids = keep // max(num_boxes, 1), keep % max(num_boxes, 1)
+    # a stable sort keeps the score order inside each class
+    order = np.argsort(keep_cls, kind='stable')
+    split = np.cumsum(np.bincount(keep_cls, minlength=num_classes))[:-1]
+    return [ids.tolist() for ids in np.split(keep_ids[order], split)]
+
+
 def fastrcnn_loss(class_logits, box_regression, labels, regression_targets):
     """
     Computes the loss for Faster R-CNN.
@@ -481,26 +510,21 @@ class RoIHeads(torch.nn.Module):
         all_boxes = []
         all_scores = []
         all_labels = []
+        if save_feat:
+            valid_cls = COCO_VALID_IDS.to(device)
         
         for boxes, scores, image_shape in zip(pred_boxes, pred_scores, image_shapes):
             boxes = box_ops.clip_boxes_to_image(boxes, image_shape)
 
             if save_feat:
                 # delete N/A 
-                boxes =  np.delete(boxes.cpu().detach().numpy(), [12, 26, 29, 30, 45, 66, 68, 69, 71, 83], axis=1)
-                scores =  np.delete(scores.cpu().detach().numpy(), [12, 26, 29, 30, 45, 66, 68, 69, 71, 83], axis=1)
-
-                boxes = torch.from_numpy(boxes).cuda()
-                scores = torch.from_numpy(scores).cuda()
-                # ipdb.set_trace()
-                nms_keep_indices = [None] * 81
-                for cls_ind in range(81):
-                    cls_boxes = boxes[:, cls_ind]
-                    cls_scores = scores[:, cls_ind]
-                    keep = box_ops.nms(cls_boxes, cls_scores, self.nms_thresh)
-                    nms_keep_indices[cls_ind] = keep.cpu().numpy().tolist()
-                
-                return [boxes], [scores], [nms_keep_indices]
+                boxes = boxes[:, valid_cls]
+                scores = scores[:, valid_cls]
+                nms_keep_indices = per_class_nms(boxes, scores, self.nms_thresh)
+
+                all_boxes.append(boxes)
+                all_scores.append(scores)
+                all_labels.append(nms_keep_indices)
 
             else:
                 # create labels for each prediction
@@ -557,14 +581,18 @@ class RoIHeads(torch.nn.Module):
         else:
             boxes, scores, labels = self.postprocess_detections(class_logits, box_regression, proposals, image_shapes, save_feat)
             num_images = len(boxes)
+            # the features of each image in the batch
+            boxes_per_image = [len(boxes_in_image) for boxes_in_image in proposals]
+            fc7_feats = box_features.split(boxes_per_image, 0)
+            pool_feats = pool_features.split(boxes_per_image, 0)
             for i in range(num_images):
                 result.append(
                     dict(
                         boxes=boxes[i],
                         labels=labels[i],
                         scores=scores[i],
-                        fc7_feat=box_features,
-                        pool_feat=pool_features
+                        fc7_feat=fc7_feats[i],
+                        pool_feat=pool_feats[i]
                     )
                 )
 
@@ -16,11 +16,12 @@ import torchvision
 from torch.utils.data import DataLoader
 
 from model.vcoco_model import AGRNN
-from datasets.vcoco.vsrl_eval import VCOCOeval
+from result.vsrl_eval import VCOCOeval
 from datasets.vcoco_constants import VcocoConstants
 from datasets.vcoco_dataset import VcocoDataset, collate_fn
 from datasets import vcoco_metadata
 import utils.io as io
+from result.vcoco_det_table import VcocoDetTable, ACTION_ROLE_SCORE_IDX
 
 def main(args):
 
@@ -50,12 +51,18 @@ def main(args):
         sys.exit(1)
 
     io.mkdir_if_not_exists(data_const.result_dir)
-    det_save_file = os.path.join(data_const.result_dir, 'detection_results.pkl')
+    if args.det_format == 'pickle':
+        det_save_file = os.path.join(data_const.result_dir, 'detection_results.pkl')
+    else:
+        det_save_file = os.path.join(data_const.result_dir, 'detection_results.hdf5')
     if not os.path.isfile(det_save_file) or args.rewrite:
         test_dataset = VcocoDataset(data_const=data_const, subset='vcoco_test')
         test_dataloader = DataLoader(dataset=test_dataset, batch_size=1, shuffle=False, collate_fn=collate_fn)
         # save detection result
-        det_data_list = []
+        if args.det_format == 'pickle':
+            det_data_list = []
+        else:
+            det_table = VcocoDetTable()
         # for global_id in tqdm(test_list): 
         for data in tqdm(test_dataloader):
             train_data = data
@@ -78,6 +85,15 @@ def main(args):
             attn_lang = attn_lang.cpu().detach().numpy()
 
             h_idxs = np.where(roi_labels == 1)[0]
+            if args.det_format == 'columnar':
+                # all the (human, node) pairs, ordered by human then node as in the loops below
+                h_grid, o_grid = np.meshgrid(h_idxs, np.arange(node_num[0]), indexing='ij')
+                pair_mask = o_grid != h_grid
+                pair_h, pair_o = h_grid[pair_mask], o_grid[pair_mask]
+                edge_idx = pair_h * (node_num[0] - 1) + pair_o - (pair_o > pair_h)
+                score = roi_scores[pair_h, None] * roi_scores[pair_o, None] * action_scores[edge_idx]
+                det_table.add(global_id, det_boxes[pair_h], det_boxes[pair_o], score[:, ACTION_ROLE_SCORE_IDX])
+                continue
             # import ipdb; ipdb.set_trace()
             for h_idx in h_idxs:
                 for i_idx in range(node_num[0]):
@@ -111,12 +127,15 @@ def main(args):
                     
                     det_data_list.append(single_result)
         # save all detected results
-        pickle.dump(det_data_list, open(det_save_file,'wb'))
+        if args.det_format == 'pickle':
+            pickle.dump(det_data_list, open(det_save_file,'wb'))
+        else:
+            det_table.save(det_save_file)
     # evaluate
     vcocoeval = VCOCOeval(os.path.join(data_const.original_data_dir, 'data/vcoco/vcoco_test.json'),
                           os.path.join(data_const.original_data_dir, 'data/instances_vcoco_all_2014.json'),
                           os.path.join(data_const.original_data_dir, 'data/splits/vcoco_test.ids'))
-    vcocoeval._do_eval(data_const, det_save_file, ovr_thresh=0.5)
+    vcocoeval._do_eval(data_const, det_save_file, ovr_thresh=0.5, num_workers=args.num_processes)
 
 def str2bool(arg):
     arg = arg.lower()
@@ -147,6 +166,12 @@ if __name__ == "__main__":
     parser.add_argument('--rewrite', '-r', action='store_true', default=False,
                         help='overwrite the detection file')
 
+    parser.add_argument('--det_format', type=str, default='columnar', choices=['columnar', 'pickle'],
+                        help='detection file, per-pair arrays in hdf5 (columnar) or a pickled list of dicts: columnar')
+
+    parser.add_argument('--num_processes', type=int, default=1,
+                        help='number of processes scoring the actions, the ones with the most predictions first: 1')
+
     args = parser.parse_args()
     # data_const = HicoConstants(feat_type=args.feat_type, exp_ver=args.exp_ver)
     # inferencing
@@ -26,6 +26,8 @@ from datasets import vcoco_metadata
 from utils.vis_tool import vis_img_vcoco
 from datasets.vcoco_constants import VcocoConstants
 from datasets.vcoco_dataset import VcocoDataset, collate_fn
+from datasets.bucket_sampler import BucketBatchSampler
+from datasets.prefetcher import DataPrefetcher
 
 ###########################################################################################
 #                                     TRAIN/TEST MODEL                                    #
@@ -38,7 +40,12 @@ def run_model(args, data_const):
     dataset = {'train': train_dataset, 'val': val_dataset}
     print('set up dataset variable successfully')
     # use default DataLoader() to load the data. 
-    train_dataloader = DataLoader(dataset=dataset['train'], batch_size=args.batch_size, shuffle=True, collate_fn=collate_fn)
+    if args.bucket_budget:
+        # group images with similar node numbers and fill each batch up to the node/edge budget
+        train_sampler = BucketBatchSampler(dataset['train'].get_node_nums(), args.bucket_budget, budget_type=args.bucket_type)
+        train_dataloader = DataLoader(dataset=dataset['train'], batch_sampler=train_sampler, collate_fn=collate_fn)
+    else:
+        train_dataloader = DataLoader(dataset=dataset['train'], batch_size=args.batch_size, shuffle=True, collate_fn=collate_fn)
     val_dataloader = DataLoader(dataset=dataset['val'], batch_size=args.batch_size, shuffle=True, collate_fn=collate_fn)
     dataloader = {'train': train_dataloader, 'val': val_dataloader}
     print('set up dataloader successfully')
@@ -124,7 +131,9 @@ def epoch_train(model, dataloader, dataset, criterion, optimizer, scheduler, dev
             idx = 0
             
             VcocoDataset.data_sample_count=0
-            for data in tqdm(dataloader[phase]): 
+            # stage the next batches on the device in the background
+            batches = DataPrefetcher(dataloader[phase], device) if args.prefetch else dataloader[phase]
+            for data in tqdm(batches): 
                 train_data = data
                 # img_name = train_data['img_name']
                 # det_boxes = train_data['det_boxes']
@@ -136,6 +145,7 @@ def epoch_train(model, dataloader, dataset, criterion, optimizer, scheduler, dev
                 features = train_data['features']
                 spatial_feat = train_data['spatial_feat']
                 word2vec = train_data['word2vec']
+                # !NOTE: no-op if the batch has been staged by DataPrefetcher
                 features, spatial_feat, word2vec, edge_labels = features.to(device), spatial_feat.to(device), word2vec.to(device), edge_labels.to(device)
                 # if idx == 10: break    
                 if phase == 'train':
@@ -287,6 +297,15 @@ parser.add_argument('--sampler',  type=float, default=0,
 parser.add_argument('--hico',  type=str, default=None,
                     help='location of the pretrained model of HICO_DET dataset: None')
 
+parser.add_argument('--bucket_budget', type=int, default=0,
+                    help='if set, build training batches by node number under this budget instead of --batch_size: 0')
+
+parser.add_argument('--bucket_type', type=str, default='edge', choices=['edge', 'node'],
+                    help='count the bucket budget in edges or nodes: edge')
+
+parser.add_argument('--prefetch', type=str2bool, default='false',
+                    help='copy the next batches to the device in a background thread: false')
+
 args = parser.parse_args() 
 
 if __name__ == "__main__":